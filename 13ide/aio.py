@@ -0,0 +1,213 @@
+##
+## asyncio layer for macros
+##
+##   Awaitable versions of caput(wait=True), of waiting for a PV value,
+##   and of waiting for a ScanDB info value, so that independent steps
+##   (gain changes, filter changes, motor moves, detector exposures) can
+##   overlap with asyncio.gather() instead of running one after another.
+##
+##   Async macros are named <macro>_async and must be run with run_async(),
+##   which runs them to completion on an event loop, for example
+##       run_async(move_energy_async(7200), move_stage_async('focus', 1.25))
+##   The plain macros (move_energy, autoset_gain, ...) are thin wrappers
+##   that run their async versions this way, so existing scripts work as
+##   before.  Inside an async macro, await the *_async versions rather than
+##   calling the plain macros.
+##
+##   PV callbacks arrive on CA threads and are passed to the event loop
+##   with call_soon_threadsafe().  Blocking calls (waiting caput()s,
+##   areaDetector configuration, ...) are made with acall(), which runs
+##   them in a worker thread so that the loop keeps running.  Calls that
+##   use ScanDB are made with adb() instead: the ScanDB session is not
+##   thread-safe, so adb() calls hold a lock, and run one at a time.
+
+import asyncio
+import threading
+from time import monotonic as clock
+from epics.ca import CAThread, use_initial_context
+
+def _resolve(future, value):
+    "--private-- set the result of a future, if not already done"
+    if not future.done():
+        future.set_result(value)
+#enddef
+
+def run_async(*coros):
+    """
+    run one or more async macros concurrently, waiting for all of them
+
+    Returns:
+        result of the single coroutine, or a list of results for several
+
+    Example:
+        run_async(move_stage_async('finex', 0.1), autoset_gain_async())
+    """
+    async def _gather():
+        return await asyncio.gather(*coros)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        out = asyncio.run(_gather())
+    else:
+        # called from inside a running loop (as from a function run with
+        # acall()): run a new loop in its own thread
+        result = {}
+        def _run():
+            try:
+                result['out'] = asyncio.run(_gather())
+            except BaseException as exc:
+                result['exc'] = exc
+        #enddef
+        thread = CAThread(target=_run)
+        thread.start()
+        thread.join()
+        if 'exc' in result:
+            raise result['exc']
+        out = result['out']
+    #endtry
+    return out[0] if len(coros) == 1 else out
+#enddef
+
+# serializes ScanDB use by adb() worker threads
+_SCANDB_LOCK = threading.RLock()
+
+def _call_in_context(func, args, kws):
+    "--private-- call a function in a worker thread, with the CA context"
+    use_initial_context()
+    return func(*args, **kws)
+#enddef
+
+def _call_with_scandb(func, args, kws):
+    "--private-- call a function in a worker thread, holding the ScanDB lock"
+    with _SCANDB_LOCK:
+        return _call_in_context(func, args, kws)
+#enddef
+
+async def acall(func, *args, **kws):
+    """
+    awaitable call of a blocking function, run in a worker thread
+
+    Returns:
+        the return value of func(*args, **kws)
+
+    Example:
+        await acall(caput, '13IDE:m1.VAL', 1.0, wait=True)
+    """
+    return await asyncio.to_thread(_call_in_context, func, args, kws)
+#enddef
+
+async def adb(func, *args, **kws):
+    """
+    awaitable call of a blocking function that uses ScanDB, run in a
+    worker thread while holding the ScanDB lock, so that concurrent
+    async macros do not use the ScanDB session at the same time
+
+    Returns:
+        the return value of func(*args, **kws)
+
+    Example:
+        await adb(_scandb.set_info, 'needs_offset', 1)
+
+    Note:
+        func must not call run_async(), whose macros would wait for the lock.
+    """
+    return await asyncio.to_thread(_call_with_scandb, func, args, kws)
+#enddef
+
+async def aget(pvname, as_string=False):
+    "awaitable caget(), using the monitored value of a connected PV"
+    pv = get_pv(pvname)
+    t0 = clock()
+    while not pv.connected and clock()-t0 < 5.0:
+        await asyncio.sleep(0.01)
+    return pv.get(as_string=as_string)
+#enddef
+
+async def aput(pvname, value, wait=True, timeout=60.0):
+    """
+    awaitable caput()
+
+    Parameters:
+        pvname (string): PV name
+        value: value to put
+        wait (True or False): whether to wait for the put to complete [True]
+        timeout (float): maximum time to wait for completion [60]
+
+    Returns:
+        True if the put completed (or wait=False), False on timeout,
+        which callers must check
+    """
+    pv = get_pv(pvname)
+    t0 = clock()
+    while not pv.connected and clock()-t0 < 5.0:
+        await asyncio.sleep(0.01)
+    if not wait:
+        pv.put(value)
+        return True
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    def onComplete(**kws):
+        loop.call_soon_threadsafe(_resolve, done, True)
+    pv.put(value, callback=onComplete)
+    try:
+        return await asyncio.wait_for(done, timeout)
+    except asyncio.TimeoutError:
+        print("#aput: %s did not complete in %.1f seconds" % (pvname, timeout))
+        return False
+#enddef
+
+async def await_pv(pvname, test, timeout=60.0, as_string=False):
+    """
+    wait for a PV to have a value for which test(value) is True
+
+    Parameters:
+        pvname (string): PV name
+        test (callable): function of the value
+        timeout (float): maximum time to wait [60]
+        as_string (True or False): pass the value as a string [False]
+
+    Returns:
+        the value, or None on timeout
+
+    Example:
+        await await_pv('13IDE:m1.DMOV', lambda v: v == 1)
+    """
+    pv = get_pv(pvname)
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    def onChange(value=None, char_value=None, **kws):
+        val = char_value if as_string else value
+        if test(val):
+            loop.call_soon_threadsafe(_resolve, done, val)
+    #enddef
+    cb_index = pv.add_callback(onChange)
+    try:
+        value = await aget(pvname, as_string=as_string)
+        if value is not None and test(value):
+            return value
+        return await asyncio.wait_for(done, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        pv.remove_callback(cb_index)
+#enddef
+
+async def await_info(key, test, timeout=60.0, poll=0.25):
+    """
+    wait for a ScanDB info value for which test(value) is True
+
+    Returns:
+        the value, or None on timeout
+
+    Example:
+        await await_info('needs_offset', lambda v: int(v) == 0)
+    """
+    t0 = clock()
+    while clock()-t0 < timeout:
+        value = await adb(_scandb.get_info, key, None)
+        if value is not None and test(value):
+            return value
+        await asyncio.sleep(poll)
+    #endwhile
+    return None
+#enddef
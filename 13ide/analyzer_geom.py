@@ -0,0 +1,180 @@
+##
+## Rowland-circle geometry for the emission analyzer
+##
+##   Maps arrays of emission energies (for one crystal and reflection)
+##   to arrays of motor targets, so that a whole emission trajectory can
+##   be checked against motor limits and timed before it is started.
+##   Used by the analyzer daemon (daemons/run_analyzer.py) and by the
+##   herfd_scan / rixs_scan macros.
+
+import numpy as np
+from epics import caget
+
+DSPACES = {'si': 5.4309, 'ge': 5.658}
+HC = 12398.419      # hc in eV*Angstrom, also used by optimize_id
+ACHI = 30.0
+
+ANALYZER_PREFIX = '13XRM:ANA:'
+ANALYZER_MOTORS = {'ana_th': '13XRM:m8',
+                   'ana_d':  '13XRM:m7',
+                   'det_y':  '13XRM:m11',
+                   'det_x':  '13XRM:m10'}
+
+def bragg_theta(energies, xtal='si', hkl=(4, 4, 0)):
+    """
+    Bragg angle (degrees) for an array of energies.
+
+    Energies that cannot be reached with the reflection give nan.
+    """
+    dspace = DSPACES[xtal.lower()]
+    hkllen = np.sqrt((np.asarray(hkl, dtype='float64')**2).sum())
+    sinth = hkllen*HC/(2*dspace*np.asarray(energies, dtype='float64'))
+    sinth = np.where(abs(sinth) <= 1, sinth, np.nan)
+    return np.rad2deg(np.arcsin(sinth))
+#enddef
+
+def analyzer_distance(theta, diameter=1000):
+    "sample-analyzer distance for Bragg angle(s) theta (degrees)"
+    thref = np.deg2rad(90 - np.asarray(theta, dtype='float64'))
+    return 0.5*diameter*np.sqrt(2*(1 + np.cos(2*thref)))
+#enddef
+
+def detector_position(theta, diameter=1000):
+    "detector (x, y) for Bragg angle(s) theta (degrees)"
+    theta = np.asarray(theta, dtype='float64')
+    d_anal = analyzer_distance(theta, diameter=diameter)
+    dfact = np.sqrt(2 - 2*np.cos(np.deg2rad(2*(90-theta))))
+    det_x = d_anal*dfact*np.cos(np.deg2rad(ACHI+theta))
+    det_y = d_anal*dfact*np.sin(np.deg2rad(ACHI+theta))
+    return det_x, det_y
+#enddef
+
+def analyzer_table(energies, xtal='si', hkl=(4, 4, 0), diameter=1000,
+                   det_diameter=1000):
+    """
+    motor targets for an array of emission energies
+
+    Parameters:
+        energies (float or array): emission energies in eV
+        xtal (string): 'si' or 'ge' ['si']
+        hkl (tuple): reflection [(4, 4, 0)]
+        diameter (float): Rowland circle diameter in mm, for the
+            analyzer distance (the analyzer 'diam' PV) [1000]
+        det_diameter (float): Rowland circle diameter in mm, for the
+            detector position [1000]
+
+    Returns:
+        dict with arrays 'energy', 'ana_th', 'ana_d', 'det_x', 'det_y'
+    """
+    energies = np.atleast_1d(np.asarray(energies, dtype='float64'))
+    theta = bragg_theta(energies, xtal=xtal, hkl=hkl)
+    det_x, det_y = detector_position(theta, diameter=det_diameter)
+    return {'energy': energies, 'ana_th': theta,
+            'ana_d': analyzer_distance(theta, diameter=diameter),
+            'det_x': det_x, 'det_y': det_y}
+#enddef
+
+def check_limits(table, limits):
+    """
+    check a table of motor targets against motor limits
+
+    Parameters:
+        table (dict): from analyzer_table()
+        limits (dict): {motor: (low, high)}
+
+    Returns:
+        list of (energy, motor, value) for targets outside the limits
+        or not reachable, empty if all targets are fine.
+    """
+    out = []
+    for motor, (lo, hi) in limits.items():
+        vals = table[motor]
+        bad = np.isnan(vals)
+        if lo is not None and hi is not None and lo < hi:
+            bad = bad | (vals < lo) | (vals > hi)
+        for i in np.where(bad)[0]:
+            out.append((table['energy'][i], motor, vals[i]))
+    #endfor
+    return out
+#enddef
+
+def trajectory_time(table, velocities, accels=None, start=None):
+    """
+    time to step through a table of motor targets, with all axes of
+    each step moving together (the slowest axis sets the step time).
+
+    Parameters:
+        table (dict): from analyzer_table()
+        velocities (dict): {motor: velocity}
+        accels (dict or None): {motor: acceleration time} [None]
+        start (dict or None): {motor: current position}, to include
+            the move to the first point [None]
+
+    Returns:
+        array of time for each step
+    """
+    nsteps = len(table['energy'])
+    steptime = np.zeros(nsteps)
+    for motor, velo in velocities.items():
+        if velo is None or velo <= 0:
+            continue
+        vals = table[motor]
+        first = vals[0] if start is None or start.get(motor) is None else start[motor]
+        dist = abs(np.diff(vals, prepend=first))
+        accl = 0.0 if accels is None else (accels.get(motor) or 0.0)
+        steptime = np.maximum(steptime, dist/velo + accl*(dist > 0))
+    #endfor
+    return steptime
+#enddef
+
+def analyzer_settings(prefix=ANALYZER_PREFIX):
+    "current (xtal, hkl, diameter) from the analyzer PVs, or None if not connected"
+    vals = [caget(prefix + attr) for attr in ('xtal', 'h', 'k', 'l', 'diam')]
+    if None in vals:
+        return None
+    return ['si', 'ge'][int(vals[0])], tuple(vals[1:4]), vals[4]
+#enddef
+
+def analyzer_motor_info(motors=ANALYZER_MOTORS):
+    """
+    limits, velocities, accelerations and positions of analyzer motors,
+    as dicts {motor: value} of (low, high), VELO, ACCL, and RBV.
+    """
+    limits, velos, accls, pos = {}, {}, {}, {}
+    for name, prefix in motors.items():
+        limits[name] = (caget(prefix + '.LLM'), caget(prefix + '.HLM'))
+        velos[name] = caget(prefix + '.VELO')
+        accls[name] = caget(prefix + '.ACCL')
+        pos[name] = caget(prefix + '.RBV')
+    #endfor
+    return limits, velos, accls, pos
+#enddef
+
+def plan_emission(energies, det_track=True, prefix=ANALYZER_PREFIX):
+    """
+    check and time a list of emission energies with the current analyzer
+    settings, before scanning.
+
+    Parameters:
+        energies (list or array): emission energies in eV
+        det_track (True or False): whether the detector follows [True]
+
+    Returns:
+        (table, problems, steptimes), where problems is the list from
+        check_limits() and steptimes the move time for each energy,
+        or None if the analyzer PVs are not connected.
+    """
+    settings = analyzer_settings(prefix=prefix)
+    if settings is None:
+        return None
+    xtal, hkl, diam = settings
+    table = analyzer_table(energies, xtal=xtal, hkl=hkl, diameter=diam)
+    limits, velos, accls, pos = analyzer_motor_info()
+    if not det_track:
+        for name in ('det_x', 'det_y'):
+            limits.pop(name)
+            velos.pop(name)
+    problems = check_limits(table, limits)
+    steptimes = trajectory_time(table, velos, accels=accls, start=pos)
+    return table, problems, steptimes
+#enddef
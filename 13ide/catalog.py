@@ -0,0 +1,157 @@
+##
+## Catalog of data files written by the macros
+##
+##   Every data file written through timed_scan(), an XRD session, or a
+##   checkpointed macro is registered in the SQLite database
+##   'DataCatalog.db' in the user folder, with macro name, scan name,
+##   position, energy, motor values, checkpoint key and index, times and
+##   size.  catalog_find() queries it by any of these fields.
+##
+##   SQLite connections cannot be shared between threads, so each thread
+##   (scan server, CA callback threads, acall() and adb() workers) opens its own.
+
+import json
+import sqlite3
+import threading
+from time import time
+
+CATALOG_FILE = 'DataCatalog.db'
+CATALOG_FIELDS = ('filename', 'macro', 'scanname', 'position', 'energy',
+                  'motors', 'ckpt_key', 'ckpt_index', 'map', 'map_index',
+                  'tstart', 'tend', 'nbytes')
+CATALOG_INDEXED = ('macro', 'scanname', 'position', 'energy', 'ckpt_key',
+                   'map', 'tstart')
+
+_CATALOG_DB = threading.local()
+
+def _catalog_db():
+    "--private-- connection to the catalog for the current user folder and thread"
+    fname = str(user_datafile(CATALOG_FILE))
+    conns = getattr(_CATALOG_DB, 'conns', None)
+    if conns is None:
+        conns = _CATALOG_DB.conns = {}
+    conn = conns.get(fname, None)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(fname, timeout=10.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""create table if not exists files (
+        id integer primary key, filename text unique not null,
+        macro text, scanname text, position text, energy real,
+        motors text, ckpt_key text, ckpt_index integer,
+        map text, map_index integer,
+        tstart real, tend real, nbytes integer)""")
+    for field in CATALOG_INDEXED:
+        conn.execute("create index if not exists files_%s on files (%s)" % (field, field))
+    conn.commit()
+    conns[fname] = conn
+    return conn
+#enddef
+
+def catalog_add(filename, **kws):
+    """
+    register a data file in the catalog
+
+    Parameters:
+        filename (string): name of data file
+        macro, scanname, position (string): macro, scan, and position names
+        energy (float): energy in eV
+        motors (dict): motor name: value
+        ckpt_key, ckpt_index: checkpoint key and point index
+        map, map_index: map name and point index
+        tstart, tend (float): start and end times (seconds since epoch)
+        nbytes (int): file size
+
+    Note:
+        fields that are not given (or None) keep any value already
+        registered for the same file.
+    """
+    if filename is None:
+        return
+    vals = {}
+    for key, val in kws.items():
+        if key not in CATALOG_FIELDS:
+            raise ValueError("unknown catalog field '%s'" % key)
+        if val is not None:
+            vals[key] = json.dumps(val) if key == 'motors' else val
+    #endfor
+    try:
+        conn = _catalog_db()
+        conn.execute("insert or ignore into files (filename) values (?)", (str(filename),))
+        if len(vals) > 0:
+            sets = ', '.join(['%s=?' % key for key in vals])
+            conn.execute("update files set %s where filename=?" % sets,
+                         list(vals.values()) + [str(filename)])
+        conn.commit()
+    except sqlite3.Error as exc:
+        print("#catalog: could not register '%s': %s" % (filename, exc))
+#enddef
+
+def catalog_find(energy_min=None, energy_max=None, after=None, before=None,
+                 pattern=None, **kws):
+    """
+    find data files in the catalog
+
+    Parameters:
+        energy_min, energy_max (float or None): energy range [None]
+        after, before (float or None): range of start times [None]
+        pattern (string or None): SQL 'like' pattern for file name [None]
+        any other catalog field: exact value to match
+
+    Returns:
+        list of dicts, one per file, oldest first
+
+    Example:
+        catalog_find(position='SampleA', scanname='Fe_XANES')
+        catalog_find(macro='grid_xrd', pattern='%MySample%')
+    """
+    where, args = [], []
+    for key, val in kws.items():
+        if key not in CATALOG_FIELDS:
+            raise ValueError("unknown catalog field '%s'" % key)
+        where.append('%s=?' % key)
+        args.append(val)
+    #endfor
+    for clause, val in (('energy>=?', energy_min), ('energy<=?', energy_max),
+                        ('tstart>=?', after), ('tstart<=?', before),
+                        ('filename like ?', pattern)):
+        if val is not None:
+            where.append(clause)
+            args.append(val)
+    #endfor
+    query = "select * from files"
+    if len(where) > 0:
+        query = "%s where %s" % (query, ' and '.join(where))
+    out = []
+    try:
+        rows = _catalog_db().execute(query + " order by tstart, id", args).fetchall()
+    except sqlite3.Error as exc:
+        print("#catalog: could not search catalog: %s" % exc)
+        return out
+    for row in rows:
+        row = dict(row)
+        if row['motors'] is not None:
+            row['motors'] = json.loads(row['motors'])
+        out.append(row)
+    #endfor
+    return out
+#enddef
+
+def catalog_done(ckpt_key):
+    """
+    points recorded as done for a checkpoint key
+
+    Returns:
+        dict of point index: filename
+    """
+    out = {}
+    try:
+        rows = _catalog_db().execute("select ckpt_index, filename from files "
+                                     "where ckpt_key=?", (ckpt_key,)).fetchall()
+    except sqlite3.Error as exc:
+        print("#catalog: could not read checkpoint points: %s" % exc)
+        return out
+    for row in rows:
+        out[row['ckpt_index']] = row['filename']
+    return out
+#enddef
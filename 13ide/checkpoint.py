@@ -0,0 +1,172 @@
+##
+## Checkpoint journal for long multi-scan macros
+##
+##   Journaled macros (grid_scan, transect_scan, grid_xrd, fe_map,
+##   xafs_dtc_scans, ...) append one line of JSON to the file
+##   'Checkpoints.jsonl' in the user folder for every completed point.
+##   After an abort or server restart, `resume()` re-submits the last
+##   unfinished macro with resume=True, which skips the points that are
+##   already in the journal and whose data files exist (or are held in a
+##   consolidated map file, see map_store.py).
+
+import json
+from pathlib import Path
+from time import time, ctime
+
+CHECKPOINT_FILE = 'Checkpoints.jsonl'
+
+def _checkpoint_write(entry):
+    "--private-- append one entry to the checkpoint journal"
+    entry['time'] = time()
+    with open(user_datafile(CHECKPOINT_FILE), 'a') as fh:
+        fh.write(json.dumps(entry, default=float) + '\n')
+#enddef
+
+def _checkpoint_read():
+    "--private-- read all entries of the checkpoint journal"
+    fname = user_datafile(CHECKPOINT_FILE)
+    out = []
+    if not fname.exists():
+        return out
+    with open(fname, 'r') as fh:
+        for line in fh.readlines():
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                pass
+    return out
+#enddef
+
+def _datafile_exists(filename, consolidated=()):
+    """--private-- whether a recorded datafile is present.
+
+    Relative names are looked up in the user folder (and its Maps folder),
+    and in `consolidated`, the per-point files held in map files.
+    Absolute names written by a detector server are only checked when their
+    folder is visible from here, and are trusted otherwise.
+    """
+    if filename is None or filename in consolidated:
+        return True
+    fpath = Path(filename)
+    if fpath.is_absolute():
+        return fpath.exists() or not fpath.parent.exists()
+    return (user_datafile(filename).exists() or
+            user_datafile('Maps', filename).exists())
+#enddef
+
+def checkpoint_key(macro, params):
+    "key identifying one run of a macro with a set of parameters"
+    return '%s:%s' % (macro, json.dumps(params, sort_keys=True, default=float))
+#enddef
+
+def checkpoint_begin(macro, params, resume=False):
+    """
+    start (or resume) journaling of a macro.
+
+    Parameters:
+        macro (string): name of macro
+        params (dict): keyword parameters the macro was called with
+        resume (True or False): whether to pick up completed points
+             from the journal [False]
+
+    Returns:
+        checkpoint dictionary to pass to checkpoint_skip(), checkpoint_point()
+        and checkpoint_end()
+
+    Note:
+        with resume=True, points are only treated as done if their
+        datafiles can still be found, or are held in a consolidated map file.
+    """
+    key = checkpoint_key(macro, params)
+    ckpt = {'key': key, 'macro': macro, 'params': params, 'done': {}}
+    if resume:
+        consolidated = mapstore_files()
+        for index, filename in catalog_done(key).items():
+            if _datafile_exists(filename, consolidated):
+                ckpt['done'][index] = filename
+        for entry in _checkpoint_read():
+            if entry.get('key') == key and entry.get('event') == 'point':
+                if _datafile_exists(entry.get('file'), consolidated):
+                    ckpt['done'][entry['index']] = entry.get('file')
+        print("#resume %s: %d points already done" % (macro, len(ckpt['done'])))
+    #endif
+    _checkpoint_write({'key': key, 'macro': macro, 'params': params,
+                       'event': 'begin'})
+    return ckpt
+#enddef
+
+def checkpoint_skip(ckpt, index):
+    "return whether point `index` was already completed"
+    return ckpt is not None and index in ckpt['done']
+#enddef
+
+def checkpoint_point(ckpt, index, filename=None):
+    "record that point `index` was completed, writing `filename`"
+    if ckpt is None:
+        return
+    ckpt['done'][index] = filename
+    _checkpoint_write({'key': ckpt['key'], 'event': 'point',
+                       'index': index, 'file': filename})
+    catalog_add(filename, macro=ckpt['macro'], ckpt_key=ckpt['key'],
+                ckpt_index=index)
+#enddef
+
+def checkpoint_end(ckpt):
+    "record that the macro ran to completion"
+    if ckpt is None:
+        return
+    _checkpoint_write({'key': ckpt['key'], 'event': 'end'})
+#enddef
+
+def checkpoint_list():
+    """
+    list macro runs that were started but did not finish
+
+    Returns:
+        list of (key, macro, params, npoints_done, start_time), latest last
+    """
+    runs = {}
+    for entry in _checkpoint_read():
+        key = entry.get('key')
+        event = entry.get('event')
+        if event == 'begin':
+            if key not in runs:
+                runs[key] = [key, entry['macro'], entry['params'], 0, entry['time']]
+            runs[key][4] = entry['time']
+        elif event == 'point' and key in runs:
+            runs[key][3] += 1
+        elif event == 'end' and key in runs:
+            runs.pop(key)
+    #endfor
+    out = [(r[4], tuple(r)) for r in runs.values()]
+    out.sort()
+    return [r[1] for r in out]
+#enddef
+
+def resume(macro=None):
+    """
+    resume the most recent unfinished journaled macro
+
+    Parameters:
+        macro (string or None): name of macro to resume.
+            if None (default), the most recently started unfinished macro.
+
+    Example:
+        resume('grid_scan')
+
+    Note:
+        the macro is added to the command queue with its original
+        parameters and resume=True, so that completed points are skipped.
+    """
+    runs = checkpoint_list()
+    if macro is not None:
+        runs = [r for r in runs if r[1] == macro]
+    if len(runs) < 1:
+        print("Nothing to resume")
+        return
+    key, macro, params, ndone, tstart = runs[-1]
+    args = ', '.join(['%s=%s' % (k, repr(v)) for k, v in params.items()])
+    command = '%s(%s, resume=True)' % (macro, args)
+    print("#resume: %s started %s, %d points done" % (macro, ctime(tstart), ndone))
+    _scandb.add_command(command)
+#enddef
@@ -1,4 +1,5 @@
 from time import time, sleep
+from pathlib import Path
 from epics import caget
 
 def check_abort_pause(msg='aborted.'):
@@ -9,6 +10,11 @@ def check_abort_pause(msg='aborted.'):
 def set_user_name(user_name):
     _scandb.set_info('user_name', user_name)
 
+def user_datafile(*names):
+    "full Path for a file in the current user folder"
+    return Path(_scandb.get_info('server_fileroot'),
+                _scandb.get_info('user_folder'), *names)
+
 def restart_server():
     "hard restart of server"
     epv = get_dbinfo('epics_status_prefix')
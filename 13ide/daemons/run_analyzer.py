@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import threading
+import numpy as np
+from numpy import sin, cos, sqrt, deg2rad, pi
+from epics import caget, Device, PV
+
+# daemons are run as scripts, outside the macro folder that the scan
+# server loads; modules shared with the macros are imported from it
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyzer_geom import (DSPACES, ACHI, ANALYZER_MOTORS, analyzer_table,
+                           analyzer_distance, detector_position)
+
+MIN_CLEARANCE = 50.0   # minimum analyzer-detector separation (mm) during moves
+MOTORS = dict([(name, PV(prefix + '.VAL')) for name, prefix in ANALYZER_MOTORS.items()])
+
+
+def put_motor(name, value, wait=False):
+    MOTORS[name].put(value, wait=wait)
+
+def group_move(targets, timeout=120.0):
+    """start all motor moves in `targets` (dict of name: value) at once,
+    and wait for all of them to complete.  Returns whether all completed."""
+    for name, value in targets.items():
+        MOTORS[name].put(value, use_complete=True)
+    t0 = time.time()
+    while not all([MOTORS[name].put_complete for name in targets]):
+        if time.time() - t0 > timeout:
+            print("#Analyzer: timed out waiting for ", list(targets.keys()))
+            return False
+        time.sleep(0.005)
+    return True
+
+def d_analyzer(theta=0, diameter=1000):
+    """sample-analyzer distance: law of cosines"""
+    return analyzer_distance(theta, diameter=diameter)
+#enddef
+
+def detector_xy(theta, diameter=1000):
+    return detector_position(theta, diameter=diameter)
+
+def clearance(ana_d, det_x, det_y):
+    """analyzer-detector separation, for analyzer distance ana_d"""
+    x_anal = ana_d*cos(deg2rad(ACHI))
+    h_anal = ana_d*sin(deg2rad(ACHI))
+    return sqrt((x_anal-det_x)**2 + (h_anal-det_y)**2)
+
+def move_stages(targets):
+    """split analyzer and detector targets into stages of moves
+
+    All axes move together unless moving them together would bring the
+    detector within MIN_CLEARANCE of the analyzer.  Then either the
+    detector or the analyzer moves first, whichever keeps them further apart.
+    """
+    if 'det_x' not in targets or 'det_y' not in targets:
+        return [targets]
+    old = dict([(name, MOTORS[name].get()) for name in ('ana_d', 'det_x', 'det_y')])
+    new = dict([(name, targets.get(name, old[name])) for name in old])
+    frac = np.linspace(0, 1, 21)
+    path = [old[name] + frac*(new[name] - old[name]) for name in ('ana_d', 'det_x', 'det_y')]
+    if clearance(*path).min() >= MIN_CLEARANCE:
+        return [targets]
+
+    ana = dict([(k, v) for k, v in targets.items() if k.startswith('ana')])
+    det = dict([(k, v) for k, v in targets.items() if k.startswith('det')])
+    if (clearance(old['ana_d'], new['det_x'], new['det_y']) >=
+        clearance(new['ana_d'], old['det_x'], old['det_y'])):
+        return [det, ana]
+    return [ana, det]
+
+
+class Analyzer(Device):
+    """Rowland-circle analyzer daemon
+
+    Energy requests arrive as CA callbacks on Energy (or Moving=1) and
+    are handed to run() through a condition variable.  Requests that
+    arrive while the analyzer is moving are coalesced: only the latest
+    energy is moved to.  Latency (seconds from request to start of motion)
+    and QueueDepth (number of requests coalesced into one move) are
+    written to status PVs, if those exist, as is MoveError (1 if the
+    last move did not complete).
+    """
+    attrs = ('h', 'k', 'l', 'xtal', 'diam', 'Energy',
+             'Energy_RBV', 'Moving', 'det_track', 'sim_mode',
+             'theta', 'ana_dist', 'det_x', 'det_y',
+             'Latency', 'QueueDepth', 'MoveError')
+
+    _nonpvs = ('_prefix', '_pvs', '_delim', 'en_val', 'n_pending',
+               't_request', 'cond')
+
+    def __init__(self, prefix='13XRM:ANA:'):
+
+        Device.__init__(self, prefix, attrs=self.attrs)
+        time.sleep(0.1)
+        self.cond = threading.Condition()
+        self.en_val = -1
+        self.n_pending = 0
+        self.t_request = time.time()
+        self._pvs['Moving'].put(0)
+        self.add_callback('Energy', self.onEnergyChange)
+        self.add_callback('Moving', self.onMovingChange)
+
+    def _request(self):
+        with self.cond:
+            self.n_pending += 1
+            self.t_request = time.time()
+            self.cond.notify()
+
+    def onEnergyChange(self, value, **kws):
+        if value > 1000 and value < 30000:
+            self.en_val = value
+        self._request()
+
+    def onMovingChange(self, value, **kws):
+        if value == 1:
+            self._request()
+
+    def put_status(self, attr, value):
+        "write a status PV, if it is connected"
+        pv = self._pvs.get(attr, None)
+        if pv is not None and pv.connected:
+            pv.put(value)
+
+    def set_energy(self, t_request=None):
+        energy = self.en_val
+        if energy < 2000 or energy > 30000:
+            return
+        xtal = ['si', 'ge'][self.xtal]
+        h = self.h
+        k = self.k
+        l = self.l
+
+        # analyzer distance from the diam PV, detector for a 1000 mm circle
+        table = analyzer_table(energy, xtal=xtal, hkl=(h, k, l),
+                               diameter=self.diam, det_diameter=1000)
+        thetad = table['ana_th'][0]
+        ana_d = table['ana_d'][0]
+        det_x = table['det_x'][0]
+        det_y = table['det_y'][0]
+        if np.isnan(thetad):
+            print("#Analyzer En=%.1f not reachable with %s(%d,%d,%d)" % (energy, xtal.title(), h, k, l))
+            self._pvs['Moving'].put(0)
+            return
+
+        self._pvs['det_x'].put(det_x)
+        self._pvs['det_y'].put(det_y)
+        self._pvs['theta'].put(thetad)
+        self._pvs['ana_dist'].put(ana_d)
+
+        print("#Analyzer En=%.1f %s(%d,%d,%d) at %s" % (energy, xtal.title(), h, k, l, time.ctime()))
+        # print("#  Theta=%.2f, AnaZ=%.2f, DetX=%.2f, DetY=%.2f" % (thetad, ana_d, det_x, det_y))
+        if t_request is not None:
+            self.put_status('Latency', time.time() - t_request)
+        if not self.sim_mode:
+            targets = {'ana_d': ana_d, 'ana_th': thetad}
+            if self.det_track:
+                targets['det_x'] = det_x
+                targets['det_y'] = det_y
+            for stage in move_stages(targets):
+                if not group_move(stage):
+                    print("#Analyzer En=%.1f move did not complete, stopping" % energy)
+                    self.put_status('MoveError', 1)
+                    self._pvs['Moving'].put(0)
+                    return
+            #endfor
+            self.put_status('MoveError', 0)
+
+        self._pvs['Energy_RBV'].put(energy)
+
+        self._pvs['Moving'].put(0)
+        print("Energy done", time.ctime())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.n_pending == 0:
+                    self.cond.wait()
+                depth = self.n_pending
+                t_request = self.t_request
+                self.n_pending = 0
+            self.put_status('QueueDepth', depth)
+            self.set_energy(t_request=t_request)
+
+
+
+if __name__ == '__main__':
+    analyzer = Analyzer()
+    analyzer.run()
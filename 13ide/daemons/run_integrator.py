@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+Live azimuthal integration service for XRD frames
+
+Reads the queue file 'XRD_Integrate.jsonl' in a user folder, to which
+save_xrd / grid_xrd / line_xrd add one line for each saved frame (see
+`queue_xrd_integration`), integrates the frames in a pool of worker
+processes (with the cached sparse integrators of xrd_integrate.py),
+and writes the 1-D patterns for each map into a 2-D array
+    XRD_Integrated/<map>.npy        shape (npts, nbins), nan until integrated
+    XRD_Integrated/<map>_sub.npy    same, with the dark frame subtracted
+    XRD_Integrated/<map>_q.npy      q values (1/Angstrom)
+    XRD_Integrated/<map>.json       map shape and calibration
+
+Pixels are masked if they are set in the mask file (see `set_maskfile`),
+or flagged invalid by the detector in the first frame of a shape (gaps
+and dead pixels, at the largest value of the data type, such as 2**32-1
+for the Eiger).  Pixels that are invalid only in a later frame are
+counted as zero in that frame.
+
+Each queued frame names the dark (background) frame recorded for its
+exposure time and detector temperature, if any (see `xrd_background_taken`).
+The integrated dark is subtracted from the pattern for the _sub array;
+frames without a dark are left nan there.
+
+usage:
+    python daemons/run_integrator.py <user_folder> [nworkers]
+"""
+import sys
+import time
+import json
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# daemons are run as scripts, outside the macro folder that the scan
+# server loads; xrd_integrate is only used here, and lives next to this
+from xrd_integrate import load_integrator, integrate
+
+QUEUE_FILE = 'XRD_Integrate.jsonl'
+OUTPUT_FOLDER = 'XRD_Integrated'
+NBINS = 2048
+
+# map detector-side path prefixes to local path prefixes,
+# for detectors that report paths as seen from the detector server
+PATH_MAP = {}
+
+# per-process caches of integrators, keyed by calibration file, shape
+# and mask, of masks, keyed by mask file and shape, and of integrated
+# dark frames, keyed by dark file and integrator
+_integrators = {}
+_masks = {}
+_darks = {}
+
+def local_path(fname):
+    """local path for a frame file name reported by the detector"""
+    fname = fname.replace('\\', '/')
+    for remote, local in PATH_MAP.items():
+        if fname.startswith(remote) and not Path(fname).exists():
+            return Path(local, fname[len(remote):])
+    return Path(fname)
+
+def read_frame(fname):
+    """read a TIFF or HDF5 frame as a 2-D array (HDF5 frames are summed)"""
+    if fname.suffix.lower() in ('.h5', '.hdf5', '.nxs'):
+        import h5py
+        with h5py.File(fname, 'r') as fh:
+            data = fh['entry/data/data'][()]
+        if data.ndim == 3:
+            # keep pixels flagged invalid in any frame flagged in the sum
+            bad = invalid_pixels(data).any(axis=0)
+            data = data.sum(axis=0)
+            if np.issubdtype(data.dtype, np.integer):
+                data[bad] = np.iinfo(data.dtype).max
+            else:
+                data[bad] = np.nan
+        return data
+    from tifffile import imread
+    return imread(fname)
+
+def invalid_pixels(img):
+    """pixels flagged invalid by the detector: the largest value of an
+    integer data type (gaps and dead pixels), negative or non-finite values"""
+    if np.issubdtype(img.dtype, np.integer):
+        bad = img >= np.iinfo(img.dtype).max
+        if np.issubdtype(img.dtype, np.signedinteger):
+            bad |= img < 0
+        return bad
+    return ~np.isfinite(img) | (img < 0)
+
+def read_mask(maskfile):
+    """read a mask file (TIFF or .npy), True for pixels to ignore"""
+    if maskfile.endswith('.npy'):
+        return np.load(maskfile) != 0
+    return read_frame(Path(maskfile)) != 0
+
+def get_mask(maskfile, img):
+    """mask (True for pixels to ignore) and its key, for a mask
+    file and the shape of a frame"""
+    key = (maskfile, img.shape)
+    if key not in _masks:
+        mask = invalid_pixels(img)
+        if maskfile is not None:
+            fmask = read_mask(maskfile)
+            if fmask.shape == img.shape:
+                mask |= fmask
+            else:
+                print("#mask file shape does not match frame: ", maskfile)
+        maskkey = hashlib.sha1(np.ascontiguousarray(mask).tobytes()).hexdigest()
+        _masks[key] = (mask, maskkey)
+    return _masks[key]
+
+def get_integrator(ponifile, shape, mask=None, maskkey=None, cachedir=None):
+    key = (ponifile, shape, maskkey)
+    integ = _integrators.get(key, None)
+    if integ is None:
+        integ = _integrators[key] = load_integrator(ponifile, shape, nbins=NBINS,
+                                                    mask=mask, cachedir=cachedir)
+    return integ
+
+def get_dark(darkfile, integ, key):
+    """integrated pattern of a dark frame, with the integrator for key,
+    or None if the dark frame cannot be read or has a different shape"""
+    key = (darkfile,) + key
+    if key not in _darks:
+        pattern = None
+        try:
+            img = read_frame(local_path(darkfile))
+        except (OSError, ValueError, KeyError) as exc:
+            print("#cannot read dark frame: ", darkfile, exc)
+            img = None
+        if img is not None and img.shape != key[2]:
+            print("#dark frame shape does not match frame: ", darkfile)
+        elif img is not None:
+            img = np.where(invalid_pixels(img), 0, img)
+            pattern = integrate(integ, img)[1]
+        _darks[key] = pattern
+    return _darks[key]
+
+def integrate_frame(job):
+    """integrate one queued frame, and its dark frame if it
+    names one: runs in a worker process"""
+    img = read_frame(local_path(job['file']))
+    mask, maskkey = get_mask(job['maskfile'], img)
+    integ = get_integrator(job['ponifile'], img.shape, mask=mask,
+                           maskkey=maskkey, cachedir=job['cachedir'])
+    dark = None
+    if job.get('dark', None):
+        dark = get_dark(job['dark'], integ, (job['ponifile'], img.shape, maskkey))
+    img = np.where(invalid_pixels(img), 0, img)
+    q, intensity = integrate(integ, img)
+    return job, q, intensity, dark
+
+class MapStore:
+    """2-D arrays of integrated patterns, one per map, as .npy memmaps"""
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.maps = {}
+
+    def get_array(self, job, q, suffix=''):
+        name = job['name'] + suffix
+        arr = self.maps.get(name, None)
+        if arr is not None:
+            return arr
+        fname = Path(self.folder, f'{name}.npy')
+        npts = int(np.prod(job['shape']))
+        if fname.exists():
+            arr = np.load(fname, mmap_mode='r+')
+        if arr is None or arr.shape != (npts, len(q)):
+            arr = np.lib.format.open_memmap(fname, mode='w+', dtype='float32',
+                                            shape=(npts, len(q)))
+            arr[:] = np.nan
+            if suffix == '':
+                np.save(Path(self.folder, f'{name}_q.npy'), q)
+                with open(Path(self.folder, f'{name}.json'), 'w') as fh:
+                    json.dump({'shape': job['shape'], 'poni': job['poni'],
+                               'nbins': len(q)}, fh)
+        self.maps[name] = arr
+        return arr
+
+    def add(self, job, q, intensity, dark=None):
+        arr = self.get_array(job, q)
+        arr[job['index']] = intensity
+        arr.flush()
+        if dark is not None:
+            arr = self.get_array(job, q, suffix='_sub')
+            arr[job['index']] = intensity - dark
+            arr.flush()
+
+class Integrator:
+    """live integration service"""
+    def __init__(self, folder, nworkers=None):
+        self.folder = Path(folder)
+        self.nworkers = nworkers
+        self.queue = Path(folder, QUEUE_FILE)
+        self.offset = 0
+        if self.queue.exists():
+            self.offset = self.queue.stat().st_size
+        self.store = MapStore(Path(folder, OUTPUT_FOLDER))
+
+    def new_jobs(self):
+        """new jobs appended to the queue file since the last call"""
+        if not self.queue.exists() or self.queue.stat().st_size <= self.offset:
+            return []
+        jobs = []
+        with open(self.queue, 'r') as fh:
+            fh.seek(self.offset)
+            for line in fh:
+                if not line.endswith('\n'):
+                    break
+                self.offset += len(line.encode())
+                try:
+                    job = json.loads(line)
+                except ValueError:
+                    continue
+                if job.get('poni', None) is None:
+                    print("#no calibration for ", job['file'])
+                    continue
+                job['ponifile'] = Path(self.folder, job['poni']).as_posix()
+                job['maskfile'] = None
+                if job.get('mask', None):
+                    job['maskfile'] = Path(self.folder, job['mask']).as_posix()
+                job['cachedir'] = Path(self.folder, OUTPUT_FOLDER, 'cache').as_posix()
+                job['name'] = job.get('map', None) or Path(job['file']).stem
+                jobs.append(job)
+        return jobs
+
+    def run(self):
+        with ProcessPoolExecutor(max_workers=self.nworkers) as pool:
+            pending = set()
+            while True:
+                for job in self.new_jobs():
+                    pending.add(pool.submit(integrate_frame, job))
+                done = [f for f in pending if f.done()]
+                for future in done:
+                    pending.remove(future)
+                    try:
+                        job, q, intensity, dark = future.result()
+                        self.store.add(job, q, intensity, dark=dark)
+                    except Exception as exc:
+                        print("#integration failed: ", exc)
+                time.sleep(0.02 if len(pending) > 0 else 0.25)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    Integrator(sys.argv[1], nworkers=nworkers).run()
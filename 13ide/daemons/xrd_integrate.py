@@ -0,0 +1,197 @@
+##
+## Geometry-cached azimuthal integration
+##
+##   For a fixed calibration (PONI file) and detector shape, every pixel
+##   falls in the same q bin for every frame.  build_integrator() computes
+##   the pixel -> bin map once, including mask, solid-angle and polarization
+##   corrections, as a sparse (CSR) matrix, so that each frame integrates
+##   as a single sparse matrix-vector product.  load_integrator() caches
+##   the matrix on disk, keyed by calibration, detector shape and options.
+##
+##   Geometry follows the pyFAI convention for PONI files.
+
+import json
+import hashlib
+from pathlib import Path
+import numpy as np
+from numpy import sin, cos
+
+def read_poni_file(fname):
+    """
+    read a pyFAI PONI calibration file
+
+    Returns:
+        dict with 'dist', 'poni1', 'poni2', 'rot1', 'rot2', 'rot3',
+        'wavelength' (all in meters and radians), 'pixel1', 'pixel2'
+    """
+    out = {}
+    with open(fname, 'r') as fh:
+        for line in fh.readlines():
+            line = line.strip()
+            if line.startswith('#') or ':' not in line:
+                continue
+            key, val = [w.strip() for w in line.split(':', 1)]
+            key = key.lower()
+            key = {'distance': 'dist', 'pixelsize1': 'pixel1',
+                   'pixelsize2': 'pixel2'}.get(key, key)
+            if key == 'detector_config':
+                conf = json.loads(val)
+                for pkey in ('pixel1', 'pixel2'):
+                    if pkey in conf:
+                        out[pkey] = float(conf[pkey])
+                continue
+            try:
+                out[key] = float(val)
+            except ValueError:
+                out[key] = val
+    #endfor
+    return out
+#enddef
+
+def pixel_geometry(poni, shape):
+    """
+    scattering angle, azimuth and solid angle for each detector pixel
+
+    Parameters:
+        poni (dict): calibration, from read_poni_file()
+        shape (tuple): detector shape (ny, nx)
+
+    Returns:
+        (tth, chi, solid): arrays of shape `shape`, with 2-theta and
+        chi in radians, and solid angle relative to the PONI pixel.
+    """
+    dist = poni['dist']
+    rot1, rot2, rot3 = poni.get('rot1', 0), poni.get('rot2', 0), poni.get('rot3', 0)
+    p1 = (np.arange(shape[0]) + 0.5)*poni['pixel1'] - poni['poni1']
+    p2 = (np.arange(shape[1]) + 0.5)*poni['pixel2'] - poni['poni2']
+    p1, p2 = np.meshgrid(p1, p2, indexing='ij')
+
+    t1 = (p1*cos(rot2)*cos(rot3) +
+          p2*(cos(rot3)*sin(rot1)*sin(rot2) - cos(rot1)*sin(rot3)) -
+          dist*(cos(rot1)*cos(rot3)*sin(rot2) + sin(rot1)*sin(rot3)))
+    t2 = (p1*cos(rot2)*sin(rot3) +
+          p2*(cos(rot1)*cos(rot3) + sin(rot1)*sin(rot2)*sin(rot3)) -
+          dist*(-cos(rot3)*sin(rot1) + cos(rot1)*sin(rot2)*sin(rot3)))
+    t3 = (p1*sin(rot2) - p2*cos(rot2)*sin(rot1) +
+          dist*cos(rot1)*cos(rot2))
+    rad = np.sqrt(t1*t1 + t2*t2 + t3*t3)
+    tth = np.arctan2(np.sqrt(t1*t1 + t2*t2), t3)
+    chi = np.arctan2(t1, t2)
+    solid = (dist/rad)**3
+    return tth, chi, solid
+#enddef
+
+def integrator_key(poni, shape, nbins, polarization, mask=None):
+    "key identifying an integrator matrix"
+    params = dict(poni=poni, shape=list(shape), nbins=nbins,
+                  polarization=polarization)
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    if mask is not None:
+        key.update(np.ascontiguousarray(mask, dtype=bool).tobytes())
+    return key.hexdigest()[:16]
+#enddef
+
+def build_integrator(poni, shape, nbins=2048, mask=None, polarization=0.99):
+    """
+    build the sparse pixel -> q bin matrix for a calibration
+
+    Parameters:
+        poni (dict): calibration, from read_poni_file()
+        shape (tuple): detector shape (ny, nx)
+        nbins (int): number of q bins [2048]
+        mask (array or None): boolean array, True for pixels to ignore [None]
+        polarization (float or None): polarization factor, None for no
+            polarization correction [0.99]
+
+    Returns:
+        dict with 'matrix' (CSR matrix, shape (nbins, npixels)) and 'q'
+        (bin centers, 1/Angstrom).  Rows of the matrix are normalized so
+        that the product with a frame gives the mean corrected intensity.
+    """
+    from scipy.sparse import csr_matrix
+    tth, chi, solid = pixel_geometry(poni, shape)
+    qval = (4.e-10*np.pi/poni['wavelength'])*np.sin(tth/2.0)
+
+    corr = solid
+    if polarization is not None:
+        ctth = np.cos(tth)
+        corr = corr*0.5*(1 + ctth**2 - polarization*np.cos(2*chi)*(1 - ctth**2))
+    weight = 1.0/corr.ravel()
+    good = np.ones(weight.size, dtype=bool)
+    if mask is not None:
+        good = ~np.asarray(mask, dtype=bool).ravel()
+
+    qval = qval.ravel()
+    qmin, qmax = qval[good].min(), qval[good].max()
+    bins = ((qval - qmin)*(nbins/(qmax - qmin))).astype('int64')
+    bins = np.clip(bins, 0, nbins-1)
+
+    counts = np.bincount(bins[good], minlength=nbins).astype('float64')
+    pixels = np.where(good)[0]
+    data = weight[pixels]/np.maximum(counts[bins[pixels]], 1)
+    matrix = csr_matrix((data, (bins[pixels], pixels)),
+                        shape=(nbins, weight.size))
+    qstep = (qmax - qmin)/nbins
+    return {'matrix': matrix, 'q': qmin + qstep*(np.arange(nbins) + 0.5),
+            'counts': counts, 'shape': tuple(shape)}
+#enddef
+
+def save_integrator(integ, fname):
+    "save an integrator to an .npz file"
+    mat = integ['matrix']
+    np.savez(fname, data=mat.data, indices=mat.indices, indptr=mat.indptr,
+             matshape=np.array(mat.shape), q=integ['q'],
+             counts=integ['counts'], shape=np.array(integ['shape']))
+#enddef
+
+def read_integrator(fname):
+    "read an integrator saved with save_integrator()"
+    from scipy.sparse import csr_matrix
+    dat = np.load(fname)
+    matrix = csr_matrix((dat['data'], dat['indices'], dat['indptr']),
+                        shape=tuple(dat['matshape']))
+    return {'matrix': matrix, 'q': dat['q'], 'counts': dat['counts'],
+            'shape': tuple(dat['shape'])}
+#enddef
+
+def load_integrator(ponifile, shape, nbins=2048, mask=None,
+                    polarization=0.99, cachedir=None):
+    """
+    integrator for a PONI file and detector shape, from the disk cache
+    if available, otherwise built and saved to the cache.
+
+    Parameters:
+        ponifile (string): name of PONI file
+        shape (tuple): detector shape (ny, nx)
+        nbins, mask, polarization: as for build_integrator()
+        cachedir (string or None): folder for cached integrators
+            [None, 'integrator_cache' next to the PONI file]
+    """
+    poni = read_poni_file(ponifile)
+    key = integrator_key(poni, shape, nbins, polarization, mask=mask)
+    if cachedir is None:
+        cachedir = Path(Path(ponifile).parent, 'integrator_cache')
+    fname = Path(cachedir, f'{Path(ponifile).stem}_{key}.npz')
+    if fname.exists():
+        return read_integrator(fname)
+    integ = build_integrator(poni, shape, nbins=nbins, mask=mask,
+                             polarization=polarization)
+    Path(cachedir).mkdir(parents=True, exist_ok=True)
+    save_integrator(integ, fname)
+    return integ
+#enddef
+
+def integrate(integ, img):
+    """
+    integrate a frame
+
+    Parameters:
+        integ (dict): from build_integrator() or load_integrator()
+        img (array): frame, with shape integ['shape']
+
+    Returns:
+        (q, intensity)
+    """
+    img = np.asarray(img, dtype='float64').ravel()
+    return integ['q'], integ['matrix'].dot(img)
+#enddef
@@ -3,6 +3,7 @@
 # from intensity import set_mono_tilt, autoset_i0amp_gain
 
 IDPREF = 'S13ID:USID'
+import asyncio
 import numpy as np
 from pathlib import Path
 
@@ -117,46 +118,69 @@ def move_energy(energy, id_harmonic=None, wait=True):
     Examples:
        move_energy(5000,  id_offset=0.050, id_harmonic=1)
 
+    See Also:
+       move_energy_async
+
     """
-    if check_abort_pause():
+    return run_async(move_energy_async(energy, id_harmonic=id_harmonic,
+                                       wait=wait))
+
+
+async def move_energy_async(energy, id_harmonic=None, wait=True):
+    """
+    async version of move_energy(), for use with run_async() or
+    inside other async macros
+
+    Examples:
+       run_async(move_energy_async(7200), autoset_gain_async())
+    """
+    if await adb(check_abort_pause):
         return
+    t0 = time()
     if id_harmonic is None:
         id_harmonic = select_id_harmonic(energy)
     id_harmonic_pv = get_pv(f'{IDPREF}:HarmonicValueC.VAL')
     id_gaptaper_pv = get_pv(f'{IDPREF}:TaperGapSetC.VAL')
-    caput('13IDE:En:id_harmonic', id_harmonic)
+    await aput('13IDE:En:id_harmonic', id_harmonic, wait=False)
     if 'write' in id_harmonic_pv.access:
-        id_harmonic_pv.put(id_harmonic)
+        await aput(id_harmonic_pv.pvname, id_harmonic, wait=False)
     else:
         print("no write access for harmonic")
-    sleep(0.1)
+    await asyncio.sleep(0.1)
 
     id_energy = undulator_energy(energy, harmonic=id_harmonic)
     id_gap = idenergy2idgap(id_energy, harmonic=id_harmonic)
 
     id_en_kev = 0.001*id_energy
     # print("En ", energy, id_energy, id_en_kev)
-    caput('13IDE:En:id_off.VAL', id_en_kev-energy*0.001)
+    await aput('13IDE:En:id_off.VAL', id_en_kev-energy*0.001, wait=False)
     id_energy_pv = get_pv(f'{IDPREF}:ScanEnergyC.VAL')
     # start undulator moving, if allowed
     # print("ID ENERGY ", id_energy_pv.access, id_energy_pv)
     if 'write' in id_energy_pv.access:
         # print("Put ID Energy ", id_energy_pv, id_en_kev)
-        cur_id_en = id_energy_pv.get()
-        id_energy_pv.put(id_en_kev - 0.1*(id_en_kev - cur_id_en), wait=False)
-        sleep(0.2)
-        id_gaptaper_pv.put(0.050)
-        sleep(0.2)
-        id_energy_pv.put(id_en_kev, wait=False)
+        cur_id_en = await aget(id_energy_pv.pvname)
+        await aput(id_energy_pv.pvname, id_en_kev - 0.1*(id_en_kev - cur_id_en),
+                   wait=False)
+        await asyncio.sleep(0.2)
+        await aput(id_gaptaper_pv.pvname, 0.050, wait=False)
+        await asyncio.sleep(0.2)
+        await aput(id_energy_pv.pvname, id_en_kev, wait=False)
     else:
         print("no write access for energy")
         print(id_energy_pv)
     #endif
-    caput('13IDE:En:y2_track', 1)
-    caput('13IDE:En:id_track', 1)
-    caput('13IDE:En:id_wait',  0)
-    sleep(0.1)
-    caput('13IDE:En:Energy.VAL', energy, wait=wait)
+    await aput('13IDE:En:y2_track', 1, wait=False)
+    await aput('13IDE:En:id_track', 1, wait=False)
+    await aput('13IDE:En:id_wait',  0, wait=False)
+    await asyncio.sleep(0.1)
+    if wait:
+        await watched_put_async('13IDE:En:Energy.VAL', energy,
+                                readback='13IDA:m65.RBV')
+    else:
+        await aput('13IDE:En:Energy.VAL', energy, wait=False)
+    if wait:
+        await adb(record_timing, 'move_energy', time()-t0)
     print("Move Energy done")
 
 
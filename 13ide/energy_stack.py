@@ -0,0 +1,174 @@
+##
+## Energy-stack maps: repeat a scan or map at a list of energies,
+## tuning the mono tilt once per distinct energy.
+##
+##   The tuned pitch and roll for each energy are kept in the
+##   'mono_tilt_cache' info entry.  On a later visit to the same energy
+##   (in the same or a later map) the cached pitch and roll are restored,
+##   and I0 is checked against the value seen when they were tuned.  Only
+##   if I0 has changed by more than TILT_I0_TOLERANCE is fast_mono_tilt()
+##   run, and a full set_mono_tilt() is only done at new energies.
+
+import json
+from time import time
+
+TILT_CACHE_INFO = 'mono_tilt_cache'
+TILT_CACHE_HOURS = 8.0     # maximum age of cached pitch/roll values
+TILT_I0_TOLERANCE = 0.10   # allowed fractional change in I0 for cached values
+
+TILT_PV = '13IDA:E_MonoPiezoPitch.VAL'
+ROLL_PV = '13IDA:E_MonoPiezoRoll.VAL'
+I0_PV   = '13IDE:I0_Volts'
+
+def _tilt_cache():
+    "--private-- cached tilt table: {'energy': [pitch, roll, i0, timestamp]}"
+    try:
+        return json.loads(_scandb.get_info(TILT_CACHE_INFO, '{}'))
+    except (TypeError, ValueError):
+        return {}
+#enddef
+
+def _tilt_key(energy):
+    "--private-- cache key for an energy"
+    return '%.1f' % energy
+#enddef
+
+def cached_mono_tilt(energy):
+    """
+    cached (pitch, roll, i0) for an energy, or None if
+    not cached or older than TILT_CACHE_HOURS
+    """
+    entry = _tilt_cache().get(_tilt_key(energy), None)
+    if entry is None or (time() - entry[3]) > TILT_CACHE_HOURS*3600.0:
+        return None
+    return entry[0], entry[1], entry[2]
+#enddef
+
+def save_mono_tilt(energy):
+    "save the current mono pitch, roll, and I0 as tuned values for an energy"
+    cache = _tilt_cache()
+    cache[_tilt_key(energy)] = [caget(TILT_PV), caget(ROLL_PV), caget(I0_PV), time()]
+    _scandb.set_info(TILT_CACHE_INFO, json.dumps(cache))
+#enddef
+
+def clear_mono_tilt_cache():
+    "forget all cached mono pitch and roll values"
+    _scandb.set_info(TILT_CACHE_INFO, '{}')
+#enddef
+
+def tune_at_energy(energy, full=True):
+    """
+    move to an energy and tune the mono tilt, reusing cached values
+
+    Parameters:
+        energy (float): energy in eV
+        full (True or False): use set_mono_tilt() (True) or
+            fast_mono_tilt() (False) at energies without cached values [True]
+
+    Returns:
+        one of 'cached', 'fast', or 'full', for how the tilt was set
+
+    Note:
+        with cached values, roll and pitch feedback are turned back
+        on as set_mono_tilt() would (see mono_tilt_feedback()).
+
+    Example:
+        tune_at_energy(7112.0)
+    """
+    move_energy(energy)
+    cached = cached_mono_tilt(energy)
+    how = 'full' if full else 'fast'
+    if cached is not None:
+        pitch, roll, i0_ref = cached
+        caput('13XRM:pitch_pid.FBON', 0)
+        caput('13XRM:roll_pid.FBON', 0)
+        caput(TILT_PV, pitch, wait=True)
+        caput(ROLL_PV, roll, wait=True)
+        sleep(0.25)
+        i0 = caget(I0_PV)
+        if (i0 is not None and i0_ref is not None and
+            abs(i0 - i0_ref) < TILT_I0_TOLERANCE*abs(i0_ref)):
+            print("#tune_at_energy %.1f: using cached pitch=%.3f, roll=%.3f" %
+                  (energy, pitch, roll))
+            fb_roll, fb_pitch = mono_tilt_feedback()
+            if fb_roll:
+                caput('13XRM:roll_pid.FBON', 1)
+            if fb_pitch:
+                caput('13XRM:pitch_pid.FBON', 1)
+            return 'cached'
+        #endif
+        print("#tune_at_energy %.1f: I0 changed (%s, was %s)" % (energy, i0, i0_ref))
+        how = 'fast'
+    #endif
+    if how == 'full':
+        set_mono_tilt()
+    else:
+        fast_mono_tilt()
+    save_mono_tilt(energy)
+    return how
+#enddef
+
+def energy_stack_time(energies, tune='full'):
+    "estimated time for energy moves and tuning for a list of energies"
+    entime, _n = learned_timing('move_energy', default=5.0)
+    fulltime, _n = learned_timing('set_mono_tilt', default=50.0)
+    total = 0.0
+    seen = []
+    for en in energies:
+        total += entime
+        key = _tilt_key(en)
+        if tune is None:
+            continue
+        elif key in seen or cached_mono_tilt(en) is not None:
+            total += 1.0
+        elif tune == 'full':
+            total += fulltime
+        else:
+            total += 0.3*fulltime
+        seen.append(key)
+    #endfor
+    return total
+#enddef
+
+def energy_stack(scanname, energies, fileform, tune='full',
+                 pitch_feedback=False, ckpt=None):
+    """
+    run a scan or map at each of a list of energies
+
+    Parameters:
+        scanname (string): name of scan
+        energies (list of floats): energies in eV
+        fileform (string): '%' format string for the file name at each energy.
+            any other '%' in the name must be written as '%%'
+        tune (None, 'fast' or 'full'): how to tune the mono tilt at energies
+            without cached values.  None for no tuning ['full']
+        pitch_feedback (True or False): whether to turn on pitch feedback
+            during each scan [False]
+        ckpt (dict or None): checkpoint from checkpoint_begin() [None]
+
+    Returns:
+        True if all energies were done, False if aborted.
+
+    Example:
+        energy_stack('MyMap', [5450, 5465, 5500], 'MyMap_sampleX_%.1feV.001')
+    """
+    for i, en in enumerate(energies):
+        if checkpoint_skip(ckpt, i): continue
+        if tune is None:
+            move_energy(en)
+        else:
+            tune_at_energy(en, full=(tune == 'full'))
+        if pitch_feedback:
+            caput('13XRM:pitch_pid.FBON', 1)
+
+        dfile = fileform % en
+        print("Start Map ", scanname, " Filename ", dfile)
+        dfile = timed_scan(scanname,  filename=dfile, meta={'energy': en})
+
+        if pitch_feedback:
+            caput('13XRM:pitch_pid.FBON', 0)
+        checkpoint_point(ckpt, i, dfile)
+        if check_scan_abort(): return False
+    #endfor
+    return True
+#enddef
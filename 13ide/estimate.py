@@ -0,0 +1,212 @@
+##
+## Time and data-volume estimates for scanning macros
+##
+##   Scanning macros called with dryrun=True enumerate their points and
+##   report the expected total time and output size, without moving
+##   anything.  Motor move times come from the motor record VELO and ACCL
+##   fields, per-point times are learned from earlier runs (see
+##   `record_timing()`), falling back to the scan definition.
+
+import json
+import glob
+import numpy as np
+from time import time
+from pathlib import Path
+
+TIMING_INFO = 'macro_timing'
+SCAN_OVERHEAD = 5.0    # seconds added per scan when nothing has been learned
+TIMING_WEIGHT = 0.2    # weight of newest measurement in running average
+
+def _timing_table():
+    "--private-- learned timing table: {key: [seconds, nbytes, count]}"
+    try:
+        return json.loads(_scandb.get_info(TIMING_INFO, '{}'))
+    except (TypeError, ValueError):
+        return {}
+#enddef
+
+def record_timing(key, elapsed, nbytes=None):
+    """
+    update learned time (and output size) for an operation
+
+    Parameters:
+        key (string): name of operation, such as 'scan:Fe_XAFS' or 'move_energy'
+        elapsed (float): time in seconds the operation took
+        nbytes (int or None): size of output written [None]
+    """
+    table = _timing_table()
+    tval, nval, count = table.get(key, [elapsed, nbytes, 0])
+    if count > 0:
+        tval = (1-TIMING_WEIGHT)*tval + TIMING_WEIGHT*elapsed
+        if nbytes is not None:
+            nval = nbytes if nval is None else (1-TIMING_WEIGHT)*nval + TIMING_WEIGHT*nbytes
+    table[key] = [tval, nval, count+1]
+    _scandb.set_info(TIMING_INFO, json.dumps(table))
+#enddef
+
+def learned_timing(key, default=None):
+    """
+    learned time and output size for an operation
+
+    Returns:
+        (seconds, nbytes), using `default` for the time if nothing
+        has been learned yet.  nbytes may be None.
+    """
+    tval, nval, count = _timing_table().get(key, [default, None, 0])
+    return tval, nval
+#enddef
+
+def scan_nominal_time(scanname):
+    """
+    nominal time for one run of a scan, from its scan definition:
+    number of points times dwell time, without any overhead.
+
+    Returns None if the scan definition cannot be understood.
+    """
+    sdef = _scandb.get_scandef(scanname)
+    if sdef is None:
+        return None
+    try:
+        sdict = json.loads(sdef.text)
+        if sdict.get('type', '') == 'xafs':
+            return sum([reg[2]*reg[3] for reg in sdict['regions']])
+        npts = 1
+        if 'positioners' in sdict:
+            npts = sdict['positioners'][0][-1]
+        for axis in ('inner', 'outer'):
+            if axis in sdict:
+                npts *= sdict[axis][-1]
+        dwell = sdict.get('dwelltime', 1.0)
+        if isinstance(dwell, (list, tuple)):
+            dwell = dwell[0]
+        return npts*dwell
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError) as exc:
+        print("#scan_nominal_time: cannot read scan '%s' (%s: %s), no estimate" %
+              (scanname, type(exc).__name__, exc))
+        return None
+#enddef
+
+def estimate_scan_time(scanname):
+    """
+    expected time and output size for one run of a named scan.
+
+    Returns:
+        (seconds, nbytes): learned from earlier runs if available,
+        otherwise the nominal scan time plus SCAN_OVERHEAD.
+    """
+    nominal = scan_nominal_time(scanname)
+    default = None if nominal is None else nominal + SCAN_OVERHEAD
+    return learned_timing('scan:%s' % scanname, default=default)
+#enddef
+
+def _datafiles_like(filename):
+    """--private-- names of the files in the user folder that the scan
+    server may write for `filename`: the name with any numeric extension
+    removed, followed by anything"""
+    fpath = Path(filename)
+    stem, _, ext = fpath.name.rpartition('.')
+    if not (stem and ext.isdigit()):
+        stem = fpath.name
+    folder = user_datafile(fpath.parent)
+    return set((fpath.parent / Path(name).name).as_posix()
+               for name in glob.glob(str(folder / (glob.escape(stem) + '*'))))
+#enddef
+
+def timed_scan(scanname, filename=None, nscans=1, meta=None):
+    """
+    run do_scan() and record its time and output size for later estimates
+
+    meta is an optional dict of extra catalog fields for the datafile,
+    such as {'position': 'SampleA'} (see catalog_add()).  The energy
+    defaults to the mono energy at the start of the scan.
+
+    Returns:
+        name of the data file written, relative to the user folder.  The
+        scan server increments the extension of `filename` when that file
+        exists, so this is the newest file for `filename` that was not
+        there before the scan, or `filename` if there is none.
+    """
+    meta = {} if meta is None else dict(meta)
+    if meta.get('energy', None) is None:
+        meta['energy'] = caget('13IDE:En:Energy')
+    before = set() if filename is None else _datafiles_like(filename)
+    t0 = time()
+    do_scan(scanname, filename=filename, nscans=nscans)
+    nbytes = None
+    if filename is not None:
+        written = _datafiles_like(filename) - before
+        if len(written) > 0:
+            filename = max(written, key=lambda name: user_datafile(name).stat().st_mtime)
+        fpath = user_datafile(filename)
+        if fpath.exists():
+            nbytes = fpath.stat().st_size
+    record_timing('scan:%s' % scanname, (time()-t0)/max(1, nscans), nbytes)
+    catalog_add(filename, scanname=scanname, tstart=t0, tend=time(),
+                nbytes=nbytes, **meta)
+    return filename
+#enddef
+
+def motor_move_time(pvname, distances):
+    """
+    time to make a series of moves of a motor, from its VELO and ACCL fields.
+
+    Parameters:
+        pvname (string): motor PV name, such as '13XRM:m1.VAL'
+        distances (float or array): distance(s) to move
+
+    Returns:
+        total time in seconds for all moves, or 0 if the
+        motor is unknown or its velocity cannot be read.
+    """
+    if pvname is None:
+        return 0.0
+    prefix = pvname.split('.')[0]
+    velo = caget(prefix + '.VELO')
+    accl = caget(prefix + '.ACCL')
+    if velo is None or velo <= 0:
+        return 0.0
+    if accl is None:
+        accl = 0.0
+    dist = np.abs(np.asarray(distances, dtype='float64'))
+    return float((dist/velo + accl*(dist > 0)).sum())
+#enddef
+
+def path_move_time(pvname, vals):
+    "time for a motor to visit each value in `vals`, in order"
+    return motor_move_time(pvname, np.diff(np.asarray(vals, dtype='float64')))
+#enddef
+
+def _fmt_seconds(secs):
+    "--private-- format a time in seconds as H:MM:SS"
+    secs = int(round(secs))
+    return '%d:%2.2d:%2.2d' % (secs//3600, (secs//60) % 60, secs % 60)
+#enddef
+
+def dryrun_report(macro, npts, point_time, nbytes=None, move_time=0.0, extra=0.0):
+    """
+    print and return estimated time and output size for a macro
+
+    Parameters:
+        macro (string): name of macro
+        npts (int): number of points
+        point_time (float or None): time per point, excluding motor moves
+        nbytes (float or None): output size per point
+        move_time (float): total time for motor moves [0]
+        extra (float): any other time, such as energy moves and tuning [0]
+
+    Returns:
+        dict with 'npts', 'seconds', and 'nbytes'
+    """
+    if point_time is None:
+        print("#dryrun %s: no timing known for points, counting moves only" % macro)
+        point_time = 0.0
+    total = npts*point_time + move_time + extra
+    out = {'npts': npts, 'seconds': total, 'nbytes': None}
+    msg = "#dryrun %s: %d points, %s (%.1f s/point, moves %s)" % (macro, npts,
+                    _fmt_seconds(total), point_time, _fmt_seconds(move_time))
+    if nbytes is not None:
+        out['nbytes'] = npts*nbytes
+        msg = "%s, %.1f MB" % (msg, npts*nbytes/1.e6)
+    print(msg)
+    return out
+#enddef
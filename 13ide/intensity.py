@@ -4,6 +4,8 @@
 # from time import sleep
 from time import monotonic as clock
 from time import sleep, ctime
+import asyncio
+import numpy as np
 # from common import check_abort_pause, check_scan_abort, caget, caput
 
 def feedback_off():
@@ -79,38 +81,145 @@ def scaler_mode(mode='autocount', count_time=1.0):
 #enddef
 
 
-def optimize_id():
+OPTID_I0_PV = '13IDE:scaler1.S2'
+OPTID_THETA_PV = '13IDA:m65.RBV'
+
+def _gaussian(x, amp, cen, sig, off):
+    "--private-- Gaussian peak plus constant"
+    return off + amp*np.exp(-0.5*((x-cen)/sig)**2)
+#enddef
+
+def _fit_id_peak(energies, i0vals, sigma=None):
+    """--private-- fit a Gaussian (plus constant) to I0 vs mono energy
+
+    With sigma given, only amplitude, center and offset are fit.
+
+    Returns:
+        (center, center_stderr, sigma), or None if the fit fails.
+    """
+    from scipy.optimize import curve_fit
+    energies = np.asarray(energies, dtype='float64')
+    i0vals = np.asarray(i0vals, dtype='float64')
+    imax = np.argmax(i0vals)
+    off = i0vals.min()
+    guess = [i0vals[imax]-off, energies[imax], sigma, off]
+    if sigma is None:
+        guess[2] = max(1.0, 0.15*np.ptp(energies))
+        model = _gaussian
+    else:
+        guess.pop(2)
+        model = lambda x, amp, cen, off: _gaussian(x, amp, cen, sigma, off)
+    try:
+        pars, cov = curve_fit(model, energies, i0vals, p0=guess)
+    except (RuntimeError, ValueError):
+        return None
+    cen, cen_err = pars[1], np.sqrt(abs(cov[1, 1]))
+    if not (np.isfinite(cen_err) and energies.min() <= cen <= energies.max()):
+        return None
+    return cen, cen_err, abs(pars[2]) if sigma is None else sigma
+#enddef
+
+def optimize_id(width=75.0, nrefine=5, sweep_time=10.0, readpv=OPTID_I0_PV):
     """
-    Optimize undulator by scanning ID energy and
-    finding highest I0 intensity
+    Optimize undulator offset by sweeping the mono energy (with ID
+    tracking off) across the undulator harmonic and fitting the peak of I0
+
+    Parameters:
+        width (float): half-width in eV of the coarse sweep [75]
+        nrefine (int): number of points stepped near the peak [5]
+        sweep_time (float): time in seconds for the coarse sweep [10]
+        readpv (string): PV for reading I0 [OPTID_I0_PV]
+
+    Returns:
+        (offset, uncertainty, nevals): ID offset and its uncertainty in keV,
+        and the number of I0 readings used.
 
     Example:
         optimize_id()
+
+    Note:
+        the coarse sweep is one continuous mono move, with I0 and the mono
+        angle recorded from their monitors.  The mono angle velocity is set
+        for the sweep to take `sweep_time`, and restored afterwards.
+        Because I0 lags the move slightly, the center is then refined with
+        `nrefine` stepped points within one peak width, fitted with the
+        width from the sweep.  The sweep gets one I0 reading for each
+        update of `readpv`, so a faster readout (such as an ADC channel
+        of the I0 amplifier) gives more points than the scaler.
     """
-    caput('13IDE:En:id_track', 0)
+    t0 = clock()
     und_energy  = caget('ID13us:ScanEnergy')
     mono_energy = caget('13IDE:En:Energy')
-    energies = linspace(-75, 75, 31) + mono_energy
-    caput('13IDE:En:Energy', energies[0])
-    sleep(2.0)
-    best_en  = mono_energy
-    best_i0  = -10.0
-    i0vals = []
-    for en in energies:
-       caput('13IDE:En:Energy', en, wait=True)
-       sleep(1.00)
-       i0val = caget('13IDE:scaler1.S2')
-       i0vals.append(i0val)
-       if i0val > best_i0:
-         best_i0 = i0val
-         best_en = en
-       #endif
-    #endfor
-    caput('13IDE:En:id_track', 1)
+    dspace      = caget('13IDE:En:dspace')
+    theta_motor = OPTID_THETA_PV.split('.')[0]
+    velo_save   = caget(theta_motor + '.VELO')
+    caput('13IDE:En:id_track', 0)
+    try:
+        caput('13IDE:En:Energy', mono_energy-width, wait=True)
+
+        # coarse: continuous sweep, pairing each new I0 with the latest angle
+        theta_pv, i0_pv = get_pv(OPTID_THETA_PV), get_pv(readpv)
+        thetas = np.degrees(np.arcsin(HC/(2*dspace*np.array([mono_energy-width,
+                                                             mono_energy+width]))))
+        latest = {'theta': theta_pv.get()}
+        sweep = []
+        def onTheta(value=None, **kws):
+            latest['theta'] = value
+        def onI0(value=None, **kws):
+            if latest['theta'] is not None and value is not None:
+                sweep.append((latest['theta'], value))
+        #enddef
+        cb_theta = theta_pv.add_callback(onTheta)
+        cb_i0 = i0_pv.add_callback(onI0)
+        tsweep = clock()
+        try:
+            caput(theta_motor + '.VELO', abs(thetas[1]-thetas[0])/sweep_time, wait=True)
+            caput('13IDE:En:Energy', mono_energy+width, wait=True)
+        finally:
+            theta_pv.remove_callback(cb_theta)
+            i0_pv.remove_callback(cb_i0)
+            caput(theta_motor + '.VELO', velo_save, wait=True)
+        #endtry
+        tsweep = clock()-tsweep
+        record_timing('optimize_id_sweep', tsweep)
+        nevals = len(sweep)
+        best_en, best_err, sigma = mono_energy, width, None
+        if nevals > 4:
+            theta, i0vals = np.array(sweep).T
+            energies = HC/(2*dspace*np.sin(np.radians(theta)))
+            fit = _fit_id_peak(energies, i0vals)
+            if fit is None:
+                best_en = energies[np.argmax(i0vals)]
+                best_err = 0.5*np.ptp(energies)/nevals
+            else:
+                best_en, best_err, sigma = fit
+        #endif
+
+        # refine: step through the peak
+        if sigma is not None and nrefine > 2:
+            energies = best_en + sigma*np.linspace(-1, 1, nrefine)
+            i0vals = []
+            for en in energies:
+                caput('13IDE:En:Energy', en, wait=True)
+                wait_settled('optimize_id', [readpv], default=1.0, rtol=0.02, fresh=True)
+                i0vals.append(caget(readpv))
+            #endfor
+            nevals += nrefine
+            fit = _fit_id_peak(energies, i0vals, sigma=sigma)
+            if fit is not None:
+                best_en, best_err, sigma = fit
+        #endif
+    finally:
+        caput('13IDE:En:id_track', 1)
+    #endtry
     offset = und_energy - best_en*0.001
-    print('best ID offset = %.3f keV ' % offset)
+    elapsed = clock()-t0
+    record_timing('optimize_id', elapsed)
+    print('best ID offset = %.4f +/- %.4f keV (%d I0 readings, sweep %.1f s, total %.1f s)' %
+          (offset, best_err*0.001, nevals, tsweep, elapsed))
     caput('13IDE:En:id_off', offset)
     caput('13IDE:En:Energy', best_en)
+    return offset, best_err*0.001, nevals
 #enddef
 
 
@@ -261,20 +370,38 @@ def autoset_gain(prefix='13IDE:A1', scaler='13IDE:I0_Volts', offset=25, count=0)
        count (int):     Recursion count to avoid infinite loop.
     Returns:
        success (True or False): whether setting the gain succeeded.
+
+    See Also:
+       autoset_gain_async
+    """
+    return run_async(autoset_gain_async(prefix=prefix, scaler=scaler,
+                                        offset=offset, count=count))
+#enddef
+
+async def autoset_gain_async(prefix='13IDE:A1', scaler='13IDE:I0_Volts',
+                             offset=25, count=0):
+    """
+    async version of autoset_gain(), so that the gains of several
+    amplifiers can be set at the same time
+
+    Example:
+       run_async(autoset_gain_async(prefix='13IDE:A1'),
+                 autoset_gain_async(prefix='13IDE:A2', scaler='13IDE:I1_Volts'))
     """
     # wait_for_shutters(hours=1)
     I0Max = 2.8
     I0Min = 0.7
-    i0val = caget(scaler)
-    sleep(0.5)
+    settle_key = 'gain:%s' % scaler
+    await wait_settled_async(settle_key, [scaler], default=0.5, rtol=0.02)
+    i0val = await aget(scaler)
     if i0val < I0Max and i0val > I0Min:
         return True
 
     for i in range(2):
-        unit = caget("%ssens_unit.VAL" % prefix)
-        sens = caget("%ssens_num.VAL"  % prefix)
-        sleep(0.5)
-        i0val = caget(scaler)
+        unit = await aget("%ssens_unit.VAL" % prefix)
+        sens = await aget("%ssens_num.VAL"  % prefix)
+        await wait_settled_async(settle_key, [scaler], default=0.5, rtol=0.02)
+        i0val = await aget(scaler)
         if i0val > I0Max:
            sens = sens + 1
            if sens > 8:
@@ -295,8 +422,8 @@ def autoset_gain(prefix='13IDE:A1', scaler='13IDE:I0_Volts', offset=25, count=0)
         msg = "changing SRS sensitivity"
         print(f"{msg} i0={i0val:.3f} -> {SRS_SENS[sens]} {SRS_UNITS[unit]}")
 
-        caput("%ssens_unit.VAL" % prefix, unit)
-        caput("%ssens_num.VAL"  % prefix, sens)
+        await aput("%ssens_unit.VAL" % prefix, unit, wait=False)
+        await aput("%ssens_num.VAL"  % prefix, sens, wait=False)
 
         ## set offsets
         if sens > 2:
@@ -307,15 +434,16 @@ def autoset_gain(prefix='13IDE:A1', scaler='13IDE:I0_Volts', offset=25, count=0)
             off_unit = unit - 1
         #endif
 
-        caput("%soffset_unit.VAL" % prefix, off_unit)
-        caput("%soffset_num.VAL"  % prefix, off_sens)
-        caput("%soff_u_put.VAL"   % prefix, offset)
-        _scandb.set_info('needs_offset', 1)
-        sleep(1.0)
-        i0val = caget(scaler)
+        await aput("%soffset_unit.VAL" % prefix, off_unit, wait=False)
+        await aput("%soffset_num.VAL"  % prefix, off_sens, wait=False)
+        await aput("%soff_u_put.VAL"   % prefix, offset, wait=False)
+        await adb(_scandb.set_info, 'needs_offset', 1)
+        await wait_settled_async(settle_key, [scaler], default=1.0, rtol=0.02,
+                                 fresh=True)
+        i0val = await aget(scaler)
         if (i0val > I0Min) and (i0val < I0Max):
             break
-    scaler_mode(mode='autocount')
+    await acall(scaler_mode, mode='autocount')
     return True
 #enddef
 
@@ -373,25 +501,45 @@ def find_max_intensity(drivepv, vals, readpv, minval=0.1, debug=False):
         minval (float):   minimum acceptable intensity [defualt = 0.1]
 
     Returns:
-        best_drive_value, max_readpv, max_read_pv2
+        best_drive_value, max_readpv
     Note:
        if the best intensity is below minval, the position is
        moved back to the original position.
 
+    See Also:
+       find_max_intensity_async
+    """
+    xbest, i1max, ok = run_async(find_max_intensity_async(drivepv, vals, readpv,
+                                                          minval=minval, debug=debug))
+    return xbest, i1max
+#enddef
+
+async def find_max_intensity_async(drivepv, vals, readpv, minval=0.1, debug=False):
     """
-    xorig = xbest = get_pv(drivepv).get()
-    i1max = i1 = get_pv(readpv).get()
-    caput(drivepv, xorig+vals[0])
+    async version of find_max_intensity(), so that independent
+    sweeps (or a sweep and other moves) can run at the same time
+
+    Returns:
+        best_drive_value, max_readpv, ok
+        where ok is False if the sweep was aborted or a move did not
+        complete: then best_drive_value is the original position, and
+        the drive is left where the sweep stopped.
+    """
+    xorig = xbest = await aget(drivepv)
+    i1max = i1 = await aget(readpv)
+    await aput(drivepv, xorig+vals[0], wait=False)
 
     for _val in vals:
         val = xorig + _val
-        caput(drivepv, val, wait=True)
-        sleep(0.2)
-        i1 = caget(readpv)
+        if not await aput(drivepv, val, wait=True):
+            return xorig, i1max, False
+        await wait_settled_async('intensity:%s' % readpv, [readpv], default=0.2,
+                                 fresh=True)
+        i1 = await aget(readpv)
         if i1 > i1max:
             xbest, i1max = val, i1
-        if get_dbinfo('request_abort', as_bool=True):
-            return
+        if await adb(get_dbinfo, 'request_abort', as_bool=True):
+            return xorig, i1max, False
         if debug:
             print(val, i1, i1max, xbest)
     #endfor
@@ -400,12 +548,31 @@ def find_max_intensity(drivepv, vals, readpv, minval=0.1, debug=False):
         print(" i1max too small ", i1max, minval)
     #endif
     print(f" move {drivepv}  {xbest:.3f}")
-    caput(drivepv, xbest, wait=True)
-    sleep(0.05)
-    return xbest, i1max
+    await aput(drivepv, xbest, wait=True)
+    await asyncio.sleep(0.05)
+    return xbest, i1max, True
 #enddef
 
 
+def mono_tilt_feedback(enable_fb_roll=None, enable_fb_pitch=None):
+    """
+    whether roll and pitch feedback should be on after tuning the
+    mono tilt, from the mono angle unless given
+
+    Returns:
+        (enable_fb_roll, enable_fb_pitch)
+    """
+    if enable_fb_pitch is None:
+        # enable_fb_pitch = caget('13IDE:En:Energy') < 3000.0
+        enable_fb_pitch = caget('13IDA:m65.VAL') > 46.
+    #endif
+    if enable_fb_roll is None:
+        # enable_fb_roll = caget('13IDE:En:Energy') < 3000.0
+        enable_fb_roll = caget('13IDA:m65.VAL') > 35.
+    #endif
+    return enable_fb_roll, enable_fb_pitch
+#enddef
+
 def set_mono_tilt(enable_fb_roll=None, enable_fb_pitch=None):
     """
     Adjust IDE monochromator 2nd crystal tilt and roll to maximize intensity.
@@ -433,14 +600,8 @@ def set_mono_tilt(enable_fb_roll=None, enable_fb_pitch=None):
     sum_pv  = '13XRM:QE2:SumAll:MeanValue_RBV'
     i0_minval = 0.1   # expected smallest I0 Voltage
 
-    if enable_fb_pitch is None:
-        # enable_fb_pitch = caget('13IDE:En:Energy') < 3000.0
-        enable_fb_pitch = caget('13IDA:m65.VAL') > 46.
-    #endif
-    if enable_fb_roll is None:
-        # enable_fb_roll = caget('13IDE:En:Energy') < 3000.0
-        enable_fb_roll = caget('13IDA:m65.VAL') > 35.
-    #endif
+    enable_fb_roll, enable_fb_pitch = mono_tilt_feedback(enable_fb_roll,
+                                                         enable_fb_pitch)
 
     caput('13XRM:pitch_pid.FBON', 0)
     caput('13XRM:roll_pid.FBON', 0)
@@ -503,6 +664,7 @@ def set_mono_tilt(enable_fb_roll=None, enable_fb_pitch=None):
         sleep(0.5)
         caput('13XRM:pitch_pid.FBON', 1)
     #endif
+    record_timing('set_mono_tilt', clock()-t0)
     print('#-- set_mono_tilt done (%.2f seconds)' % (clock()-t0))
 #enddef
 
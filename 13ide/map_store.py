@@ -0,0 +1,205 @@
+##
+## Consolidated HDF5 map files
+##
+##   With map consolidation enabled, the mapping macros (grid_scan,
+##   line_scan, transect_scan, line_xrd, grid_xrd, line_xrf, ...) append the
+##   data file written at each point into one HDF5 file per map, '<map>.h5'
+##   in the user folder, holding
+##       data       (ny, nx, ...)    chunked one point per chunk, gzip compressed
+##       positions  (ny, nx, nmotors) motor values at each point
+##       done       (ny, nx)         whether each point has data
+##       files      (ny, nx)         name of the per-point file
+##   The per-point files are kept unless keep_files=False.  Either way, a
+##   point recorded as done here counts as done for resume() (see
+##   mapstore_files()).
+
+import json
+import numpy as np
+from os.path import commonprefix
+from pathlib import Path
+
+MAPSTORE_INFO = 'map_consolidation'
+
+def enable_map_consolidation(enable=True, keep_files=True):
+    """
+    enable or disable consolidation of per-point map files into HDF5
+
+    Parameters:
+        enable (True or False): whether to consolidate [True]
+        keep_files (True or False): whether to keep the per-point
+            files after they are consolidated [True]
+    """
+    _scandb.set_info(MAPSTORE_INFO, json.dumps({'enable': enable,
+                                                'keep_files': keep_files}))
+#enddef
+
+def disable_map_consolidation():
+    enable_map_consolidation(False)
+#enddef
+
+def _mapstore_config():
+    "--private-- map consolidation settings"
+    try:
+        return json.loads(_scandb.get_info(MAPSTORE_INFO, '{}'))
+    except (TypeError, ValueError):
+        return {}
+#enddef
+
+def _read_point_file(fpath):
+    "--private-- read the data of one per-point file as an array"
+    suffix = fpath.suffix.lower()
+    if suffix in ('.tif', '.tiff'):
+        from tifffile import imread
+        return imread(fpath)
+    with open(fpath, 'r') as fh:
+        lines = fh.readlines()
+    # GSE MCA files: counts follow the 'DATA:' line
+    for i, line in enumerate(lines):
+        if line.startswith('DATA:'):
+            return np.loadtxt(lines[i+1:], ndmin=2)
+    return np.loadtxt(lines, comments='#', ndmin=2)
+#enddef
+
+def mapstore_begin(plan, mapname=None):
+    """
+    start (or continue) the consolidated HDF5 file for a map
+
+    Parameters:
+        plan (dict): scan plan of the map
+        mapname (string or None): name of map
+            [None, the common start of the plan file names]
+
+    Returns:
+        store dictionary to pass to mapstore_add(), or None if
+        map consolidation is not enabled.
+    """
+    conf = _mapstore_config()
+    if not conf.get('enable', False):
+        return None
+    if mapname is None:
+        mapname = commonprefix([f for f in plan['filenames'] if f is not None])
+        mapname = mapname.rstrip('_.') or 'map'
+    fname = user_datafile('%s.h5' % mapname)
+
+    import h5py
+    ny, nx = plan['shape']
+    with h5py.File(fname, 'a') as fh:
+        if 'positions' not in fh:
+            fh.attrs['motors'] = json.dumps(plan['motors'])
+            fh.attrs['pvnames'] = json.dumps(plan['pvnames'])
+            fh.create_dataset('positions', shape=(ny, nx, len(plan['motors'])),
+                              dtype='float64', fillvalue=np.nan)
+            fh.create_dataset('done', shape=(ny, nx), dtype=bool)
+            fh.create_dataset('files', shape=(ny, nx),
+                              dtype=h5py.string_dtype())
+    #endwith
+    return {'file': fname, 'plan': plan,
+            'keep_files': conf.get('keep_files', True)}
+#enddef
+
+def mapstore_add(store, i, filename):
+    """
+    add the data file for point `i` of a map to its HDF5 file
+
+    Parameters:
+        store (dict or None): from mapstore_begin()
+        i (int): point number in the map plan
+        filename (string): per-point data file
+    """
+    if store is None or filename is None:
+        return
+    fpath = Path(filename)
+    if not fpath.is_absolute():
+        fpath = user_datafile(filename)
+    if not fpath.exists():
+        print("#mapstore: cannot find '%s'" % filename)
+        return
+    try:
+        data = np.asarray(_read_point_file(fpath))
+    except Exception as exc:
+        print("#mapstore: cannot read '%s': %s" % (filename, exc))
+        return
+
+    import h5py
+    plan = store['plan']
+    iy, ix = plan['index'][i]
+    ny, nx = plan['shape']
+    with h5py.File(store['file'], 'a') as fh:
+        dset = fh.get('data', None)
+        if dset is None:
+            dset = fh.create_dataset('data', shape=(ny, nx) + data.shape,
+                                     maxshape=(ny, nx) + (None,)*data.ndim,
+                                     chunks=(1, 1) + data.shape,
+                                     dtype=data.dtype, compression='gzip',
+                                     compression_opts=4)
+        if dset.ndim != data.ndim + 2:
+            print("#mapstore: '%s' does not match map data" % filename)
+            return
+        # scans at different points may have different numbers of rows
+        newshape = [max(n, m) for n, m in zip(dset.shape[2:], data.shape)]
+        if newshape != list(dset.shape[2:]):
+            dset.resize((ny, nx) + tuple(newshape))
+        dset[(iy, ix) + tuple([slice(0, n) for n in data.shape])] = data
+        fh['positions'][iy, ix] = plan['points'][i]
+        fh['done'][iy, ix] = True
+        fh['files'][iy, ix] = str(filename)
+    #endwith
+    if not store['keep_files']:
+        fpath.unlink()
+#enddef
+
+def mapstore_files():
+    """
+    per-point files held in the consolidated map files of the user folder
+
+    Returns:
+        set of per-point file names recorded as done
+    """
+    out = set()
+    try:
+        import h5py
+    except ImportError:
+        return out
+    for fname in user_datafile().glob('*.h5'):
+        try:
+            with h5py.File(fname, 'r') as fh:
+                if 'done' not in fh or 'files' not in fh:
+                    continue
+                done = fh['done'][()]
+                files = fh['files'][()]
+        except Exception:
+            continue
+        for name in files[done]:
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            out.add(name)
+    #endfor
+    return out
+#enddef
+
+def mapstore_read(mapname):
+    """
+    open a consolidated map file for reading
+
+    Parameters:
+        mapname (string): name of map or of the .h5 file
+
+    Returns:
+        open h5py File: datasets are read chunk by chunk on access,
+        so that fh['data'][()] reads the whole map in one call and
+        fh['data'][iy, ix] reads only one point.
+
+    Example:
+        fh = mapstore_read('MyScan_sampleX_y')
+        done = fh['done'][()]
+        data = fh['data'][()]
+        fh.close()
+    """
+    import h5py
+    fname = Path(mapname)
+    if fname.suffix != '.h5':
+        fname = Path('%s.h5' % mapname)
+    if not fname.is_absolute():
+        fname = user_datafile(fname.name)
+    return h5py.File(fname, 'r', rdcc_nbytes=64*1024*1024)
+#enddef
@@ -0,0 +1,172 @@
+##
+## Motion completion policy
+##
+##   caput(motor, value, wait=True) returns only when the motor record is
+##   done, including backlash, retries and the final settling of the
+##   record.  For axes with an in-position policy, move_in_position()
+##   instead watches the readback (.RBV) and returns as soon as it has
+##   stayed within a deadband of the target for a settle window.  Full
+##   completion of the put is always accepted too, so axes without a
+##   policy (or whose readback never settles) behave as with wait=True.
+##
+##   The move is watched by the move watchdog (see watchdog.py), which
+##   handles stalled and overdue moves.
+##
+##   Policies are kept per motor record in the 'motion_policy' info entry,
+##   as {record: {'deadband': d, 'settle': s}}.  A deadband of None uses
+##   the retry deadband (.RDBD) of the motor record.
+
+import json
+from time import sleep, monotonic as clock
+
+MOTION_INFO = 'motion_policy'
+MOTION_POLL = 0.005      # seconds between readback checks
+
+def _motor_record(pvname):
+    "--private-- motor record name for a PV name, such as '13XRM:m1.VAL'"
+    return pvname.split('.')[0]
+#enddef
+
+def _motion_policies():
+    "--private-- table of in-position policies"
+    try:
+        return json.loads(_scandb.get_info(MOTION_INFO, '{}'))
+    except (TypeError, ValueError):
+        return {}
+#enddef
+
+def set_motion_policy(motor, deadband=None, settle=0.05, enable=True):
+    """
+    set the in-position policy for a motor
+
+    Parameters:
+        motor (string): motor name (as for _getPV) or PV name
+        deadband (float or None): allowed distance from target
+            [None, the motor record retry deadband .RDBD]
+        settle (float): time in seconds the readback must stay
+            within the deadband [0.05]
+        enable (True or False): use the policy, or wait for full
+            completion for this motor [True]
+
+    Example:
+        set_motion_policy('finex', deadband=0.0002, settle=0.03)
+    """
+    pvname = _getPV(motor) or motor
+    policies = _motion_policies()
+    if enable:
+        policies[_motor_record(pvname)] = {'deadband': deadband, 'settle': settle}
+    else:
+        policies.pop(_motor_record(pvname), None)
+    _scandb.set_info(MOTION_INFO, json.dumps(policies))
+#enddef
+
+def motion_policy(pvname, policies=None):
+    """
+    in-position policy for a motor PV, or None to wait for full completion
+
+    Parameters:
+        pvname (string): motor PV name
+        policies (dict or None): policy table, to avoid reading it
+            again [None, read from the 'motion_policy' info entry]
+
+    Returns:
+        dict with 'deadband' (resolved from .RDBD if needed) and 'settle'
+    """
+    if policies is None:
+        policies = _motion_policies()
+    record = _motor_record(pvname)
+    policy = policies.get(record, None)
+    if policy is None:
+        return None
+    policy = dict(policy)
+    if policy.get('deadband', None) is None:
+        policy['deadband'] = caget(record + '.RDBD')
+    if policy['deadband'] is None:
+        return None
+    return policy
+#enddef
+
+def motion_policies(pvnames):
+    """
+    in-position policies for a list of motor PVs, reading the policy
+    table (and any .RDBD) only once, as for all moves of a scan plan
+
+    Returns:
+        dict of pvname: policy (or None)
+    """
+    policies = _motion_policies()
+    return {pvname: motion_policy(pvname, policies=policies) for pvname in pvnames}
+#enddef
+
+def move_in_position(pvname, value, timeout=60.0, policy='auto'):
+    """
+    move a motor and wait until it is in position
+
+    Parameters:
+        pvname (string): motor PV name, such as '13XRM:m1.VAL'
+        value (float): target value
+        timeout (float): maximum time to wait [60]
+        policy (dict, None or 'auto'): in-position policy, None for
+            full completion ['auto', from motion_policy()]
+
+    Returns:
+        'in_position' if released by the readback, 'complete' if the put
+        completed, or 'stopped' if the watchdog stopped the move.
+
+    Note:
+        after an early release, the completion of that put is still
+        outstanding, and may be reported for the next put to the same
+        motor.  So for motors with a policy, completion only counts once
+        the readback is within the deadband of the new target, or, if the
+        motor stopped outside it (retries exhausted, encoder noise), once
+        DMOV is 1 and the readback has been steady for the settle time.
+        That case is printed as a warning.
+    """
+    if policy == 'auto':
+        policy = motion_policy(pvname)
+    pv = get_pv(pvname)
+    watch = watch_begin(pvname, value, timeout=timeout)
+    pv.put(value, use_complete=True)
+    rbv = dmov = None
+    if policy is not None:
+        rbv = get_pv(_motor_record(pvname) + '.RBV')
+        dmov = get_pv(_motor_record(pvname) + '.DMOV')
+    t_in = None
+    done = {'t': None, 'readback': None}
+    while True:
+        now = clock()
+        if pv.put_complete:
+            if rbv is None:
+                break
+            readback = rbv.get()
+            if readback is not None and abs(readback - value) <= policy['deadband']:
+                break
+            # completed outside the deadband: accept once steady
+            if dmov.get() != 1 or readback != done['readback']:
+                done['t'], done['readback'] = now, readback
+            elif now - done['t'] >= policy['settle']:
+                print("#move_in_position: %s stopped at %s, outside deadband of %s" %
+                      (pvname, readback, value))
+                break
+        #endif
+        problem = watch_check(watch)
+        if problem is not None:
+            t_in = None
+            if not watch_recover(watch, problem):
+                return 'stopped'
+        if rbv is not None:
+            readback = rbv.get()
+            if readback is not None and abs(readback - value) <= policy['deadband']:
+                if t_in is None:
+                    t_in = now
+                elif now - t_in >= policy['settle']:
+                    watch_end(watch)
+                    return 'in_position'
+            else:
+                t_in = None
+        #endif
+        sleep(MOTION_POLL)
+    #endwhile
+    watch_end(watch)
+    return 'complete'
+#enddef
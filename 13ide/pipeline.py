@@ -0,0 +1,142 @@
+##
+## Scan-to-scan pipelining
+##
+##   do_scan() returns only after the data file is written.  With
+##   pipelining enabled, scan_with_prefetch() watches the scan server
+##   Status PV, and as soon as it leaves 'Running' for one of
+##   ACQUIRE_DONE_STATES (that is, the beam-on part of the scan is over)
+##   it starts the moves for the next point, without waiting, while the
+##   file is still being finalized.
+##
+##   With nscans > 1, the moves are only started after the last repeat.
+##   Moves for a named position are made one after another, in instrument
+##   order, as move_samplestage() does.
+##
+##   The loop still makes its usual (waiting) move to the next point after
+##   do_scan() returns, so abort checks happen exactly where they did
+##   before: the early start only removes the dead time.  An error starting
+##   a move is raised in the scan thread once the scan is done.  No moves
+##   are started if Abort has been requested, or if the Status PV never
+##   reports 'Running' (in which case the scan runs as before).
+
+PREFETCH_JOIN_MARGIN = 2.0   # factor on the estimated time of ordered moves
+PREFETCH_JOIN_MIN = 5.0      # seconds to wait for the moves to be started
+
+from epics.ca import CAThread
+
+PIPELINE_INFO = 'scan_pipelining'
+ACQUIRE_DONE_STATES = ('finishing', 'idle')
+
+def enable_scan_pipelining(enable=True):
+    """
+    enable or disable starting the moves for the next point
+    while the data file of the current point is written
+    """
+    _scandb.set_info(PIPELINE_INFO, int(enable))
+#enddef
+
+def disable_scan_pipelining():
+    enable_scan_pipelining(False)
+#enddef
+
+def _status_pvs():
+    "--private-- scan server Status and Abort PVs, or None if not available"
+    if int(_scandb.get_info(PIPELINE_INFO, 0)) == 0:
+        return None
+    eprefix = _scandb.get_info('epics_status_prefix', None)
+    if eprefix is None:
+        return None
+    status = get_pv(f'{eprefix}Status')
+    abort = get_pv(f'{eprefix}Abort')
+    if not (status.wait_for_connection(timeout=0.5) and
+            abort.wait_for_connection(timeout=0.5)):
+        return None
+    return status, abort
+#enddef
+
+def _start_moves(moves, abort, errors, ordered=False):
+    """--private-- start moves, unless Abort is set.
+    With ordered=True, each move is finished before the next is started,
+    and no more moves are started after an error."""
+    for pvname, value in moves:
+        if abort.get() not in (0, None):
+            return
+        try:
+            caput(pvname, value, wait=ordered, timeout=60.0)
+        except Exception as exc:
+            errors.append((pvname, exc))
+            if ordered:
+                return
+    #endfor
+#enddef
+
+def scan_with_prefetch(scanname, filename=None, nscans=1, meta=None, moves=None,
+                       ordered=False):
+    """
+    run timed_scan(), starting the moves for the next point as soon as
+    acquisition has ended
+
+    Parameters:
+        scanname, filename, nscans, meta: as for timed_scan()
+        moves (list or None): (pvname, value) pairs for the next point [None]
+        ordered (True or False): make the moves one after another, in the
+            order given, as for a named position [False]
+
+    Returns:
+        name of the data file written, as from timed_scan()
+
+    Raises:
+        the first error from starting the moves, after the scan is done
+
+    Note:
+        moves are only started early with scan pipelining enabled (see
+        enable_scan_pipelining()).  The caller must still make its usual
+        move to the next point, which then waits for these moves to finish.
+    """
+    pvs = None
+    if moves is not None and len(moves) > 0:
+        pvs = _status_pvs()
+    if pvs is None:
+        return timed_scan(scanname, filename=filename, nscans=nscans, meta=meta)
+    status, abort = pvs
+
+    # wait for ordered moves for up to their estimated time
+    tjoin = PREFETCH_JOIN_MIN
+    if ordered:
+        for pvname, value in moves:
+            current = caget(pvname)
+            if current is not None:
+                tjoin += PREFETCH_JOIN_MARGIN*motor_move_time(pvname, abs(value-current))
+    #endif
+    errors = []
+    # count acquisitions: only the end of the last repeat starts the moves
+    state = {'running': False, 'ndone': 0, 'thread': None}
+    def onStatus(char_value=None, **kws):
+        sval = str(char_value).lower()
+        if sval == 'running':
+            state['running'] = True
+        elif sval in ACQUIRE_DONE_STATES and state['running']:
+            state['running'] = False
+            state['ndone'] += 1
+            if state['ndone'] >= max(1, nscans) and state['thread'] is None:
+                state['thread'] = CAThread(target=_start_moves,
+                                           args=(moves, abort, errors, ordered))
+                state['thread'].start()
+    #enddef
+
+    cb_index = status.add_callback(onStatus)
+    try:
+        out = timed_scan(scanname, filename=filename, nscans=nscans, meta=meta)
+    finally:
+        status.remove_callback(cb_index)
+        if state['thread'] is not None:
+            state['thread'].join(timeout=tjoin)
+            if state['thread'].is_alive():
+                print("#scan_with_prefetch: moves not done after %.1f s" % tjoin)
+    #endtry
+    for pvname, exc in errors:
+        print("#scan_with_prefetch: could not start move of %s: %s" % (pvname, exc))
+    if len(errors) > 0:
+        raise errors[0][1]
+    return out
+#enddef
@@ -0,0 +1,300 @@
+##
+## Bulk access to named positions
+##
+##   read_positions() loads every named position of an instrument with one
+##   query per table (selecting the values of that instrument's positions
+##   only), as a NumPy array of (position, pv) values, instead of
+##   one get_position_vals() call per position.  write_positions() saves a
+##   whole array of positions, skipping those that are already saved with
+##   the same values.
+
+import re
+import numpy as np
+
+def instrument_pvnames(instname):
+    """list of PV names for an instrument, in instrument order
+    (the display order, which is also the order positions are restored in)"""
+    inst = _scandb.get_rows('instrument', where={'name': instname},
+                            limit_one=True)
+    if inst is None:
+        return []
+    pvnames = {}
+    for row in _scandb.get_rows('pv'):
+        pvnames[row.id] = row.name
+    rows = [row for row in
+            _scandb.get_rows('instrument_pv', where={'instrument_id': inst.id})
+            if row.pv_id in pvnames]
+    rows.sort(key=lambda row: getattr(row, 'display_order', 0) or 0)
+    return [pvnames[row.pv_id] for row in rows]
+#enddef
+
+def read_positions(instname, pvnames=None):
+    """
+    read all named positions of an instrument at once
+
+    Parameters:
+        instname (string): name of instrument
+        pvnames (list or None): PV names to read [None, all PVs of instrument]
+
+    Returns:
+        (names, pvnames, values), with values an array of shape
+        (len(names), len(pvnames)), and nan for values not saved.
+
+    Example:
+        names, pvs, vals = read_positions('SampleStage')
+    """
+    inst = _scandb.get_rows('instrument', where={'name': instname},
+                            limit_one=True)
+    if inst is None:
+        print("Error: cannot find instrument '%s'" % instname)
+        return [], [], np.zeros((0, 0))
+    #endif
+    pvrows = {}
+    for row in _scandb.get_rows('pv'):
+        pvrows[row.id] = row.name
+    if pvnames is None:
+        pvnames = [pvrows[row.pv_id] for row in
+                   _scandb.get_rows('instrument_pv', where={'instrument_id': inst.id})
+                   if row.pv_id in pvrows]
+    #endif
+    pvindex = {}
+    for i, pvname in enumerate(pvnames):
+        pvindex[pvname] = i
+
+    names, posindex = [], {}
+    for row in _scandb.get_rows('position', where={'instrument_id': inst.id}):
+        posindex[row.id] = len(names)
+        names.append(row.name)
+    #endfor
+    values = np.full((len(names), len(pvnames)), np.nan)
+    if len(posindex) == 0:
+        return names, list(pvnames), values
+    # only the values of this instrument's positions
+    ptab = _scandb.get_table('position_pv')
+    query = ptab.select().where(ptab.c.position_id.in_(list(posindex)))
+    for row in _scandb.execute(query).fetchall():
+        ipos = posindex.get(row.position_id, None)
+        ipv = pvindex.get(pvrows.get(row.pv_id, None), None)
+        if ipos is not None and ipv is not None:
+            values[ipos, ipv] = float(row.value)
+    #endfor
+    return names, list(pvnames), values
+#enddef
+
+def positions_dict(names, values):
+    "dictionary of name: list of values, from read_positions() output"
+    out = {}
+    for name, vals in zip(names, values):
+        out[name] = vals.tolist()
+    return out
+#enddef
+
+def write_positions(instname, names, pvnames, values, tol=1.e-6):
+    """
+    save a set of named positions for an instrument
+
+    Parameters:
+        instname (string): name of instrument
+        names (list of strings): position names
+        pvnames (list of strings): PV names
+        values (array): values, shape (len(names), len(pvnames))
+        tol (float): positions already saved with all values within
+            tol are not rewritten [1.e-6]
+
+    Returns:
+        number of positions written
+
+    Note:
+        saved positions with the same names are overwritten.
+    """
+    values = np.asarray(values, dtype='float64').reshape((len(names), len(pvnames)))
+    onames, opvs, ovals = read_positions(instname, pvnames=pvnames)
+    oindex = {}
+    for i, name in enumerate(onames):
+        oindex[name] = i
+    nwrite = 0
+    for name, vals in zip(names, values):
+        i = oindex.get(name, None)
+        if i is not None and np.all(abs(ovals[i] - vals) <= tol):
+            continue
+        _instdb.save_position(instname, name, dict(zip(pvnames, vals.tolist())))
+        nwrite += 1
+    #endfor
+    return nwrite
+#enddef
+
+##
+## Spatial index of named positions
+##
+##   position_index() keeps the positions of an instrument in memory, with
+##   an (x, y) sample coordinate for each.  On each call only positions
+##   that were added, changed, or removed since the last call are re-read.
+##   For stages with coarse and fine motors (6 or more PVs, fine X, Y
+##   first and coarse X, Y as the 5th and 6th, as for SampleStage), the
+##   sample coordinate is coarse + fine.
+
+_POSITION_INDEX = {}
+
+def _index_xy(values):
+    "--private-- sample (x, y) coordinates from position values"
+    if values.shape[1] >= 6:
+        return values[:, [4, 5]] + np.nan_to_num(values[:, [0, 1]])
+    return values[:, :2]
+#enddef
+
+def position_index(instname=None):
+    """
+    in-memory index of the named positions of an instrument
+
+    Parameters:
+        instname (string or None): name of instrument
+            [None, the samplestage instrument]
+
+    Returns:
+        dict with 'names' (list), 'pvnames' (list), 'values' (array of
+        shape (npos, npvs)) and 'xy' (array of shape (npos, 2))
+    """
+    if instname is None:
+        instname = _scandb.get_info('samplestage_instrument', 'SampleStage')
+    inst = _scandb.get_rows('instrument', where={'name': instname},
+                            limit_one=True)
+    if inst is None:
+        return None
+    rows = _scandb.get_rows('position', where={'instrument_id': inst.id})
+    stamps = {}
+    for row in rows:
+        stamps[row.id] = (row.name, str(row.modify_time))
+
+    index = _POSITION_INDEX.get(instname, None)
+    if index is None:
+        names, pvnames, values = read_positions(instname)
+        ids = [row.id for row in rows]
+        index = {'pvnames': pvnames, 'stamps': {}}
+    else:
+        pvnames, ids, values = index['pvnames'], [], []
+        for i, posid in enumerate(index['ids']):
+            if stamps.get(posid, None) == index['stamps'].get(posid, None):
+                ids.append(posid)
+                values.append(index['values'][i])
+        #endfor
+        pvindex = {}
+        for j, pvname in enumerate(pvnames):
+            pvindex[pvname] = j
+        pvrows = {}
+        for posid in stamps:
+            if posid in ids:
+                continue
+            if len(pvrows) == 0:
+                for row in _scandb.get_rows('pv'):
+                    pvrows[row.id] = row.name
+            vals = np.full(len(pvnames), np.nan)
+            for row in _scandb.get_rows('position_pv', where={'position_id': posid}):
+                j = pvindex.get(pvrows.get(row.pv_id, None), None)
+                if j is not None:
+                    vals[j] = float(row.value)
+            #endfor
+            ids.append(posid)
+            values.append(vals)
+        #endfor
+        values = np.array(values).reshape((len(ids), len(pvnames)))
+        names = [stamps[posid][0] for posid in ids]
+    #endif
+    index.update({'ids': ids, 'names': names, 'values': values,
+                  'xy': _index_xy(values), 'stamps': stamps})
+    _POSITION_INDEX[instname] = index
+    return index
+#enddef
+
+def _index_result(index, sel, dist=None):
+    "--private-- list of names (and distances) for selected positions"
+    names = [index['names'][i] for i in sel]
+    if dist is None:
+        return names
+    return list(zip(names, dist[sel].tolist()))
+#enddef
+
+def positions_near(x, y, n=5, instname=None):
+    """
+    nearest named positions to a sample (x, y)
+
+    Returns:
+        list of (name, distance) for up to n positions, nearest first
+    """
+    index = position_index(instname)
+    dist = np.sqrt(((index['xy'] - np.array([x, y]))**2).sum(axis=1))
+    order = np.argsort(dist)
+    return _index_result(index, order[:n][np.isfinite(dist[order[:n]])], dist)
+#enddef
+
+def positions_within(x, y, radius, instname=None):
+    """
+    named positions within `radius` of a sample (x, y)
+
+    Returns:
+        list of (name, distance), nearest first
+    """
+    index = position_index(instname)
+    dist = np.sqrt(((index['xy'] - np.array([x, y]))**2).sum(axis=1))
+    order = np.argsort(dist)
+    return _index_result(index, order[dist[order] <= radius], dist)
+#enddef
+
+def positions_in_box(xmin, xmax, ymin, ymax, instname=None):
+    "names of positions with sample x, y inside a box"
+    index = position_index(instname)
+    x, y = index['xy'][:, 0], index['xy'][:, 1]
+    sel = np.where((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))[0]
+    return _index_result(index, sel)
+#enddef
+
+def positions_matching(pattern, instname=None):
+    """
+    names of positions matching a regular expression
+
+    Example:
+        positions_matching('^SampleA_')    # names starting with 'SampleA_'
+        positions_matching('fid')          # names containing 'fid'
+    """
+    regex = re.compile(pattern)
+    index = position_index(instname)
+    return [name for name in index['names'] if regex.search(name)]
+#enddef
+
+def visit_order(names, instname=None, start=None):
+    """
+    order a list of position names to reduce total travel
+
+    Parameters:
+        names (list of strings): position names
+        instname (string or None): name of instrument [None, samplestage]
+        start (tuple or None): starting sample (x, y)
+            [None, the current stage position]
+
+    Returns:
+        list of names, in nearest-neighbour order from start.
+        names not found in the index are put at the end.
+    """
+    index = position_index(instname)
+    lookup = {}
+    for i, name in enumerate(index['names']):
+        lookup[name] = i
+    known = [name for name in names if name in lookup]
+    unknown = [name for name in names if name not in lookup]
+    if len(known) < 2:
+        return known + unknown
+    xy = np.nan_to_num(index['xy'][[lookup[name] for name in known]])
+    if start is None:
+        start = _index_xy(np.array([[caget(pvname) for pvname in index['pvnames']]],
+                                   dtype='float64'))[0]
+    pos = np.nan_to_num(np.asarray(start, dtype='float64'))
+    todo = np.ones(len(known), dtype=bool)
+    out = []
+    for k in range(len(known)):
+        dist = np.where(todo, ((xy - pos)**2).sum(axis=1), np.inf)
+        i = int(np.argmin(dist))
+        todo[i] = False
+        out.append(known[i])
+        pos = xy[i]
+    #endfor
+    return out + unknown
+#enddef
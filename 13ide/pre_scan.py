@@ -309,7 +309,8 @@ def post_scan_command(row=0):
         caput('13XRM:roll_pid.FBON', 0)
         caput('13IDA:E_MonoPiezoPitch.VAL', pval)
         caput('13IDA:E_MonoPiezoRoll.VAL', rval)
-        sleep(2)
+        wait_settled('mono_tilt', ['13IDE:I0_Volts'], default=2.0, rtol=0.02,
+                     fresh=True)
         caput('13XRM:pitch_pid.FBON', 1)
         caput('13XRM:roll_pid.FBON', 1)
 #enddef
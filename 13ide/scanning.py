@@ -3,6 +3,7 @@
 ##    pos_scan: move to a Named Position, run a Scan
 ##    pos_map
 
+import re
 import numpy as np
 import json
 
@@ -22,7 +23,7 @@ def pos_multiscan(posname, scannames, number=1):
     """
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
-    sleep(1.0)
+    samplestage_settled()
 
     for scanname in scannames:
          elemname = scanname.replace('XANES', '').replace('_', '')
@@ -30,7 +31,8 @@ def pos_multiscan(posname, scannames, number=1):
          autoset_i0amp_gain()
 
          datafile = f'{scanname}_{posname}.001'
-         do_scan(scanname,  filename=datafile, nscans=number)
+         timed_scan(scanname,  filename=datafile, nscans=number,
+                    meta={'macro': 'pos_multiscan', 'position': posname})
     #endfor
 #enddef
 
@@ -48,13 +50,16 @@ def pos_scan(posname, scanname, datafile=None, extra=None, number=1, **kws):
         number (integer): number of repeats of scan to do [default=1]
         extra (string): Extra name for file [default=None]
 
+    Returns:
+        name of the data file written (see timed_scan), or None if aborted
+
     Example:
        pos_scan('MySample', 'Fe_XANES', number=3)
 
     """
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
-    sleep(1.0)
+    samplestage_settled()
     if extra is None:
         extra = ''
     if datafile is None:
@@ -65,7 +70,8 @@ def pos_scan(posname, scanname, datafile=None, extra=None, number=1, **kws):
            caput(pvname, val)
         else:
            print("## No known PV for ", key)
-    do_scan(scanname,  filename=datafile, nscans=number)
+    return timed_scan(scanname,  filename=datafile, nscans=number,
+                      meta={'macro': 'pos_scan', 'position': posname})
 #enddef
 
 def pos_map(posname, scanname):
@@ -82,7 +88,7 @@ def pos_map(posname, scanname):
     """
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
-    sleep(1.0)
+    samplestage_settled()
     datafile = '%s_%s.001' % (scanname, posname)
     do_slewscan(scanname, filename=datafile)
 #enddef
@@ -92,7 +98,8 @@ def scan_at_energy(scanname, posname, en):
     move_energy(en)
     move_samplestage(posname, wait=True)
     fname = '%s_%s_%ieV.001' % (posname, scanname, en)
-    do_scan(scanname, filename=fname)
+    timed_scan(scanname, filename=fname,
+               meta={'macro': 'scan_at_energy', 'position': posname})
 #enddef
 
 def _getPV(mname):
@@ -137,20 +144,39 @@ def move_stage(motorname, value, relative=False, wait=True):
         value (float): value to move to
         relative (bool): whether move is relative  [False]
         wait (bool): whether to wait for move to complete [True]
+
+    Returns:
+        True if the move completed (or wait=False), False otherwise
+
+    See Also:
+        move_stage_async
+    """
+    return run_async(move_stage_async(motorname, value, relative=relative,
+                                      wait=wait))
+
+async def move_stage_async(motorname, value, relative=False, wait=True):
+    """async version of move_stage(), so that several stages
+    can be moved at the same time
+
+    Example:
+        run_async(move_stage_async('finex', 0.1), move_stage_async('focus', 1.2))
     """
     motor = _getPV(motorname)
     if motor is None:
         print(f"Error: cannot find motor named '{motorname}'")
-        return
+        return False
 
     if relative:
-        value = value + caget(motor)
+        value = value + await aget(motor)
     print("Move " , motor, value, wait)
 
-    caput(motor, value, wait=wait)
+    if not await aput(motor, value, wait=wait):
+        print(f"Error: move of '{motorname}' to {value} did not complete")
+        return False
+    return True
 
 
-def _scanloop(scanname, datafile, motorname, vals, number=1):
+def _scanloop(scanname, datafile, motorname, vals, number=1, ckpt=None):
     """
     run a named scan at each point for a named motor.
     expected to be used internally.
@@ -161,6 +187,7 @@ def _scanloop(scanname, datafile, motorname, vals, number=1):
         motorname (string): name of motor
         vals (list or array of floats): motor values at which to do scan.
         number(int): number of scan repeats at each point
+        ckpt (dict or None): checkpoint from checkpoint_begin() [None]
 
     Example:
         _scanloop('Fe_XAFS', 'sample1_', 'x', [-0.1, 0.0, 0.1])
@@ -174,23 +201,95 @@ def _scanloop(scanname, datafile, motorname, vals, number=1):
             'Fe_XAFS_sample1_x3.001'
     """
     if check_abort_pause(): return
-    motor = _getPV(motorname)
-    if motor is None:
-        print("Error: cannot find motor named '%s'" % motorname)
+    fileform = '%s_%s_%s.' % (scanname, datafile, motorname) + '{i:03d}'
+    plan = list_path(motorname, vals, fileform=fileform)
+    if plan is None:
         return
     #endif
-    filename = '%s_%s_%s.001' % (scanname, datafile, motorname)
+    _run_scan_plan(plan, scanname, number=number, ckpt=ckpt)
+#enddef
 
-    for i, val in enumerate(vals):
-        caput(motor, val, wait=True)
-        filename = '%s_%s_%s.%3.3i' % (scanname, datafile, motorname, i+1)
-        do_scan(scanname,  filename=filename, nscans=number)
-        if check_scan_abort(): return
+def _run_scan_plan(plan, scanname, number=1, ckpt=None, mapname=None,
+                   macro=None, posname=None):
+    """
+    run a named scan at each point of a scan plan.
+    expected to be used internally.
+
+    Parameters:
+        plan (dict): scan plan, as from line_path() or grid_path()
+        scanname (string): name of scan
+        number (int): number of scan repeats at each point [1]
+        ckpt (dict or None): checkpoint from checkpoint_begin() [None]
+        mapname (string or None): name for consolidated map file [None]
+        macro (string or None): name of macro, for the catalog
+            [None, from the checkpoint]
+        posname (string or None): name of position, for the catalog [None]
+
+    Returns:
+        True if all points were done, False if aborted.
+    """
+    store = mapstore_begin(plan, mapname=mapname)
+    if macro is None and ckpt is not None:
+        macro = ckpt['macro']
+    todo = [i for i in range(len(plan['filenames'])) if not checkpoint_skip(ckpt, i)]
+    moveall = True
+    for n, i in enumerate(todo):
+        filename = plan['filenames'][i]
+        plan_move(plan, i, allmotors=moveall)
+        moves = None
+        if n+1 < len(todo):
+            moveall = todo[n+1] != i+1
+            moves = plan_targets(plan, todo[n+1], allmotors=moveall)
+        motors = dict(zip(plan['motors'], plan['points'][i].tolist()))
+        filename = scan_with_prefetch(scanname,  filename=filename, nscans=number,
+                                      meta={'macro': macro, 'position': posname,
+                                            'motors': motors, 'map': mapname,
+                                            'map_index': i},
+                                      moves=moves)
+        mapstore_add(store, i, filename)
+        checkpoint_point(ckpt, i, filename)
+        if check_scan_abort(): return False
     #endfor
+    return True
+#enddef
+
+def _dryrun_plan(macro, plan, scanname, number=1):
+    "--private-- report estimated time and size for running a scan over a plan"
+    scantime, nbytes = estimate_scan_time(scanname)
+    if scantime is not None:
+        scantime *= number
+    return dryrun_report(macro, len(plan['filenames']), scantime,
+                         nbytes=nbytes, move_time=plan_move_time(plan))
+#enddef
+
+def path_scan(scanname, plan, number=1, dryrun=False):
+    """
+    run a named scan at each point of a scan path
+
+    Parameters:
+        scanname (string): name of scan
+        plan (dict): scan plan from line_path(), grid_path(), spiral_path(),
+            list_path(), and so on.
+        number (int): number of scan repeats at each point [1]
+        dryrun (True or False): only report estimated time and size [False]
+
+    Example:
+        path_scan('Fe_XANES', spiral_path('x', 'y', radius=0.02, step=0.004,
+                                          fileform='Fe_XANES_spiral_{i}.001'))
+
+    See Also:
+        line_scan, grid_scan
+    """
+    if plan is None:
+        return
+    if dryrun:
+        return _dryrun_plan('path_scan', plan, scanname, number=number)
+    if check_abort_pause(): return
+    _run_scan_plan(plan, scanname, number=number, macro='path_scan')
 #enddef
 
 def line_scan(scanname, posname, motor='x',
-              start=0, stop=0.1, step=0.001, number=1):
+              start=0, stop=0.1, step=0.001, number=1, dryrun=False):
     """
     run a named scan (or map) at each point in along a line
 
@@ -202,6 +301,7 @@ def line_scan(scanname, posname, motor='x',
         stop (float): ending motor value [0.100]
         step (float): step size for motor [0.001]
         number(int): number of scan repeats at each point
+        dryrun (True or False): only report estimated time and size [False]
     Example:
         line_scan('Fe_XAFS', 'mysample1', motor='x', start=0, stop=0.05, step=0.005, number=2)
 
@@ -217,20 +317,24 @@ def line_scan(scanname, posname, motor='x',
        grid_scan
 
     """
+    fileform = '%s_%s_%s.' % (scanname, posname, motor) + '{i:03d}'
+    plan = line_path(motor, start, stop, step, fileform=fileform)
+    if plan is None:
+        return
+    if dryrun:
+        return _dryrun_plan('line_scan', plan, scanname, number=number)
+    #endif
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
-    sleep(1.0)
-
-    npts = int(1.0 + (abs(start-stop)+0.1*abs(step))/abs(step))
-    vals = linspace(start, stop, npts)
+    samplestage_settled()
 
-    datafile = posname
-    _scanloop(scanname, datafile, motor, vals, number=number)
+    _run_scan_plan(plan, scanname, number=number, macro='line_scan', posname=posname)
 #enddef
 
 
 def line_xrf(posname, motor='x',
-             start=0, stop=0.1, step=0.001, t=5):
+             start=0, stop=0.1, step=0.001, t=5, fly=False,
+             trigger='internal', dryrun=False):
     """
     run a named scan (or map) at each point in along a line
 
@@ -241,9 +345,16 @@ def line_xrf(posname, motor='x',
         stop (float): ending motor value [0.100]
         step (float): step size for motor [0.001]
         t(float): dwelltime
+        fly (True or False): move the motor continuously and stream all
+            spectra to a single file [False]
+        trigger (string): for fly mode, 'internal' (timed frames) or
+            'external' (hardware trigger pulses) ['internal']
+        dryrun (True or False): only report estimated time and size [False]
     Example:
         line_xrf('mysample1', motor='x', start=0, stop=0.05, step=0.005, t=10)
 
+        line_xrf('mysample1', motor='x', start=0, stop=0.05, step=0.001, t=0.25, fly=True)
+
     Note:
        output files will named `<scanname>_<datafile>_<x>I.001`  where I will
        increment 1, 2, 3, and so on.
@@ -252,35 +363,47 @@ def line_xrf(posname, motor='x',
        'Fe_XAFS_mysample1_x1.002', 'Fe_XAFS_mysample1_x2.001', 'Fe_XAFS_mysample1_x2.002',
        'Fe_XAFS_mysample1_x3.001', 'Fe_XAFS_mysample1_x2.002', and so on.
 
+       In fly mode, all spectra and positions are written to one file,
+       `<posname>_<x>_xrf.npz`.
+
     See Also:
        save_xrf
 
     """
-    if check_abort_pause(): return
-    motorpv = _getPV(motor)
-    if motorpv is None:
-        print("Error: cannot find motor named '%s'" % motor)
+    fileform = '%s_%s_xrf.' % (posname, motor) + '{i:03d}'
+    plan = line_path(motor, start, stop, step, fileform=fileform)
+    if plan is None:
         return
+    if dryrun:
+        if fly:
+            return dryrun_report('line_xrf', len(plan['filenames']), t)
+        overhead, nbytes = learned_timing('xrf_overhead', default=1.0)
+        return dryrun_report('line_xrf', len(plan['filenames']), t+overhead,
+                             nbytes=nbytes, move_time=plan_move_time(plan))
     #endif
+    if check_abort_pause(): return
     move_samplestage(posname, wait=True)
+    samplestage_settled()
 
-    sleep(1.0)
-
-    npts = int(1.0 + (abs(start-stop)+0.1*abs(step))/abs(step))
-    vals = linspace(start, stop, npts)
-
-    filename = '%s_%s_xrf.001' % (posname, motor)
+    if fly:
+        _line_xrf_fly(plan, t, '%s_%s_xrf.npz' % (posname, motor), trigger=trigger)
+        return
+    #endif
 
-    for i, val in enumerate(vals):
-        caput(motorpv, val, wait=True)
-        filename = '%s_%s_xrf.%3.3i' % (posname, motor, i+1)
+    store = mapstore_begin(plan)
+    for i, filename in enumerate(plan['filenames']):
+        plan_move(plan, i)
+        t0 = time()
         save_xrf(filename, t=t)
+        record_timing('xrf_overhead', time()-t0-t)
+        mapstore_add(store, i, filename)
         if check_scan_abort(): return
     #endfor
 #enddef
 
 
-def transect_scan(scanname, datafile, pos1, pos2, npts=11, nscans=1):
+def transect_scan(scanname, datafile, pos1, pos2, npts=11, nscans=1,
+                  resume=False, dryrun=False):
     """
     run a scan at evenly spaced points from
 
@@ -293,6 +416,9 @@ def transect_scan(scanname, datafile, pos1, pos2, npts=11, nscans=1):
         pos2 (string): name of Stop position
         npts (int): number of steps                [11]
         nscans (int): number of scans at each step [1]
+        resume (True or False): skip points completed in an earlier,
+            interrupted run with the same parameters [False]
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
         transect_scan('Fe_XAFS', 'sample1', 'Point1', 'Point2', npts=5)
@@ -308,65 +434,27 @@ def transect_scan(scanname, datafile, pos1, pos2, npts=11, nscans=1):
         line_scan, grid_xrd, diag, diag_scan
 
     """
-    if check_abort_pause(): return
-
-    instrument = _scandb.get_info('samplestage_instrument', 'SampleStage')
-    p1 = _instdb.get_position(instrument, pos1)
-    p2 = _instdb.get_position(instrument, pos2)
-
-    move_samplestage(pos1, wait=True)
-    if p1 is None:
-        print("Error: cannot find position '%s'" % pos1)
-        return
-
-    if p2 is None:
-        print("Error: cannot find position '%s'" % pos2)
-        return
-
-    xmotor = p1.pv[0].pv.name
-    if xmotor is None:
-        print("Error: cannot find motor named '%s'" % xname)
-        return
-
-    xstart = float(p1.pv[0].value)
-    xstop  = float(p2.pv[0].value)
-
-    if abs(xstop-xstart) < 0.001:
-        xmotor = p1.pv[4].pv.name
-        xstart = float(p1.pv[4].value)
-        xstop  = float(p2.pv[4].value)
-    #endif
-
-    ymotor = p1.pv[1].pv.name
-    if ymotor is None:
-        print("Error: cannot find motor named '%s'" % yname)
+    fileform = '%s_%s_' % (scanname, datafile) + '{i}.001'
+    plan = transect_path(pos1, pos2, npts=npts, fileform=fileform)
+    if plan is None:
         return
+    if dryrun:
+        return _dryrun_plan('transect_scan', plan, scanname, number=nscans)
     #endif
-    ystart = float(p1.pv[1].value)
-    ystop  = float(p2.pv[1].value)
-
-    if abs(ystop-ystart) < 0.001:
-        ymotor = p1.pv[5].pv.name
-        ystart = float(p1.pv[5].value)
-        ystop  = float(p2.pv[5].value)
+    if check_abort_pause(): return
+    move_samplestage(pos1, wait=True)
 
-    xvals = linspace(xstart, xstop, npts)
-    yvals = linspace(ystart, ystop, npts)
-
-    i = 0
-    for xval, yval in zip(xvals, yvals):
-        i += 1
-        caput(xmotor, xval, wait=True)
-        caput(ymotor, yval, wait=True)
-        filename = "%s_%s_%i.001" % (scanname, datafile, i)
-        do_scan(scanname,  filename=filename, nscans=nscans)
-        if check_scan_abort(): return
-    #endfor
+    ckpt = checkpoint_begin('transect_scan',
+                            dict(scanname=scanname, datafile=datafile, pos1=pos1,
+                                 pos2=pos2, npts=npts, nscans=nscans),
+                            resume=resume)
+    if _run_scan_plan(plan, scanname, number=nscans, ckpt=ckpt):
+        checkpoint_end(ckpt)
 #enddef
 
 def diagonal_scan(scanname, datafile, x='x', y='y',
                   xstart=0, xstop=0.1, xstep=0.001,
-                  ystart=0, ystop=0.1, number=1):
+                  ystart=0, ystop=0.1, number=1, dryrun=False):
     """
     run a scan at each point along a diagonal of two motors, say 'x' and 'y'
 
@@ -380,6 +468,8 @@ def diagonal_scan(scanname, datafile, x='x', y='y',
         xstep (float): step size for X value [0.001]
         ystart (float): starting Y value [0]
         ystop (float): ending Y value [0.100]
+        number(int): number of scan repeats at each point
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
         diagonal_scan('Fe_XAFS', 'sample1', y='theta', xstart=0, xstop=0.05, xstep=0.005,
@@ -398,38 +488,21 @@ def diagonal_scan(scanname, datafile, x='x', y='y',
         line_scan, grid_xrd
 
     """
-    if check_abort_pause(): return
-    yname = y
-    xname = x
-
-    nx  = int(1.0 + (abs(xstart-xstop)+0.1*abs(xstep))/abs(xstep))
-    ny  = nx
-    xvals = linspace(xstart, xstop, nx)
-    yvals = linspace(ystart, ystop, ny)
-
-    ymotor = _getPV(yname)
-    xmotor = _getPV(xname)
-    if xmotor is None:
-        print("Error: cannot find motor named '%s'" % xname)
+    fileform = '%s_%s_' % (scanname, datafile) + '{i}.001'
+    plan = diagonal_path(x, y, xstart, xstop, xstep, ystart, ystop,
+                         fileform=fileform)
+    if plan is None:
         return
+    if dryrun:
+        return _dryrun_plan('diagonal_scan', plan, scanname, number=number)
     #endif
-    if ymotor is None:
-        print("Error: cannot find motor named '%s'" % yname)
-        return
-    #endif
-
-    for ix, xval in enumerate(xvals):
-        caput(xmotor, xval, wait=True)
-        caput(ymotor, yvals[ix], wait=True)
-        filename = "%s_%s_%i.001" % (scanname, datafile, ix+1)
-        do_scan(scanname,  filename=filename, nscans=number)
-        if check_scan_abort(): return
-    #endfor
+    if check_abort_pause(): return
+    _run_scan_plan(plan, scanname, number=number, macro='diagonal_scan')
 #enddef
 
 def grid_scan(scanname, x='x', y='y', datafile=None,
               xstart=0, xstop=0.1, xstep=0.001,
-              ystart=0, ystop=0.1, ystep=0.001):
+              ystart=0, ystop=0.1, ystep=0.001, resume=False, dryrun=False):
     """
     run a named scan (or map) at each point in an x, y grid
 
@@ -444,6 +517,9 @@ def grid_scan(scanname, x='x', y='y', datafile=None,
         ystart (float): starting Y value [0]
         ystop (float): ending Y value [0.100]
         ystep (float): step size for Y value [0.001]
+        resume (True or False): skip points completed in an earlier,
+            interrupted run with the same parameters [False]
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
         grid_scan('Fe_XAFS', 'sample1', y='theta', xstart=0, xstop=0.05, xstep=0.005,
@@ -461,39 +537,33 @@ def grid_scan(scanname, x='x', y='y', datafile=None,
         line_scan, grid_xrd
 
     """
-    if check_abort_pause(): return
-    yname = y
-    xname = x
-
-    nx  = int(1.0 + (abs(xstart-xstop)+0.1*abs(xstep))/abs(xstep))
-    ny  = int(1.0 + (abs(ystart-ystop)+0.1*abs(ystep))/abs(ystep))
-    xvals = linspace(xstart, xstop, nx)
-    yvals = linspace(ystart, ystop, ny)
-
-    ymotor = _getPV(yname)
-    xmotor = _getPV(xname)
-    if ymotor is None:
-        print("Error: cannot find motor named '%s'" % yname)
+    if datafile is None: datafile = scanname
+    fileform = '%s_%s_%s' % (scanname, datafile, y) + '{iy}_' + x + '.{ix:03d}'
+    plan = grid_path(x, y, xstart, xstop, xstep, ystart, ystop, ystep,
+                     fileform=fileform)
+    if plan is None:
         return
+    if dryrun:
+        return _dryrun_plan('grid_scan', plan, scanname)
     #endif
-    print("Xmotor ", xmotor, xvals)
-    print("Ymotor ", ymotor, yvals)
-    if datafile is None: datafile = scanname
-
-    for iy, yval in enumerate(yvals):
-        caput(ymotor, yval, wait=True)
-        print("Move y ", ymotor, yval, 'loop over x ', xname, xvals)
-        ydatafile = "%s_%s%i" % (datafile, yname, iy+1)
-        _scanloop(scanname, ydatafile, xname, xvals)
-        # print( "_scanloop ", scanname, ydatafile, xname, xvals)
-        if check_scan_abort():  return
-    #endfor
+    if check_abort_pause(): return
+    ny, nx = plan['shape']
+    print("grid_scan: %d rows of %s, %d columns of %s" % (ny, y, nx, x))
+
+    ckpt = checkpoint_begin('grid_scan',
+                            dict(scanname=scanname, x=x, y=y, datafile=datafile,
+                                 xstart=xstart, xstop=xstop, xstep=xstep,
+                                 ystart=ystart, ystop=ystop, ystep=ystep),
+                            resume=resume)
+    if _run_scan_plan(plan, scanname, ckpt=ckpt):
+        checkpoint_end(ckpt)
 #enddef
 
 ## For V:
 # energies=[5460, 5467.5, 5469, 5485.9, 5493.3, 5600]):
 
-def redox_map(posname, scanname, datafile=None, energies=[2472.0, 2481.5, 2550]):
+def redox_map(posname, scanname, datafile=None, energies=[2472.0, 2481.5, 2550],
+              dryrun=False):
     """
     repeat a scan or map at multiple energies
 
@@ -502,6 +572,7 @@ def redox_map(posname, scanname, datafile=None, energies=[2472.0, 2481.5, 2550])
         scanname (string):  scan name
 
         energies (list of floats):   list of energies (in eV) to run map scan at
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
        redox_map('MyMap', 'sampleX', energies=[5450, 5465, 5500])
@@ -513,32 +584,29 @@ def redox_map(posname, scanname, datafile=None, energies=[2472.0, 2481.5, 2550])
         'MyMap_sampleX_5465.0eV.001',
         'MyMap_sampleX_5500.0eV.001',
 
+        the mono tilt is fully tuned only on the first visit to each energy,
+        later maps at the same energies reuse the cached pitch and roll
+        (see tune_at_energy()).
     """
+    if dryrun:
+        scantime, nbytes = estimate_scan_time(scanname)
+        return dryrun_report('redox_map', len(energies), scantime, nbytes=nbytes,
+                             extra=energy_stack_time(energies, tune='full'))
+    #endif
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
 
     if datafile is None:
         datafile = '%s_%s.001' % (scanname, posname)
     #endif
-
-    for en in energies:
-        move_energy(en)
-        set_mono_tilt()
-        caput('13XRM:pitch_pid.FBON', 1)
-
-        dfile = '%s_%.1feV.001' % (datafile, en)
-        print("Start Map ", scanname, " Filename ", dfile)
-        do_scan(scanname,  filename=dfile)
-
-        caput('13XRM:pitch_pid.FBON', 0)
-        if check_scan_abort(): return
-
-
-
+    energy_stack(scanname, energies, datafile.replace('%', '%%') + '_%.1feV.001',
+                 tune='full', pitch_feedback=True)
+#enddef
 
 def grid_xrd(datafile, t=5, x='x', y='y',
              xstart=0, xstop=0.1, xstep=0.001,
-             ystart=0, ystop=0.1, ystep=0.001, bgr_per_row=False):
+             ystart=0, ystop=0.1, ystep=0.001, bgr_per_row=False,
+             resume=False, dryrun=False):
     """
     collect an XRD image at each point in an x, y grid
     running save_xrd() at each point in the grid
@@ -554,8 +622,13 @@ def grid_xrd(datafile, t=5, x='x', y='y',
         ystart (float): starting Y value [0]
         ystop (float): ending Y value [0.100]
         ystep (float): step size for Y value [0.001]
-        bgr_per_row (True or False): whether to collec xrd_bgr()
-            at the beginning of each row.
+        bgr_per_row (True or False): whether to collect xrd_bgr() at the
+            beginning of every row [False].  A background is always
+            collected at the beginning of a row when there is none
+            recorded for the exposure time and detector temperature.
+        resume (True or False): skip points completed in an earlier,
+            interrupted run with the same parameters [False]
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
         grid_xrd('MySample', xstart=0, xstop=0.05, xstep=0.005,
@@ -571,36 +644,71 @@ def grid_xrd(datafile, t=5, x='x', y='y',
         save_xrd, xrd_bgr
 
     """
-    if check_abort_pause(): return
-    yname = y
-    xname = x
-
-    nx  = int(1.0 + (abs(xstart-xstop)+0.1*abs(xstep))/abs(xstep))
-    ny  = int(1.0 + (abs(ystart-ystop)+0.1*abs(ystep))/abs(ystep))
-    xvals = linspace(xstart, xstop, nx)
-    yvals = linspace(ystart, ystop, ny)
-
-    xmotor = _getPV(xname)
-    ymotor = _getPV(yname)
-    if ymotor is None:
-        print("Error: cannot find motor named '%s'" % yname)
+    fileform = '%s_%s' % (datafile, y) + '{iy}_' + x + '{ix}'
+    plan = grid_path(x, y, xstart, xstop, xstep, ystart, ystop, ystep,
+                     fileform=fileform)
+    if plan is None:
         return
+    ny, nx = plan['shape']
+    if dryrun:
+        overhead, nbytes = learned_timing('xrd_overhead', default=3.0)
+        extra = 0.0
+        if bgr_per_row:
+            extra = ny*(t + overhead)
+        elif xrd_background_needed(t):
+            extra = t + overhead
+        return dryrun_report('grid_xrd', nx*ny, t+overhead, nbytes=nbytes,
+                             move_time=plan_move_time(plan), extra=extra)
     #endif
+    if check_abort_pause(): return
 
-    for iy, yval in enumerate(yvals):
-        caput(ymotor, yval, wait=True)
-        if bgr_per_row: xrd_bgr()
-        ydatafile = "%s_%s%i" % (datafile, yname, iy+1)
-        for ix, xval in enumerate(xvals):
-           caput(xmotor, xval, wait=True)
-           fname = ydatafile + '_%s%i' % (xname, ix+1)
-           save_xrd(fname, t=t, ext=1)
-           if check_scan_abort():  return
+    ckpt = checkpoint_begin('grid_xrd',
+                            dict(datafile=datafile, t=t, x=x, y=y,
+                                 xstart=xstart, xstop=xstop, xstep=xstep,
+                                 ystart=ystart, ystop=ystop, ystep=ystep,
+                                 bgr_per_row=bgr_per_row),
+                            resume=resume)
+    store = mapstore_begin(plan, mapname=datafile)
+    moveall = True
+    row = -1
+    session = xrd_session_begin()
+    if session is None:
+        return
+    try:
+        for i, fname in enumerate(plan['filenames']):
+            if checkpoint_skip(ckpt, i):
+                moveall = True
+                continue
+            #endif
+            plan_move(plan, i, allmotors=moveall)
+            moveall = False
+            if (plan['index'][i][0] != row and
+                (bgr_per_row or xrd_background_needed(t))):
+                # end the session before xrd_bgr, so that it is not
+                # ended again (in finally) if xrd_bgr fails
+                ended, session = session, None
+                xrd_session_end(ended)
+                xrd_bgr()
+                xrd_background_taken(t)
+                session = xrd_session_begin()
+                if session is None:
+                    return
+            #endif
+            row = plan['index'][i][0]
+            fname = xrd_session_frame(session, fname, t=t, ext=1, mapname=datafile,
+                                      index=i, shape=plan['shape'])
+            mapstore_add(store, i, fname)
+            checkpoint_point(ckpt, i, fname)
+            if check_scan_abort():  return
         #endfor
-    #endfor
+    finally:
+        if session is not None:
+            xrd_session_end(session)
+    checkpoint_end(ckpt)
 #enddef
 
-def line_xrd(datafile, t=5, motor='x', start=0, stop=0.1, step=0.001):
+def line_xrd(datafile, t=5, motor='x', start=0, stop=0.1, step=0.001,
+             dryrun=False):
     """
     collect an XRD image at each point in along a line
 
@@ -611,6 +719,7 @@ def line_xrd(datafile, t=5, motor='x', start=0, stop=0.1, step=0.001):
         start (float): starting  value [0]
         stop (float): ending  value [0.100]
         step (float): step size for  value [0.001]
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
         line_xrd('MySample', t=5, start=0, stop=0.05, step=0.005)
@@ -623,15 +732,30 @@ def line_xrd(datafile, t=5, motor='x', start=0, stop=0.1, step=0.001):
     See Also:
         save_xrd, grid_xrd
     """
+    plan = line_path(motor, start, stop, step)
+    if plan is None:
+        return
+    npts = len(plan['filenames'])
+    if dryrun:
+        overhead, nbytes = learned_timing('xrd_overhead', default=3.0)
+        return dryrun_report('line_xrd', npts, t+overhead, nbytes=nbytes,
+                             move_time=plan_move_time(plan))
+    #endif
     if check_abort_pause(): return
-    npts = int(1.0 + (abs(start-stop)+0.1*abs(step))/abs(step))
-    mvals = linspace(start, stop, npts)
-    motor_pv = _getPV(motor)
-    for i, val in enumerate(mvals):
-       caput(motor_pv, val, wait=True)
-       save_xrd(datafile, t=t, ext=(i+1))
-       if check_scan_abort():  return
-    #endfor
+    store = mapstore_begin(plan, mapname=datafile)
+    session = xrd_session_begin()
+    if session is None:
+        return
+    try:
+        for i in range(npts):
+           plan_move(plan, i)
+           fname = xrd_session_frame(session, datafile, t=t, ext=(i+1),
+                                     mapname=datafile, index=i, shape=plan['shape'])
+           mapstore_add(store, i, fname)
+           if check_scan_abort():  return
+        #endfor
+    finally:
+        xrd_session_end(session)
 #enddef
 
 def theta_xafs(scanname, datafile, motor='theta',
@@ -663,10 +787,11 @@ def theta_xafs(scanname, datafile, motor='theta',
 
     """
     if check_abort_pause(): return
-    npts = int(1.0 + (abs(start-stop)+0.1*abs(step))/abs(step))
-    vals = linspace(start, stop, npts)
-
-    _scanloop(scanname, datafile, motor, vals, number=number)
+    fileform = '%s_%s_%s.' % (scanname, datafile, motor) + '{i:03d}'
+    plan = line_path(motor, start, stop, step, fileform=fileform)
+    if plan is None:
+        return
+    _run_scan_plan(plan, scanname, number=number, macro='theta_xafs')
 #enddef
 
 def dac_xafs(scanname, samplename, tstart=-5, tstop=5, xstart=6.8, xstop=7.0, npts=11):
@@ -698,49 +823,82 @@ def dac_xafs(scanname, samplename, tstart=-5, tstop=5, xstart=6.8, xstop=7.0, np
 
     tvals = linspace(tstart, tstop, npts)
     xvals = linspace(xstart, xstop, npts)
-    theta_pv = _getPV('theta')
-    finex_pv = _getPV('finex')
-
     filename = '%s_%s.001' % (scanname, samplename)
-
-    for theta, finex in zip(tvals, xvals):
-        caput(theta_pv, theta, wait=True)
-        caput(finex_pv, finex, wait=True)
-        do_scan(scanname,  filename=filename, nscans=1)
-        if check_scan_abort(): return
-    #endfor
+    plan = list_path(['theta', 'finex'], np.column_stack((tvals, xvals)),
+                     fileform=filename)
+    _run_scan_plan(plan, scanname, macro='dac_xafs')
 #enddef
 
-def maplist(posname, scanname, suffixes=None):
+def maplist(posname, scanname, suffixes=None, ordered=False):
     """
     repeat a scan or map at multiple points with similar names
 
     Parameters:
         posname (string): position name
         scanname (string):  scan name
-        suffix (string): position name suffix
+        suffixes (list, 'all' or None): position name suffixes,
+            or 'all' for all positions with names starting with posname
+            [None, no positions]
+        ordered (True or False): visit positions in order of shortest
+            travel rather than in the order given [False]
 
     Example:
        maplist('SampleA_', 'MyMap', suffixes=['1', '2', '3'])
 
     to do MyMap at SampleA_1, SampleA_2, SampleA_3
     """
-    if suffixes is None: suffixes = []
-    for suff in suffixes:
-        pname = "%s%s" % (posname, suff)
+    if suffixes is None:
+        return
+    if suffixes == 'all':
+        pnames = positions_matching('^' + re.escape(posname))
+    else:
+        pnames = ["%s%s" % (posname, suff) for suff in suffixes]
+    if ordered:
+        pnames = visit_order(pnames)
+    instname = _scandb.get_info('samplestage_instrument', 'SampleStage')
+    names, pvnames, values = read_positions(instname,
+                                            pvnames=instrument_pvnames(instname))
+    posvals = positions_dict(names, values)
+    for n, pname in enumerate(pnames):
         move_samplestage(pname, wait=True)
 
         datafile = '%s_%s.001' % (scanname, pname)
+        moves = None
+        if n+1 < len(pnames) and pnames[n+1] in posvals:
+            moves = [(pvname, val) for pvname, val in
+                     zip(pvnames, posvals[pnames[n+1]]) if not np.isnan(val)]
 
         if check_scan_abort(): return
-        do_scan(scanname,  filename=datafile)
+        scan_with_prefetch(scanname,  filename=datafile,
+                           meta={'macro': 'maplist', 'position': pname},
+                           moves=moves, ordered=True)
         if check_scan_abort():  return
     #endfor
 #enddef
 
 
 
-def herfd_scan(posname, scanname, energies=[7045, 7057, 7058, 7059, 7060]):
+def _check_emission(macro, energies):
+    """--private-- check emission energies against analyzer motor limits
+
+    Returns:
+        (ok, move_time): whether all energies are reachable, and the
+        estimated total analyzer move time.
+    """
+    det_track = caget(ANALYZER_PREFIX + 'det_track') == 1
+    plan = plan_emission(energies, det_track=det_track)
+    if plan is None:
+        print("#%s: analyzer PVs not connected, cannot check emission energies" % macro)
+        return False, 0.0
+    table, problems, steptimes = plan
+    for energy, motor, value in problems:
+        print("#%s: emission energy %.2f needs %s=%.3f, outside limits" %
+              (macro, energy, motor, value))
+    return len(problems) == 0, float(np.nansum(steptimes))
+#enddef
+
+def herfd_scan(posname, scanname, energies=[7045, 7057, 7058, 7059, 7060],
+               dryrun=False):
     """
     repeat a scan at multiple emission energies
 
@@ -748,23 +906,38 @@ def herfd_scan(posname, scanname, energies=[7045, 7057, 7058, 7059, 7060]):
         posname  (string): position name
         scanname (string):  scan name
         energies (list): list of emission energies
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
 
     Note:
+        all emission energies are checked against the analyzer motor
+        limits before the scan starts.
     """
+    ok, movetime = _check_emission('herfd_scan', energies)
+    if dryrun:
+        scantime, nbytes = estimate_scan_time(scanname)
+        return dryrun_report('herfd_scan', len(energies), scantime, nbytes=nbytes,
+                             move_time=movetime)
+    #endif
+    if not ok: return
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
 
-    for en in energies:
+    for n, en in enumerate(energies):
         datafile = '%s_%d_%s.001' % (scanname, en, posname)
         caput('13XRM:ANA:Energy', en, wait=True)
-        do_scan(scanname,  filename=datafile)
+        moves = None
+        if n+1 < len(energies):
+            moves = [('13XRM:ANA:Energy', energies[n+1])]
+        scan_with_prefetch(scanname,  filename=datafile, moves=moves,
+                           meta={'macro': 'herfd_scan', 'position': posname})
         if check_scan_abort(): return
     #endfor
 #enddef
 
-def rixs_scan(posname, scanname, estart=7055, estop=7062, estep=0.25):
+def rixs_scan(posname, scanname, estart=7055, estop=7062, estep=0.25,
+              dryrun=False):
     """
     repeat a scan at multiple emission energies
 
@@ -774,6 +947,7 @@ def rixs_scan(posname, scanname, estart=7055, estop=7062, estep=0.25):
         estart   (float): emission energy start
         estop   (float):  mission energy stop
         estep   (float):  emission energy step
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
        redox_map('FeO1', 'FeHERFD', estart=7050, estop=7060, estep=0.1)
@@ -785,20 +959,31 @@ def rixs_scan(posname, scanname, estart=7055, estop=7062, estep=0.25):
         'MyMap_sampleX_5465.0eV.001',
         'MyMap_sampleX_5500.0eV.001',
 
+        all emission energies are checked against the analyzer motor
+        limits before the scan starts.
     """
+    energies = np.linspace(estart, estop, _npts(estart, estop, estep))
+    ok, movetime = _check_emission('rixs_scan', energies)
+    if dryrun:
+        scantime, nbytes = estimate_scan_time(scanname)
+        return dryrun_report('rixs_scan', len(energies), scantime, nbytes=nbytes,
+                             move_time=movetime)
+    #endif
+    if not ok: return
     if check_abort_pause(): return
     move_samplestage(posname, wait=True)
 
     datafile = '%s_%s' % (scanname, posname)
 
-    nepts = int((estop-estart + 1.1*estep)/estep)
-    energies = linspace(estart, estop, nepts)
-
-    for en in energies:
+    for n, en in enumerate(energies):
         caput('13XRM:ANA:Energy', en)
         fast_mono_tilt()
         dfile = '%s_emission%.1feV.001' % (datafile, en)
-        do_scan(scanname,  filename=dfile)
+        moves = None
+        if n+1 < len(energies):
+            moves = [('13XRM:ANA:Energy', energies[n+1])]
+        scan_with_prefetch(scanname,  filename=dfile, moves=moves,
+                           meta={'macro': 'rixs_scan', 'position': posname})
         if check_scan_abort(): return
     #endfor
 #enddef
@@ -814,7 +999,8 @@ def ssa_xafs(posname, scanname,
         set_mono_tilt()
         collect_offsets()
         fname = fileform(posname, scanname, sval*1000)
-        do_scan(scanname, filename=fname)
+        timed_scan(scanname, filename=fname,
+                   meta={'macro': 'ssa_xafs', 'position': posname})
 
 
 def xrf_maps():
@@ -841,21 +1027,32 @@ def xrf_maps():
                 for fval in filters:
                     filter(fval)
                     fname = fileform(sample, en, ddist, fval)
-                    do_scan(mapname, filename=fname)
+                    timed_scan(mapname, filename=fname,
+                               meta={'macro': 'xrf_maps', 'position': sample})
 
 
-def xafs_dtc_scans(posname, scanname):
+def xafs_dtc_scans(posname, scanname, resume=False):
     FOE_VALS = (0.75, 0.4, 0.1)
     DET_VALS = (60.0, 65.0, 70.0)
     SSA_VALS = (0.20, 0.10, 0.050, 0.025, 0.010, 0.005)
+    ckpt = checkpoint_begin('xafs_dtc_scans',
+                            dict(posname=posname, scanname=scanname),
+                            resume=resume)
+    npts = len(SSA_VALS)
+    index = 0
     for fval in FOE_VALS:
-        caput('13IDA:m6.VAL', fval)
         for dval in DET_VALS:
+            if all([checkpoint_skip(ckpt, index+i+1) for i in range(npts)]):
+                index += npts
+                continue
+            caput('13IDA:m6.VAL', fval)
             caput('13IDE:m19.VAL', dval)
             ssa_hsize(SSA_VALS[0])
             set_mono_tilt()
             autoset_i0amp_gain()
             for sval in SSA_VALS:
+                index += 1
+                if checkpoint_skip(ckpt, index): continue
                 ssa_hsize(sval)
                 print("---> hsize ", sval)
                 fast_mono_tilt()
@@ -863,10 +1060,14 @@ def xafs_dtc_scans(posname, scanname):
                 autoset_i0amp_gain()
                 print("starting scan")
                 sleep(1)
-                pos_scan(posname, scanname)
+                datafile = pos_scan(posname, scanname)
+                if datafile is None: return
+                checkpoint_point(ckpt, index, datafile)
+                if check_scan_abort(): return
             #endfor
         #endfor
     #endfor
+    checkpoint_end(ckpt)
 #enddef
 
 def xafs_dtc1(posname, scanname):
@@ -885,13 +1086,18 @@ def xafs_dtc1(posname, scanname):
 #enddef
 
 
-def fe_map(scanname, posname):
+def fe_map(scanname, posname, tune=None, resume=False, dryrun=False):
     """
     repeat a scan at multiple energies around Fe edge - a custom redox map
 
     Parameters:
         posname (string): position name
         scanname (string):  scan name
+        tune (None, 'fast' or 'full'): how to tune the mono tilt at each
+            energy, reusing cached values where possible [None, no tuning]
+        resume (True or False): skip energies completed in an earlier,
+            interrupted run with the same parameters [False]
+        dryrun (True or False): only report estimated time and size [False]
 
     Example:
        fe_map('MyMap')
@@ -902,20 +1108,26 @@ def fe_map(scanname, posname):
         'MyMap_sampleX_7100.0eV.001',
         'MyMap_sampleX_7105.0eV.001'
     """
-    if check_abort_pause(): return
-    move_samplestage(posname, wait=True)
-    datafile = '%s_%s' % (scanname, posname)
-
     energies = [7100, 7105, 7107, 7108, 7109]
     energies.extend(np.arange(7110,  7114, 0.25).tolist())
     energies.extend(np.arange(7114,  7130,  1.0).tolist())
     energies.extend(np.arange(7130,  7250, 10.0).tolist())
+    if dryrun:
+        scantime, nbytes = estimate_scan_time(scanname)
+        return dryrun_report('fe_map', len(energies), scantime, nbytes=nbytes,
+                             extra=energy_stack_time(energies, tune=tune))
+    #endif
 
-    for en in energies:
-        move_energy(en)
-        dfile = '%s_%.2feV' % (datafile, en)
-        do_scan(scanname,  filename=dfile)
-        if check_scan_abort(): return
+    if check_abort_pause(): return
+    move_samplestage(posname, wait=True)
+    datafile = '%s_%s' % (scanname, posname)
+
+    ckpt = checkpoint_begin('fe_map', dict(scanname=scanname, posname=posname, tune=tune),
+                            resume=resume)
+    if energy_stack(scanname, energies, datafile.replace('%', '%%') + '_%.2feV',
+                    tune=tune, ckpt=ckpt):
+        checkpoint_end(ckpt)
+#enddef
 
 
 def cu_grid(posname, xjump=0.200, yjump=0, energy1=8983.9, energy2=9200,
@@ -0,0 +1,227 @@
+##
+## Scan paths: point sets shared by the scanning macros
+##
+##   Each path function returns a "plan" dictionary with
+##     'motors':    list of motor names, in the order they are moved
+##     'pvnames':   list of motor PV names
+##     'pvs':       list of connected PV objects for the motors
+##     'points':    array (npts, nmotors) of motor values
+##     'moves':     array (npts, nmotors) of whether each motor moves at each point
+##     'index':     array (npts, 2) of (iy, ix) for each point, starting at 0
+##     'shape':     (ny, nx)
+##     'filenames': list of file names, one per point (or None)
+##
+##   File names are made from `fileform`, a format string that may use
+##   {i} (point number), {iy} and {ix} (row and column), all starting at 1.
+##
+##   The scanning macros just iterate over a plan, so new path shapes
+##   only need a new function here.
+
+import numpy as np
+
+def _npts(start, stop, step):
+    "--private-- number of points from start to stop (inclusive) for step size"
+    return int(1.0 + (abs(start-stop)+0.1*abs(step))/abs(step))
+#enddef
+
+def make_plan(motors, points, fileform=None, index=None, shape=None):
+    """
+    make a scan plan from motor names and an array of points
+
+    Parameters:
+        motors (list of strings): motor names (as for _getPV) or PV names
+        points (array): motor values, shape (npts, nmotors)
+        fileform (string or None): format string for file names [None]
+        index (array or None): (iy, ix) for each point [None, meaning (0, i)]
+        shape (tuple or None): (ny, nx) [None, meaning (1, npts)]
+
+    Returns:
+        plan dictionary, or None if a motor cannot be found.
+    """
+    pvnames = []
+    for mname in motors:
+        pvname = _getPV(mname)
+        if pvname is None and ':' in mname:
+            pvname = mname
+        if pvname is None:
+            print("Error: cannot find motor named '%s'" % mname)
+            return None
+        pvnames.append(pvname)
+    #endfor
+    points = np.asarray(points, dtype='float64').reshape((-1, len(motors)))
+    npts = points.shape[0]
+    if index is None:
+        index = np.zeros((npts, 2), dtype='int32')
+        index[:, 1] = np.arange(npts)
+    if shape is None:
+        shape = (1, npts)
+    moves = np.ones(points.shape, dtype=bool)
+    moves[1:] = np.diff(points, axis=0) != 0
+
+    filenames = [None]*npts
+    if fileform is not None:
+        filenames = [fileform.format(i=i+1, iy=iy+1, ix=ix+1)
+                     for i, (iy, ix) in enumerate(index)]
+    return {'motors': list(motors), 'pvnames': pvnames,
+            'pvs': [get_pv(pvname) for pvname in pvnames],
+            'points': points, 'moves': moves, 'index': index,
+            'shape': shape, 'filenames': filenames}
+#enddef
+
+def line_path(motor, start=0, stop=0.1, step=0.001, npts=None, fileform=None):
+    """
+    plan for evenly spaced points of one motor
+
+    Parameters:
+        motor (string): name of motor
+        start, stop (float): first and last motor values
+        step (float): step size, used if npts is None [0.001]
+        npts (int or None): number of points [None]
+        fileform (string or None): format string for file names [None]
+    """
+    if npts is None:
+        npts = _npts(start, stop, step)
+    return make_plan([motor], np.linspace(start, stop, npts), fileform=fileform)
+#enddef
+
+def list_path(motors, points, fileform=None):
+    """
+    plan for an arbitrary list of points
+
+    Parameters:
+        motors (string or list of strings): motor name(s)
+        points (list or array): values, shape (npts,) or (npts, nmotors)
+        fileform (string or None): format string for file names [None]
+    """
+    if isinstance(motors, str):
+        motors = [motors]
+    return make_plan(motors, points, fileform=fileform)
+#enddef
+
+def grid_path(x='x', y='y', xstart=0, xstop=0.1, xstep=0.001,
+              ystart=0, ystop=0.1, ystep=0.001, fileform=None):
+    """
+    plan for an x, y grid, with y as the outer (slow) loop
+
+    Note:
+        motors are ordered [y, x], so that y moves first on each new row.
+    """
+    nx = _npts(xstart, xstop, xstep)
+    ny = _npts(ystart, ystop, ystep)
+    iy, ix = np.mgrid[0:ny, 0:nx]
+    index = np.column_stack((iy.ravel(), ix.ravel()))
+    points = np.column_stack((np.linspace(ystart, ystop, ny)[index[:, 0]],
+                              np.linspace(xstart, xstop, nx)[index[:, 1]]))
+    return make_plan([y, x], points, fileform=fileform,
+                     index=index, shape=(ny, nx))
+#enddef
+
+def diagonal_path(x='x', y='y', xstart=0, xstop=0.1, xstep=0.001,
+                  ystart=0, ystop=0.1, fileform=None):
+    """
+    plan for points along a diagonal of two motors, with the
+    number of points set by the x step size.
+    """
+    npts = _npts(xstart, xstop, xstep)
+    points = np.column_stack((np.linspace(xstart, xstop, npts),
+                              np.linspace(ystart, ystop, npts)))
+    return make_plan([x, y], points, fileform=fileform)
+#enddef
+
+def transect_path(pos1, pos2, npts=11, fileform=None):
+    """
+    plan for evenly spaced points between the fine X, Y values of two
+    named SampleStage positions.
+
+    Note:
+        the coarse stage is used for X or Y if the fine stage
+        values of the two positions are the same.
+    """
+    instrument = _scandb.get_info('samplestage_instrument', 'SampleStage')
+    p1 = _instdb.get_position(instrument, pos1)
+    p2 = _instdb.get_position(instrument, pos2)
+    if p1 is None:
+        print("Error: cannot find position '%s'" % pos1)
+        return None
+    if p2 is None:
+        print("Error: cannot find position '%s'" % pos2)
+        return None
+
+    motors, starts, stops = [], [], []
+    for fine, coarse in ((0, 4), (1, 5)):
+        start = float(p1.pv[fine].value)
+        stop  = float(p2.pv[fine].value)
+        motor = p1.pv[fine].pv.name
+        if abs(stop-start) < 0.001:
+            start = float(p1.pv[coarse].value)
+            stop  = float(p2.pv[coarse].value)
+            motor = p1.pv[coarse].pv.name
+        motors.append(motor)
+        starts.append(start)
+        stops.append(stop)
+    #endfor
+    points = np.column_stack((np.linspace(starts[0], stops[0], npts),
+                              np.linspace(starts[1], stops[1], npts)))
+    return make_plan(motors, points, fileform=fileform)
+#enddef
+
+def spiral_path(x='x', y='y', xcenter=0, ycenter=0, radius=0.05,
+                step=0.005, fileform=None):
+    """
+    plan for an outward Archimedean spiral with about `step` between
+    neighbouring points and between turns, out to `radius`.
+    """
+    npts = 1 + int(np.pi*(radius/step)**2)
+    k = np.arange(npts)
+    theta = np.sqrt(4*np.pi*k)
+    rad = step*np.sqrt(k/np.pi)
+    points = np.column_stack((xcenter + rad*np.cos(theta),
+                              ycenter + rad*np.sin(theta)))
+    return make_plan([x, y], points, fileform=fileform)
+#enddef
+
+def plan_move(plan, i, wait=True, allmotors=False):
+    """
+    move motors to point `i` of a plan
+
+    Parameters:
+        plan (dict): scan plan
+        i (int): point number, starting at 0
+        wait (True or False): whether to wait for each move [True]
+        allmotors (True or False): move all motors, not only those
+            that changed since the previous point [False]
+
+    Note:
+        with wait=True, each motor is waited for with move_in_position(),
+        so motors with an in-position policy are released early.  The
+        policies are looked up once per plan.
+    """
+    if wait and 'policies' not in plan:
+        plan['policies'] = motion_policies(plan['pvnames'])
+    for pvname, pv, val, moves in zip(plan['pvnames'], plan['pvs'],
+                                      plan['points'][i], plan['moves'][i]):
+        if not (moves or allmotors):
+            continue
+        if wait:
+            move_in_position(pvname, float(val), timeout=60.0,
+                             policy=plan['policies'][pvname])
+        else:
+            pv.put(val)
+    #endfor
+#enddef
+
+def plan_targets(plan, i, allmotors=False):
+    """
+    (pvname, value) pairs for the moves to point `i` of a plan,
+    as done by plan_move()
+    """
+    return [(pvname, val) for pvname, val, moves in
+            zip(plan['pvnames'], plan['points'][i].tolist(), plan['moves'][i])
+            if moves or allmotors]
+#enddef
+
+def plan_move_time(plan):
+    "estimated time for all motor moves of a plan"
+    return sum([path_move_time(pvname, plan['points'][:, j])
+                for j, pvname in enumerate(plan['pvnames'])])
+#enddef
@@ -0,0 +1,176 @@
+##
+## Learned settle times
+##
+##   Instead of a fixed sleep after a move or a gain change, macros call
+##   wait_settled() with the readbacks that need to settle.  It returns as
+##   soon as every readback has stayed within a tolerance for a short
+##   window, and never waits longer than the fixed sleep it replaces
+##   (`default`).  Each measured settle time is kept (per key, such as
+##   'samplestage' or 'gain:13IDE:I0_Volts') in the 'settle_times' info
+##   entry.  A high percentile of the recent measurements is used when
+##   there are no readbacks to watch, and otherwise only as the time of
+##   the first readback check.  Waits that reach `default` without
+##   settling are printed, and not kept as measurements.
+##   settle_report() prints what has been measured.
+##
+##   Measurements are buffered in memory, and written to ScanDB at most
+##   every SETTLE_FLUSH seconds, or with settle_flush().
+
+import json
+import asyncio
+import numpy as np
+from time import time, monotonic as clock
+
+SETTLE_INFO = 'settle_times'
+SETTLE_HISTORY = 25        # number of measurements kept per key
+SETTLE_PERCENTILE = 90.0   # percentile of measurements used as learned time
+SETTLE_WINDOW = 0.10       # time readbacks must stay within tolerance
+SETTLE_POLL = 0.01
+SETTLE_FLUSH = 60.0        # seconds between writes of measurements to ScanDB
+
+SAMPLESTAGE_MOTORS = ('finex', 'finey', 'focus', 'coarsex', 'coarsey')
+
+_SETTLE = {'table': None, 'pending': {}, 'tflush': clock()}
+
+def _settle_read():
+    "--private-- settle measurements in ScanDB: {key: [seconds, ...]}, oldest first"
+    try:
+        return json.loads(_scandb.get_info(SETTLE_INFO, '{}'))
+    except (TypeError, ValueError):
+        return {}
+#enddef
+
+def _settle_table():
+    "--private-- settle measurements, including those not yet written"
+    if _SETTLE['table'] is None:
+        _SETTLE['table'] = _settle_read()
+    return _SETTLE['table']
+#enddef
+
+def settle_flush():
+    "write buffered settle measurements to ScanDB"
+    _SETTLE['tflush'] = clock()
+    if len(_SETTLE['pending']) < 1:
+        return
+    table = _settle_read()
+    for key, vals in _SETTLE['pending'].items():
+        table[key] = (table.get(key, []) + vals)[-SETTLE_HISTORY:]
+    _scandb.set_info(SETTLE_INFO, json.dumps(table))
+    _SETTLE['table'], _SETTLE['pending'] = table, {}
+#enddef
+
+def record_settle(key, elapsed):
+    "add a measured settle time (in seconds) for a key"
+    elapsed = round(elapsed, 4)
+    table = _settle_table()
+    table[key] = (table.get(key, []) + [elapsed])[-SETTLE_HISTORY:]
+    _SETTLE['pending'].setdefault(key, []).append(elapsed)
+    if clock() - _SETTLE['tflush'] > SETTLE_FLUSH:
+        settle_flush()
+#enddef
+
+def learned_settle(key, default=None):
+    "learned settle time for a key, or `default` if nothing has been measured"
+    history = _settle_table().get(key, [])
+    if len(history) < 1:
+        return default
+    return float(np.percentile(history, SETTLE_PERCENTILE))
+#enddef
+
+async def wait_settled_async(key, pvnames=None, default=1.0, tol=None, rtol=0.01,
+                             window=SETTLE_WINDOW, fresh=False):
+    """
+    wait until readbacks have settled, at most `default` seconds
+
+    Parameters:
+        key (string): name of what is settling, for the learned times
+        pvnames (list or None): readback PVs to watch [None]
+        default (float): fixed wait this replaces, and maximum wait [1.0]
+        tol (float or None): absolute tolerance [None, use rtol]
+        rtol (float): relative tolerance, used if tol is None [0.01]
+        window (float): time readbacks must stay within tolerance [0.1]
+        fresh (True or False): require a new value of each readback,
+            for signals that update only after a change [False]
+
+    Returns:
+        settle time in seconds
+
+    Note:
+        with no readbacks, this waits for the learned settle time
+        of `key` (but at most `default`).  With readbacks, the first
+        check is made after the learned settle time (less `window`).
+    """
+    learned = await adb(learned_settle, key, None)
+    if not pvnames:
+        wait = default if learned is None else min(default, learned)
+        await asyncio.sleep(wait)
+        return wait
+    #endif
+    t0, tstart = clock(), time()
+    pvs = [get_pv(pvname) for pvname in pvnames]
+    ref, tstable = None, None
+    settled = False
+    if learned is not None:
+        await asyncio.sleep(max(0, min(learned - window, default - window)))
+    while clock() - t0 < default:
+        vals = [pv.get() for pv in pvs]
+        ready = None not in vals
+        if ready and fresh:
+            ready = all([(pv.timestamp or 0) > tstart for pv in pvs])
+        if ready:
+            if ref is None or any([abs(v - r) > (tol if tol is not None else rtol*abs(r))
+                                   for v, r in zip(vals, ref)]):
+                ref, tstable = vals, clock()
+            elif clock() - tstable >= window:
+                settled = True
+                break
+        #endif
+        await asyncio.sleep(SETTLE_POLL)
+    #endwhile
+    if not settled:
+        print("#settle: %s did not settle in %.2f s" % (key, default))
+        return default
+    elapsed = tstable - t0
+    await adb(record_settle, key, elapsed)
+    return elapsed
+#enddef
+
+def wait_settled(key, pvnames=None, default=1.0, tol=None, rtol=0.01,
+                 window=SETTLE_WINDOW, fresh=False):
+    """
+    wait until readbacks have settled, at most `default` seconds.
+    See wait_settled_async() for parameters.
+
+    Example:
+        wait_settled('mono_tilt', ['13IDE:I0_Volts'], default=2.0, fresh=True)
+    """
+    return run_async(wait_settled_async(key, pvnames=pvnames, default=default,
+                                        tol=tol, rtol=rtol, window=window,
+                                        fresh=fresh))
+#enddef
+
+def samplestage_settled(default=1.0):
+    "wait for the sample stage readbacks to settle after a move"
+    pvnames = [_getPV(m).split('.')[0] + '.RBV' for m in SAMPLESTAGE_MOTORS]
+    return wait_settled('samplestage', pvnames, default=default, tol=0.0005)
+#enddef
+
+def settle_report():
+    """
+    print measured settle times
+
+    Returns:
+        dict of key: (number of measurements, median, learned time, last)
+    """
+    settle_flush()
+    out = {}
+    print("# %-36s %5s %9s %9s %9s" % ('settle key', 'n', 'median', 'learned', 'last'))
+    for key, history in sorted(_settle_table().items()):
+        if len(history) < 1:
+            continue
+        out[key] = (len(history), float(np.median(history)),
+                    learned_settle(key), history[-1])
+        print("  %-36s %5d %9.3f %9.3f %9.3f" % ((key,) + out[key]))
+    #endfor
+    return out
+#enddef
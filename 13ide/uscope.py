@@ -21,7 +21,6 @@ make_uscope_rotation()
 """
 
 import json
-from lmfit import minimize, Parameters, report_fit
 import numpy as np
 
 def affine_matrix_from_points(v0, v1, scale=True, usesvd=True):
@@ -171,7 +170,6 @@ def superimposition_matrix(v0, v1, scale=False, usesvd=True):
     """
     v0 = np.array(v0, dtype=np.float64)[:3]
     v1 = np.array(v1, dtype=np.float64)[:3]
-    print("XX  ", v0, v1)
     return affine_matrix_from_points(v0, v1, scale=scale, usesvd=usesvd)
 
 
@@ -191,13 +189,9 @@ def read_uscope_xyz(name=USCOPE_NAME):
     read XYZ Positions from Offline Microscope Instrument
     returns dictionary of PositionName: (x, y, z)
     """
-    out = {}
-    for pname in _instdb.get_positionlist(name):
-        v = _instdb.get_position_vals(name, pname)
-        out[pname]  = [v[p] for p in USCOPE_XYZ]
-    #endfor
-
-    return out
+    names, pvnames, vals = read_positions(name, pvnames=USCOPE_XYZ)
+    keep = np.all(np.isfinite(vals), axis=1)
+    return positions_dict(np.array(names)[keep], vals[keep])
 #enddef
 
 def read_sample_xyz(name=SSTAGE_NAME):
@@ -207,14 +201,9 @@ def read_sample_xyz(name=SSTAGE_NAME):
 
     Note: FineX, FineY and Theta stages are not included
     """
-    out = {}
-    for pname in _instdb.get_positionlist(name):
-        v = _instdb.get_position_vals(name, pname)
-        if SSTAGE_XYZ[0] in v:
-            out[pname]  = [v[p] for p in SSTAGE_XYZ]
-        #endif
-    #endfor
-    return out
+    names, pvnames, vals = read_positions(name, pvnames=SSTAGE_XYZ)
+    keep = np.all(np.isfinite(vals), axis=1)
+    return positions_dict(np.array(names)[keep], vals[keep])
 #enddef
 
 
@@ -234,58 +223,105 @@ def params2rotmatrix(params, mat):
 def resid_rotmatrix(params, mat, v1, v2):
     "--private-- resdiual function for fit"
     mat = params2rotmatrix(params, mat)
-    return (v2 - dot(mat, v1)).flatten()
+    return (v2 - np.dot(mat, v1)).flatten()
 #enddef
 
 
-def calc_rotmatrix(d1, d2):
-    """get best-fit rotation matrix to transform coordinates
-    from 1st position dict into the 2nd position dict
+def affine_lstsq(v1, v2, weights=None):
+    """linear least-squares affine transform from one point set to another
+
+    v1 and v2 are shape (3, npts) or (4, npts) arrays of matching points,
+    weights an optional array of npts weights.
+
+    Returns (mat, inverse, resid): the 4x4 homogeneous matrix taking v1
+    to v2, its inverse taking v2 to v1, and the distance between each
+    transformed v1 point and its v2 point.
     """
-    labels = []
-    d2keys = d2.keys()
-    for x in d1.keys():
-        if x in d2keys:
-            labels.append(x)
-        #endif
+    v1 = np.array(v1, dtype=np.float64)[:3]
+    v2 = np.array(v2, dtype=np.float64)[:3]
+    npts = v1.shape[1]
+    a = np.column_stack((v1.T, np.ones(npts)))
+    b = v2.T
+    if weights is not None:
+        wts = np.sqrt(np.asarray(weights, dtype=np.float64)).reshape(npts, 1)
+        a, b = a*wts, b*wts
+    #endif
+    coefs = np.linalg.lstsq(a, b, rcond=None)[0]
+    mat = np.identity(4)
+    mat[:3, :] = coefs.T
+    pred = np.dot(mat[:3, :3], v1) + mat[:3, 3:]
+    resid = np.sqrt(((pred - v2)**2).sum(axis=0))
+    return mat, np.linalg.inv(mat), resid
+#enddef
+
+def _common_points(d1, d2, weights=None):
+    """--private-- sorted common labels of two position dicts, and
+    (4, npts) arrays of their points and array of weights"""
+    labels = sorted([x for x in d1.keys() if x in d2])
+    v1 = np.ones((4, len(labels)))
+    v2 = np.ones((4, len(labels)))
+    for i, label in enumerate(labels):
+        v1[:3, i] = d1[label][:3]
+        v2[:3, i] = d2[label][:3]
     #endfor
-    labels.sort()
+    wts = None
+    if weights is not None:
+        wts = np.array([weights.get(label, 1.0) for label in labels])
+    return labels, v1, v2, wts
+#enddef
+
+def calc_registration(d1, d2, weights=None, refine=False):
+    """best-fit affine transforms between two position dicts
+
+    Parameters:
+        d1, d2 (dict): position dicts of name: (x, y, z)
+        weights (dict or None): name: weight for any positions
+            that should not have weight 1 [None]
+        refine (True or False): refine off-diagonal terms
+            with a non-linear fit (uses lmfit) [False]
+
+    Returns:
+        (mat, inverse, labels, resid): transforms from d1 to d2 and
+        from d2 to d1, the labels used, and the residual for each label.
+        mat is None if there are fewer than 6 common positions.
+    """
+    labels, v1, v2, wts = _common_points(d1, d2, weights=weights)
     if len(labels) < 6:
         print("""Error: need at least 6 saved positions
   in common to calculate rotation matrix""")
-        return None, None, None
+        return None, None, labels, None
     #endif
-    print("Calculating Rotation Matrix using Labels:")
-    print(labels)
-    v1 = ones((4, len(labels)))
-    v2 = ones((4, len(labels)))
-    for i, label in enumerate(labels):
-        v1[0, i] = d1[label][0]
-        v1[1, i] = d1[label][1]
-        v1[2, i] = d1[label][2]
-        v2[0, i] = d2[label][0]
-        v2[1, i] = d2[label][1]
-        v2[2, i] = d2[label][2]
-    #endfor
-
-    # get initial rotation matrix, assuming that
-    # there are orthogonal coordinate systems.
-    mat = superimposition_matrix(v1, v2, scale=True)
-    print("Got Mat ", mat)
+    mat, inverse, resid = affine_lstsq(v1, v2, weights=wts)
+    if refine:
+        mat = refine_rotmatrix(mat, v1, v2)
+        inverse = np.linalg.inv(mat)
+        resid = np.sqrt(((np.dot(mat, v1) - v2)[:3]**2).sum(axis=0))
+    #endif
+    print("Registration using %d positions, RMS residual %.4f, worst %s (%.4f)" %
+          (len(labels), np.sqrt((resid**2).mean()), labels[np.argmax(resid)], resid.max()))
+    return mat, inverse, labels, resid
+#enddef
 
+def refine_rotmatrix(mat, v1, v2):
+    """--private-- refine off-diagonal terms of a transform with lmfit"""
+    from lmfit import minimize, Parameters
     params = Parameters()
-    params.add('c10', value=mat[1][0])
-    params.add('c01', value=mat[0][1])
-    params.add('c20', value=mat[2][0])
-    params.add('c02', value=mat[0][2])
-    params.add('c12', value=mat[1][2])
-    params.add('c21', value=mat[2][1])
-
-    fit_result = minimize(resid_rotmatrix, params, args=(mat, v1, v2))
-    print("Fit result ", report_fit(fit_result))
-    mat = params2rotmatrix(fit_result.params, mat)
-    print(" Calculated Rotation Matrix. ")
-    print(mat)
+    for name in ('c10', 'c01', 'c20', 'c02', 'c12', 'c21'):
+        params.add(name, value=mat[int(name[1])][int(name[2])])
+    #endfor
+    fit_result = minimize(resid_rotmatrix, params, args=(mat.copy(), v1, v2))
+    return params2rotmatrix(fit_result.params, mat.copy())
+#enddef
+
+def calc_rotmatrix(d1, d2, weights=None, refine=False):
+    """get best-fit rotation matrix to transform coordinates
+    from 1st position dict into the 2nd position dict
+    """
+    mat, inverse, labels, resid = calc_registration(d1, d2, weights=weights,
+                                                    refine=refine)
+    if mat is None:
+        return None, None, None
+    labels, v1, v2, wts = _common_points(d1, d2)
     return mat, v1, v2
 #enddef
 
@@ -312,8 +348,8 @@ def make_uscope_rotation():
 
     d1 = read_uscope_xyz()
     d2 = read_sample_xyz()
-    # calculate the rotation matrix
-    mat_us2ss, v1, v2 = calc_rotmatrix(d1, d2)
+    # calculate the transforms in both directions
+    mat_us2ss, mat_ss2us, labels, resid = calc_registration(d1, d2)
     if mat_us2ss is None:
         return
     #endif
@@ -330,8 +366,6 @@ def make_uscope_rotation():
     # print("Set Config ", conf_us2ss, json.dumps(us2ss))
     _scandb.set_config(conf_us2ss, json.dumps(us2ss))
 
-    # calculate the rotation matrix going the other way
-    mat_ss2us, v1, v2 = calc_rotmatrix(d2, d1)
     conf_ss2us = "CoordTrans:%s:%s" % (sname, uname)
 
     ss2us = dict(source=SSTAGE_XYZ, dest=USCOPE_XYZ,
@@ -378,32 +412,19 @@ def uscope2sample(suffix='', xoffset=0, yoffset=0, zoffset=0):
         print("Error: could not get rotation matrix!")
         return
     #endtry
-    upos   = read_uscope_xyz()
-    labels = upos.keys()
-
-    v = ones((4, len(labels)))
-    for i, key in enumerate(labels):
-        v[0, i] = upos[key][0]
-        v[1, i] = upos[key][1]
-        v[2, i] = upos[key][2]
-    #endfor
+    names, pvnames, uvals = read_positions(USCOPE_NAME, pvnames=USCOPE_XYZ)
+    keep = np.all(np.isfinite(uvals), axis=1)
+    labels = ['%s%s' % (label, suffix) for label in np.array(names)[keep]]
     # Predict coordinates in SampleStage coordination system
-    pred = dot(rotmat, v)
-    # make SampleStage coordinates
-    poslist = _instdb.get_positionlist(SSTAGE_NAME)
-    pos0    = _instdb.get_position_vals(SSTAGE_NAME, poslist[0])
-    pvs = pos0.keys()
-    pvs.sort()
-    spos = OrderedDict()
-    for pvname in pvs:
-        spos[pvname] = 0.000
-    #endfor
-    xpv, ypv, zpv = SSTAGE_XYZ
-    for i, label in enumerate(labels):
-        spos[xpv] = pred[0, i] + xoffset
-        spos[ypv] = pred[1, i] + yoffset
-        spos[zpv] = pred[2, i] + zoffset
-        nlabel = '%s%s' % (label, suffix)
-        _instdb.save_position(SSTAGE_NAME, nlabel, spos)
+    v = np.column_stack((uvals[keep], np.ones(len(labels))))
+    pred = np.dot(v, rotmat.T)[:, :3] + np.array([xoffset, yoffset, zoffset])
+
+    # make SampleStage coordinates, with all other stages at 0
+    pvs = sorted(instrument_pvnames(SSTAGE_NAME))
+    spos = np.zeros((len(labels), len(pvs)))
+    for j, pvname in enumerate(SSTAGE_XYZ):
+        spos[:, pvs.index(pvname)] = pred[:, j]
     #endfor
+    nsaved = write_positions(SSTAGE_NAME, labels, pvs, spos)
+    print("Saved %d of %d positions to %s" % (nsaved, len(labels), SSTAGE_NAME))
 #enddef
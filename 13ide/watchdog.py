@@ -0,0 +1,258 @@
+##
+## Watchdog for blocking moves
+##
+##   Every blocking put made through watched_put() (and the motor moves of
+##   the scan loops, through move_in_position()) is registered while it is
+##   outstanding.  Each is checked against
+##     - an expected duration: from the motor VELO and ACCL fields and the
+##       distance to go, or else the learned time for the PV (see
+##       record_timing()), times WATCHDOG 'margin' plus 'min_time';
+##     - stalls: the readback not changing for 'stall_time' seconds, once
+##       the move has started (the readback has changed, or the motor
+##       DMOV has gone to 0), so a slow start is not taken as a stall.
+##   Until an expected duration is known, a move is allowed 'timeout'
+##   seconds.
+##   On a stall or an overdue move, the 'recovery' setting decides what
+##   happens:
+##     'retry':  stop the motor, wait for the stopped put to complete, and
+##               put the target again (up to 'retries' times), then 'stop'
+##     'stop':   stop the motor and return, with a logged error
+##     'skip':   stop the motor, log the error and raise MoveStalled, so
+##               that the current macro ends and the queue goes on with
+##               its next command.
+##   Errors are printed and kept in the 'watchdog_last_error' info entry.
+##
+##   Only puts made through watched_put() and move_in_position() are
+##   watched: the moves made by move_samplestage() (a scan server builtin)
+##   are not.
+
+import json
+import asyncio
+from time import time, sleep, ctime, monotonic as clock
+
+WATCHDOG_INFO = 'move_watchdog'
+WATCHDOG_ERROR_INFO = 'watchdog_last_error'
+WATCHDOG_DEFAULTS = {'recovery': 'retry', 'retries': 1, 'stall_time': 5.0,
+                     'margin': 3.0, 'min_time': 10.0, 'timeout': 60.0}
+WATCHDOG_POLL = 0.01
+
+_WATCHED = {}
+_MOTOR_RECORDS = {}
+
+class MoveStalled(Exception):
+    "a watched move stalled or took too long, with recovery='skip'"
+    pass
+
+def set_watchdog(**kws):
+    """
+    configure the move watchdog
+
+    Parameters:
+        recovery (string): 'retry', 'stop', or 'skip' ['retry']
+        retries (int): number of retries before stopping [1]
+        stall_time (float): time without readback change that is a stall [5]
+        margin (float): multiple of expected time allowed [3]
+        min_time (float): time added to the allowed time [10]
+        timeout (float): allowed time when nothing is known of the PV [60]
+
+    Example:
+        set_watchdog(recovery='skip', stall_time=10)
+    """
+    conf = watchdog_config()
+    for key, val in kws.items():
+        if key not in WATCHDOG_DEFAULTS:
+            raise ValueError("unknown watchdog setting '%s'" % key)
+        conf[key] = val
+    #endfor
+    if conf['recovery'] not in ('retry', 'stop', 'skip'):
+        raise ValueError("watchdog recovery must be 'retry', 'stop', or 'skip'")
+    _scandb.set_info(WATCHDOG_INFO, json.dumps(conf))
+#enddef
+
+def watchdog_config():
+    "current watchdog settings"
+    conf = dict(WATCHDOG_DEFAULTS)
+    try:
+        conf.update(json.loads(_scandb.get_info(WATCHDOG_INFO, '{}')))
+    except (TypeError, ValueError):
+        pass
+    return conf
+#enddef
+
+def _is_motor(record):
+    "--private-- whether a record is a motor record, cached"
+    if record not in _MOTOR_RECORDS:
+        _MOTOR_RECORDS[record] = get_pv(record + '.DMOV').wait_for_connection(timeout=0.25)
+    return _MOTOR_RECORDS[record]
+#enddef
+
+def watch_begin(pvname, value, timeout=None, readback=None):
+    """
+    register an outstanding blocking put
+
+    Parameters:
+        pvname (string): PV being put
+        value: target value
+        timeout (float or None): maximum allowed time [None, from settings]
+        readback (string or None): readback PV to watch for stalls
+            [None, .RBV for motor records].  The expected time of a motor
+            move always uses the motor's own .RBV.
+
+    Returns:
+        watch dictionary for watch_check(), watch_recover() and watch_end()
+    """
+    conf = watchdog_config()
+    record = pvname.split('.')[0]
+    expected = None
+    dmov = None
+    if _is_motor(record):
+        if readback is None:
+            readback = record + '.RBV'
+        current = caget(record + '.RBV')
+        if current is not None:
+            expected = motor_move_time(pvname, [value - current])
+        dmov = get_pv(record + '.DMOV')
+    if expected is None:
+        expected, _n = learned_timing('put:%s' % pvname)
+    allowed = conf['timeout']
+    if expected is not None:
+        allowed = conf['min_time'] + conf['margin']*expected
+    if timeout is not None:
+        allowed = min(allowed, timeout)
+    now = clock()
+    watch = {'pvname': pvname, 'record': record, 'target': value,
+             'readback': None if readback is None else get_pv(readback),
+             'dmov': dmov, 'last': None, 'started': False,
+             't0': now, 't_change': now, 'tstart': time(),
+             'expected': expected, 'allowed': allowed, 'retries': 0,
+             'conf': conf}
+    if watch['readback'] is not None:
+        watch['last'] = watch['readback'].get()
+    _WATCHED[id(watch)] = watch
+    return watch
+#enddef
+
+def watch_check(watch):
+    """
+    check an outstanding put
+
+    Returns:
+        None if the move looks fine, 'stalled', or 'overdue'
+    """
+    now = clock()
+    if watch['readback'] is not None:
+        val = watch['readback'].get()
+        if val is not None and val != watch['last']:
+            watch['started'] = watch['started'] or watch['last'] is not None
+            watch['last'], watch['t_change'] = val, now
+        elif not watch['started']:
+            if watch['dmov'] is not None and watch['dmov'].get() == 0:
+                watch['started'], watch['t_change'] = True, now
+        elif now - watch['t_change'] > watch['conf']['stall_time']:
+            return 'stalled'
+    #endif
+    if now - watch['t0'] > watch['allowed']:
+        return 'overdue'
+    return None
+#enddef
+
+def watch_recover(watch, problem):
+    """
+    apply the watchdog recovery for a stalled or overdue put
+
+    Returns:
+        True if the put was retried (keep waiting), False if stopped.
+        Raises MoveStalled if recovery='skip'.
+    """
+    conf = watch['conf']
+    msg = "%s %s moving to %s after %.1f s (expected %s s)" % (
+        watch['pvname'], problem, watch['target'], clock()-watch['t0'],
+        'unknown' if watch['expected'] is None else '%.1f' % watch['expected'])
+    if conf['recovery'] == 'retry' and watch['retries'] < conf['retries']:
+        watch['retries'] += 1
+        print("#watchdog: %s, retrying" % msg)
+        if _is_motor(watch['record']):
+            caput(watch['record'] + '.STOP', 1)
+        if _wait_put_done(watch, conf['stall_time']):
+            get_pv(watch['pvname']).put(watch['target'], use_complete=True)
+            watch['t0'] = watch['t_change'] = clock()
+            watch['started'] = False
+            return True
+        msg = msg + ', and did not stop'
+    #endif
+    if _is_motor(watch['record']):
+        caput(watch['record'] + '.STOP', 1)
+    _scandb.set_info(WATCHDOG_ERROR_INFO, '%s: %s' % (ctime(), msg))
+    watch_end(watch, completed=False)
+    if conf['recovery'] == 'skip':
+        print("#watchdog: %s, stopped, skipping to next command" % msg)
+        raise MoveStalled(msg)
+    print("#watchdog: %s, stopped" % msg)
+    return False
+#enddef
+
+def _wait_put_done(watch, timeout):
+    "--private-- wait for the outstanding put of a watch to complete"
+    pv = get_pv(watch['pvname'])
+    t0 = clock()
+    while clock() - t0 < timeout:
+        if pv.put_complete:
+            return True
+        sleep(WATCHDOG_POLL)
+    #endwhile
+    return pv.put_complete
+#enddef
+
+def watch_end(watch, completed=True):
+    "unregister a put, recording its duration if it completed"
+    if _WATCHED.pop(id(watch), None) is None:
+        return
+    if completed and not _is_motor(watch['record']):
+        record_timing('put:%s' % watch['pvname'], time()-watch['tstart'])
+#enddef
+
+def watchdog_status():
+    """
+    outstanding watched puts
+
+    Returns:
+        list of (pvname, target, elapsed, allowed)
+    """
+    now = clock()
+    return [(w['pvname'], w['target'], now-w['t0'], w['allowed'])
+            for w in _WATCHED.values()]
+#enddef
+
+async def watched_put_async(pvname, value, timeout=None, readback=None):
+    """
+    awaitable caput(wait=True), with the watchdog
+
+    Returns:
+        True if the put completed, False if it was stopped
+    """
+    pv = get_pv(pvname)
+    watch = await adb(watch_begin, pvname, value, timeout=timeout, readback=readback)
+    pv.put(value, use_complete=True)
+    while not pv.put_complete:
+        problem = watch_check(watch)
+        if problem is not None and not await adb(watch_recover, watch, problem):
+            return False
+        await asyncio.sleep(WATCHDOG_POLL)
+    #endwhile
+    await adb(watch_end, watch)
+    return True
+#enddef
+
+def watched_put(pvname, value, timeout=None, readback=None):
+    """
+    caput(wait=True), with the watchdog
+
+    Returns:
+        True if the put completed, False if it was stopped
+
+    Example:
+        watched_put('13IDE:En:Energy.VAL', 7112.0)
+    """
+    return run_async(watched_put_async(pvname, value, timeout=timeout,
+                                       readback=readback))
+#enddef
@@ -3,8 +3,9 @@
 ##
 ## Note that an XRD camera must be installed!
 
+import asyncio
 from pathlib import Path
-from time import monotonic as clock
+from time import time, monotonic as clock
 from epicsscan.detectors.ad_eiger import EigerSimplon
 from epicsscan.detectors.ad_integrator import read_poni
 
@@ -15,7 +16,7 @@ CAMERA_EIG2 = '13EIG2:'
 CAMERA = _scandb.get_info('xrd_detector_prefix', CAMERA_EIG2)
 
 eiger500k_params = {'prefix': '13EIG1:', 'ip': '10.54.160.234', 'iocport': 29200}
-eiger1M_params  = {'prefix': '13EIG2:', 'ip';: '10.54.160.13', 'iocport': 27940}
+eiger1M_params  = {'prefix': '13EIG2:', 'ip': '10.54.160.13', 'iocport': 27940}
 
 def use_herfd_detector():
     _scandb.set_info('xrd_detector_prefix', '13EIG1:')
@@ -71,7 +72,7 @@ def set_ponifile(filename):
     root = _scandb.get_info('server_fileroot')
     workdir = _scandb.get_info('user_folder')
 
-    fname = Path(root, workdir, filename).
+    fname = Path(root, workdir, filename)
     if fname.exists():
         calib = read_poni(fname.as_posix())
     else:
@@ -81,9 +82,65 @@ def set_ponifile(filename):
     calname = fname.stem
     _scandb.set_detectorconfig(calname, json.dumps(calib))
     _scandb.set_info('xrd_calibration', calname)
+    _scandb.set_info('xrd_ponifile', filename)
     print(f"Will use calibration from PONI File {fname}")
 
-def save_xrd(name, t=10, ext=None, prefix=None, timeout=60.0):
+def set_maskfile(filename=None):
+    """set detector mask file (TIFF or .npy, nonzero for pixels to
+    ignore) for autointegration, relative to working directory.
+    None for no mask file: gap and dead pixels are always masked.
+    """
+    if filename is not None and not user_datafile(filename).exists():
+        print("Could not find mask file ", filename)
+        return
+    _scandb.set_info('xrd_maskfile', '' if filename is None else filename)
+
+##
+## Live integration: with live integration enabled, each saved XRD frame
+## is added to the queue file 'XRD_Integrate.jsonl' in the user folder,
+## which is read by the integration service (daemons/run_integrator.py)
+
+INTEGRATE_QUEUE = 'XRD_Integrate.jsonl'
+
+def enable_xrd_integration(enable=True):
+    """enable or disable queueing of saved XRD frames for
+    the live integration service (daemons/run_integrator.py)"""
+    _scandb.set_info('xrd_live_integrate', 1 if enable else 0)
+
+def disable_xrd_integration():
+    enable_xrd_integration(False)
+
+def queue_xrd_integration(filename, mapname=None, index=0, shape=None,
+                          t=None, prefix=None):
+    """
+    queue a saved XRD frame for live integration
+
+    Parameters:
+        filename (string): full name of the saved frame
+        mapname (string or None): name of map the frame belongs to
+            [None, the frame is integrated on its own]
+        index (int): point number within the map [0]
+        shape (tuple or None): (ny, nx) of map [None, (1, 1)]
+        t (float or None): exposure time, to find the matching dark
+            frame (see xrd_dark_for) [None, no dark subtraction]
+        prefix (string):   PV prefix for areaDetector camera [default camera]
+    """
+    if filename is None or int(_scandb.get_info('xrd_live_integrate', 0)) == 0:
+        return
+    if shape is None:
+        shape = (1, 1)
+    dark = None
+    if t is not None:
+        dark = xrd_dark_for(t, prefix=prefix)
+    job = {'file': filename, 'map': mapname, 'index': int(index),
+           'shape': [int(s) for s in shape],
+           'poni': _scandb.get_info('xrd_ponifile', None),
+           'mask': _scandb.get_info('xrd_maskfile', None) or None,
+           'dark': dark, 'time': time()}
+    with open(user_datafile(INTEGRATE_QUEUE), 'a') as fh:
+        fh.write(json.dumps(job) + '\n')
+
+def save_xrd(name, t=10, ext=None, prefix=None, timeout=60.0, stream=False):
     """
     Save XRD image from XRD camera.
 
@@ -95,27 +152,390 @@ def save_xrd(name, t=10, ext=None, prefix=None, timeout=60.0):
         prefix (string):   PV prefix for areaDetector camera [default camera]
         timeout (float): maximumn time in seconds to wait
             for image to be saved [60]
+        stream (True or False): sum frames from the running live stream
+            when possible, see `save_xrd_stream` [False]
+
+    Returns:
+        full name of the saved file, as reported by the detector
 
     Examples:
         save_xrd('CeO2', t=20)
 
     Note:
-        calls one of `save_xrd_marccd` or `save_xrd_pe`
+        for several images in a row, use `xrd_session_begin`,
+        `xrd_session_frame`, and `xrd_session_end`, so that the
+        detector is set up and returned to live mode only once.
 
     See Also:
-       `save_xrd_marccd`, `save_xrd_pe`
+       `save_xrd_eiger`, `save_xrd_pil`, `xrd_session_begin`
 
     """
+    if stream:
+        fname = save_xrd_stream(name, t=t, ext=ext, prefix=prefix, timeout=timeout)
+        if fname is not None:
+            return fname
+    #endif
+    session = xrd_session_begin(prefix=prefix)
+    if session is None:
+        return None
+    try:
+        return xrd_session_frame(session, name, t=t, ext=ext, timeout=timeout)
+    finally:
+        xrd_session_end(session)
+
+async def save_xrd_async(name, t=10, ext=None, prefix=None, timeout=60.0):
+    """
+    async version of save_xrd(), so that other async macros run
+    during the exposure
+
+    Examples:
+        run_async(save_xrd_async('CeO2', t=20), move_energy_async(18000, wait=False))
+    """
+    session = await adb(xrd_session_begin, prefix=prefix)
+    if session is None:
+        return None
+    try:
+        return await xrd_session_frame_async(session, name, t=t, ext=ext,
+                                             timeout=timeout)
+    finally:
+        await acall(xrd_session_end, session)
+
+
+##
+## areaDetector configuration: each save_xrd_* function describes the
+## state it needs as a list of (PV suffix, value), and ad_configure()
+## writes only the PVs whose readbacks differ, then waits for those
+## readbacks instead of sleeping for a fixed time.
+
+AD_CONFIRM_TIMEOUT = 5.0
+_AD_NO_RBV = set()     # PVs found to have no _RBV, so not to wait for again
+
+# AcquireTime before AcquirePeriod: the driver raises the period to
+# match a longer exposure, so the period must be set last
+EIGER_LIVE = [('TIFF1:EnableCallbacks', 0),
+              ('cam1:FWEnable', 0),
+              ('cam1:NumImages', 64000),
+              ('cam1:AcquireTime', 0.25),
+              ('cam1:AcquirePeriod', 0.25)]
+
+def _ad_matches(current, value):
+    "--private-- whether a current PV value matches a desired value"
+    if current is None:
+        return False
+    if isinstance(value, str):
+        return current == value
+    try:
+        return abs(float(current) - float(value)) <= 1.e-6*max(1.0, abs(float(value)))
+    except (TypeError, ValueError):
+        return False
+#enddef
+
+def ad_configure(prefix, settings, timeout=AD_CONFIRM_TIMEOUT):
+    """
+    put areaDetector PVs to a desired state, writing only those that differ
+
+    Parameters:
+        prefix (string): detector PV prefix, such as '13EIG2:'
+        settings (list of (suffix, value)): PV suffixes and desired values,
+            such as ('cam1:NumImages', 1), written in the order given
+        timeout (float): maximum time in seconds to wait for
+            readbacks to confirm the new values [5]
+
+    Returns:
+        list of PV suffixes that were written
+
+    Note:
+        the current value is read from the _RBV PV where there is one,
+        as the setpoint may not have been accepted (or may have been
+        changed by the driver).  PVs without a readback are compared
+        by their setpoint.
+    """
+    written, pending = [], []
+    for suffix, value in settings:
+        rbv = None
+        if prefix+suffix not in _AD_NO_RBV:
+            rbv = get_pv(prefix+suffix+'_RBV')
+            if not rbv.wait_for_connection(timeout=0.5):
+                _AD_NO_RBV.add(prefix+suffix)
+                rbv = None
+        pv = rbv if rbv is not None else get_pv(prefix+suffix)
+        current = pv.get(as_string=isinstance(value, str))
+        if not _ad_matches(current, value):
+            caput(prefix+suffix, value, wait=True)
+            written.append((suffix, value))
+            if rbv is not None:
+                pending.append((rbv, value))
+    #endfor
+    t0 = clock()
+    while len(pending) > 0 and clock()-t0 < timeout:
+        pending = [(rbv, value) for rbv, value in pending if not
+                   _ad_matches(rbv.get(as_string=isinstance(value, str)), value)]
+        if len(pending) > 0:
+            sleep(0.02)
+    #endwhile
+    for rbv, value in pending:
+        print(f"Warning: {rbv.pvname} did not reach {value}")
+    return [suffix for suffix, value in written]
+#enddef
+
+def _ad_stop(prefix, timeout=AD_CONFIRM_TIMEOUT):
+    "--private-- stop acquisition and wait for the detector to be idle"
+    caput(prefix+'cam1:Acquire', 0, wait=True)
+    t0 = clock()
+    while (caget(prefix+'cam1:DetectorState_RBV') not in (0, None) and
+           clock()-t0 < timeout):
+        sleep(0.02)
+#enddef
+
+def _ad_acquire(prefix, t, timeout=60.0):
+    "--private-- start acquisition and wait for it to finish"
+    t0 = clock()
+    caput(prefix+'cam1:Acquire', 1)
+    sleep(0.8*t)
+    while ((1 == caget(prefix+'cam1:Acquire')) and
+            (clock()-t0 < timeout)):
+        sleep(0.05)
+    return clock()-t0
+#enddef
+
+def _ad_write_tiff(prefix, timeout=AD_CONFIRM_TIMEOUT):
+    "--private-- write the last image with the TIFF plugin, return its file name"
+    caput(prefix+'TIFF1:WriteFile', 1, wait=True, timeout=timeout)
+    return caget(prefix+'TIFF1:FullFileName_RBV',  as_string=True)
+#enddef
+
+def _tiff_settings(name, ext=None, autoincrement=None, autosave=False):
+    """--private-- TIFF plugin settings for saving one file.
+    autoincrement defaults to whether ext is None"""
+    if autoincrement is None:
+        autoincrement = ext is None
+    settings = [('TIFF1:AutoSave', int(autosave)), ('TIFF1:FileName', name)]
+    if ext is not None:
+        settings.append(('TIFF1:FileNumber', ext))
+    settings.extend([('TIFF1:AutoIncrement', int(autoincrement)),
+                     ('TIFF1:EnableCallbacks', 1)])
+    return settings
+#enddef
+
+##
+## Dark frames: the background frames taken by xrd_bgr are recorded with
+## the camera, exposure time, and detector temperature they were taken
+## at.  Each frame queued for live integration names the recorded dark
+## that matches it, which the integration service subtracts.
+
+XRD_DARKS_INFO = 'xrd_dark_frames'
+XRD_BGR_TEMP_TOL = 1.0      # detector temperature change (C) needing new background
+
+def _xrd_darks():
+    "--private-- recorded dark frames, as a list of dicts"
+    try:
+        darks = json.loads(_scandb.get_info(XRD_DARKS_INFO, '[]'))
+    except (TypeError, ValueError):
+        darks = []
+    return darks if isinstance(darks, list) else []
+#enddef
+
+def xrd_dark_for(t, prefix=None, temp_tol=XRD_BGR_TEMP_TOL):
+    """
+    recorded dark frame for exposure time t at the current
+    detector temperature
+
+    Returns:
+        full name of the dark frame, or None if there is none
+        for this camera, exposure time, and temperature.
+    """
+    if prefix is None:
+        prefix = _scandb.get_info('xrd_detector_prefix')
+    temp = caget(prefix+'cam1:TemperatureActual')
+    for dark in _xrd_darks():
+        if dark.get('prefix', None) != prefix or abs(dark.get('t', -1) - t) > 1.e-3:
+            continue
+        if (temp is not None and dark.get('temp', None) is not None and
+            abs(temp - dark['temp']) > temp_tol):
+            continue
+        return dark.get('file', None)
+    #endfor
+    return None
+#enddef
+
+def xrd_background_needed(t, prefix=None, temp_tol=XRD_BGR_TEMP_TOL):
+    """
+    whether a new XRD background is needed for exposure time t:
+    True if no background has been recorded for the camera and
+    exposure time, or the detector temperature has changed since
+    """
+    return xrd_dark_for(t, prefix=prefix, temp_tol=temp_tol) is None
+#enddef
+
+def xrd_background_taken(t, prefix=None, filename=None):
+    """
+    record the most recent XRD background as the dark frame for
+    exposure time t at the current detector temperature
+
+    Parameters:
+        t (float): exposure time of the background
+        prefix (string):   PV prefix for areaDetector camera [default camera]
+        filename (string or None): full name of the background frame
+            [None, the last file written by the camera's TIFF plugin]
+    """
     if prefix is None:
         prefix = _scandb.get_info('xrd_detector_prefix')
+    if filename is None:
+        filename = caget(prefix+'TIFF1:FullFileName_RBV', as_string=True)
+    darks = [d for d in _xrd_darks() if d.get('prefix', None) != prefix or
+             abs(d.get('t', -1) - t) > 1.e-3]
+    darks.insert(0, {'prefix': prefix, 't': t, 'time': time(), 'file': filename,
+                     'temp': caget(prefix+'cam1:TemperatureActual')})
+    _scandb.set_info(XRD_DARKS_INFO, json.dumps(darks))
+#enddef
+
+def xrd_session_begin(prefix=None, kind=None):
+    """
+    set up the XRD camera for capturing a series of images
+
+    Parameters:
+        prefix (string):   PV prefix for areaDetector camera [default camera]
+        kind (string or None): 'eiger' or 'pil' [None, from prefix]
+
+    Returns:
+        session dictionary to pass to xrd_session_frame() and
+        xrd_session_end(), or None if the camera cannot be identified.
 
-    if 'pil' in prefix.lower():
-        save_xrd_pil(name, t=t, ext=ext, prefix=prefix)
-    elif 'eig' in prefix.lower():
-        save_xrd_eiger(name, t=t, ext=ext, prefix=prefix)
+    Example:
+        session = xrd_session_begin()
+        try:
+            for i in range(5):
+                xrd_session_frame(session, 'MySample', t=5, ext=i+1)
+        finally:
+            xrd_session_end(session)
+
+    Note:
+        always call xrd_session_end(), even on errors, so that
+        the camera is returned to live mode.
+    """
+    if prefix is None:
+        prefix = _scandb.get_info('xrd_detector_prefix')
+    if kind is None:
+        if 'pil' in prefix.lower():
+            kind = 'pil'
+        elif 'eig' in prefix.lower():
+            kind = 'eiger'
+        else:
+            print("cannot identify XRD camera ", prefix)
+            return None
+    #endif
+    session = {'prefix': prefix, 'kind': kind, 'nframes': 0,
+               'shutter_mode': None}
+    if kind == 'pil':
+        # save shutter mode, disable shutter for now
+        session['shutter_mode'] = caget(prefix+'cam1:ShutterMode')
+        _ad_stop(prefix)
+        ad_configure(prefix, [('cam1:ShutterMode', 0), ('cam1:TriggerMode', 0),
+                              ('cam1:NumImages', 1)])
     else:
-        print("cannot identify XRD camera ", prefix)
+        _ad_stop(prefix)
+        ad_configure(prefix, [('cam1:FWEnable', 1), ('cam1:SaveFiles', 0),
+                              ('cam1:ManualTrigger', 0), ('cam1:NumTriggers', 1),
+                              ('cam1:TriggerMode', 0), ('cam1:NumImages', 1)])
+    return session
+#enddef
+
+def xrd_session_frame(session, name, t=10, ext=None, timeout=60.0,
+                      mapname=None, index=0, shape=None):
+    """
+    capture one image in an XRD camera session
 
+    Parameters:
+        session (dict): from xrd_session_begin()
+        name (string):  name of datafile
+        t (float):   exposure time in seconds [default= 10]
+        ext (int or None): number for file extension
+            if left as None, the extension will be auto-incremented.
+        timeout (float): maximumn time in seconds to wait
+            for image to be saved [60]
+        mapname, index, shape: map name, point number, and map shape,
+            for live integration (see queue_xrd_integration) [None, 0, None]
+
+    Returns:
+        full name of the saved file, as reported by the detector
+    """
+    prefix = session['prefix']
+    t0 = clock()
+    _session_configure(session, name, t=t, ext=ext)
+    telapsed = _ad_acquire(prefix, t, timeout=timeout)
+    fname = _ad_write_tiff(prefix)
+    return _session_saved(session, fname, t, t0, telapsed, mapname=mapname,
+                          index=index, shape=shape)
+#enddef
+
+async def xrd_session_frame_async(session, name, t=10, ext=None, timeout=60.0,
+                                  mapname=None, index=0, shape=None):
+    """
+    async version of xrd_session_frame(): other async macros
+    run while the image is being exposed
+    """
+    prefix = session['prefix']
+    t0 = clock()
+    await acall(_session_configure, session, name, t=t, ext=ext)
+    await aput(prefix+'cam1:Acquire', 1, wait=False)
+    await asyncio.sleep(0.8*t)
+    await await_pv(prefix+'cam1:Acquire', lambda v: v != 1,
+                   timeout=max(0.01, timeout-(clock()-t0)))
+    telapsed = clock()-t0
+    fname = None
+    if await aput(prefix+'TIFF1:WriteFile', 1, wait=True, timeout=AD_CONFIRM_TIMEOUT):
+        fname = await aget(prefix+'TIFF1:FullFileName_RBV', as_string=True)
+    return await adb(_session_saved, session, fname, t, t0, telapsed,
+                       mapname=mapname, index=index, shape=shape)
+#enddef
+
+def _session_configure(session, name, t=10, ext=None):
+    "--private-- set file name and exposure for the next frame of a session"
+    if session['kind'] == 'pil':
+        settings = _tiff_settings(name, ext=ext, autoincrement=True)
+        settings.append(('cam1:AcquireTime', t))
+    else:
+        # AcquireTime before AcquirePeriod, as for EIGER_LIVE
+        settings = _tiff_settings(name, ext=ext)
+        settings.extend([('cam1:AcquireTime', t), ('cam1:AcquirePeriod', t)])
+    ad_configure(session['prefix'], settings)
+    print(f'Save XRD image ({t:.1f} seconds)')
+#enddef
+
+def _session_saved(session, fname, t, t0, telapsed, mapname=None, index=0,
+                   shape=None):
+    "--private-- record timing, catalog and integration for a saved frame"
+    print(f'Acquire Done, wrote file {fname}, {telapsed:.2f} seconds')
+    session['nframes'] += 1
+
+    nbytes = None
+    if fname is not None and Path(fname).exists():
+        nbytes = Path(fname).stat().st_size
+    record_timing('xrd_overhead', clock()-t0-t, nbytes)
+    catalog_add(fname, macro='save_xrd', map=mapname,
+                map_index=None if mapname is None else index,
+                tstart=time()-(clock()-t0), tend=time(), nbytes=nbytes)
+    queue_xrd_integration(fname, mapname=mapname, index=index, shape=shape,
+                          t=t, prefix=session['prefix'])
+    return fname
+#enddef
+
+def xrd_session_end(session):
+    """
+    end an XRD camera session, returning the camera to live mode
+    """
+    prefix = session['prefix']
+    settings = [('TIFF1:EnableCallbacks', 0)]
+    if session['kind'] == 'pil':
+        if session['shutter_mode'] is not None:
+            settings.append(('cam1:ShutterMode', session['shutter_mode']))
+        ad_configure(prefix, settings)
+    else:
+        _ad_stop(prefix)
+        ad_configure(prefix, EIGER_LIVE)
+        caput(prefix+'cam1:Acquire', 1)
+    #endif
+#enddef
 
 def save_xrd_eiger(name, t=10, ext=None, prefix=None, timeout=60.0):
     """
@@ -134,58 +554,11 @@ def save_xrd_eiger(name, t=10, ext=None, prefix=None, timeout=60.0):
         save_xrd_eiger('CeO2', t=20)
 
     """
-    if prefix is None:
-        prefix = _scandb.get_info('xrd_detector_prefix')
-
-    x = caput(prefix+'cam1:Acquire', 0, wait=True)
-    sleep(0.5)
-
-    x = caput(prefix+'cam1:FWEnable', 1)
-    x = caput(prefix+'cam1:SaveFiles', 0)
-    x = caput(prefix+'cam1:ManualTrigger', 0)
-    x = caput(prefix+'cam1:NumTriggers', 1)
-    x = caput(prefix+'TIFF1:EnableCallbacks', 0)
-    x = caput(prefix+'TIFF1:AutoSave',        0)
-    x = caput(prefix+'TIFF1:FileName',     name)
-    if ext is not None:
-        x = caput(prefix+'TIFF1:FileNumber',    ext)
-        x = caput(prefix+'TIFF1:AutoIncrement',   0)
-    else:
-        x = caput(prefix+'TIFF1:AutoIncrement',   1)
-
-    x = caput(prefix+'TIFF1:EnableCallbacks', 1)
-    x = caput(prefix+'cam1:TriggerMode', 0)
-
-    print(f'Save tiff from Eiger ({t:.1f} seconds)')
-    sleep(0.5)
-    x = caput(prefix+'cam1:NumImages', 1)
-    x = caput(prefix+'cam1:AcquirePeriod', t)
-    x = caput(prefix+'cam1:AcquireTime', t)
-
-    sleep(0.5)
-    t0 = clock()
-    caput(prefix+'cam1:Acquire', 1)
-    sleep(1.0 +  t/3.0)
-    while ((1 == caget(prefix+'cam1:Acquire')) and
-            (clock()-t0 < timeout)):
-         sleep(0.25)
-
-    sleep(0.25)
-
-    # clean up, returning to short dwell time
-    caput(prefix+'TIFF1:WriteFile',       1)
-    caput(prefix+'TIFF1:EnableCallbacks', 0)
-    sleep(0.25)
-    name = caget(prefix+'TIFF1:FullFileName_RBV',  as_string=True)
-    print(f'Acquire Done, wrote file {name}, {(clock()-t0):.2f} seconds')
-
-    x = caput(prefix+'cam1:FWEnable', 0)
-    caput(prefix+'cam1:Acquire', 0)
-    caput(prefix+'cam1:NumImages', 64000)
-    caput(prefix+'cam1:AcquirePeriod', 0.25)
-    caput(prefix+'cam1:AcquireTime', 0.25)
-    caput(prefix+'cam1:AcquirePeriod', 0.25)
-    caput(prefix+'cam1:Acquire', 1)
+    session = xrd_session_begin(prefix=prefix, kind='eiger')
+    try:
+        return xrd_session_frame(session, name, t=t, ext=ext, timeout=timeout)
+    finally:
+        xrd_session_end(session)
 
 
 def save_xrd_pil(name, t=10, ext=None, prefix=None, timeout=60.0):
@@ -205,47 +578,96 @@ def save_xrd_pil(name, t=10, ext=None, prefix=None, timeout=60.0):
         save_xrd_pil('CeO2', t=20)
 
     """
-    if prefix is None:
-        prefix = _scandb.get_info('xrd_detector_prefix')
+    session = xrd_session_begin(prefix=prefix, kind='pil')
+    try:
+        return xrd_session_frame(session, name, t=t, ext=ext, timeout=timeout)
+    finally:
+        xrd_session_end(session)
 
-    print(" SAVE XRD  prefix ", prefix)
-    # save shutter mode, disable shutter for now
-    shutter_mode = caget(prefix+'cam1:ShutterMode')
-    caput(prefix+'cam1:ShutterMode', 0)
-    caput(prefix+'cam1:Acquire', 0)
-    sleep(0.1)
-    print("Save XRD...")
-    caput(prefix+'TIFF1:EnableCallbacks', 0)
-    caput(prefix+'TIFF1:AutoSave',        0)
-    caput(prefix+'TIFF1:AutoIncrement',   1)
-    caput(prefix+'TIFF1:FileName',     name)
-    if ext is not None:
-        caput(prefix+'TIFF1:FileNumber',    ext)
-
-    caput(prefix+'TIFF1:EnableCallbacks', 1)
+def save_xrd_stream(name, t=10, ext=None, prefix=None, timeout=60.0):
+    """
+    Save XRD image by summing frames from the running live stream.
 
-    caput(prefix+'cam1:TriggerMode', 0)
+    The camera is left acquiring in live mode: the PROC1 plugin sums the
+    next N frames (N = t / live frame period) and passes only the sum to
+    the TIFF plugin, so there is no stop / arm / restart of the camera.
 
-    sleep(0.25)
+    Parameters:
+        name (string):  name of datafile
+        t (float):   exposure time in seconds, a multiple of
+            the live frame period [default= 10]
+        ext (int or None): number for file extension
+            if left as None, the extension will be auto-incremented.
+        prefix (string):   PV prefix for areaDetector camera [default camera]
+        timeout (float): maximumn time in seconds to wait
+            for image to be saved [60]
 
-    caput(prefix+'cam1:NumImages', 1)
-    caput(prefix+'cam1:AcquireTime', t)
+    Returns:
+        full name of the saved file, or None if the camera is not
+        streaming or t is not a multiple of the frame period.
 
-    # expose
-    caput(prefix+'cam1:Acquire', 1)
+    Examples:
+        save_xrd_stream('CeO2', t=20)
+    """
+    if prefix is None:
+        prefix = _scandb.get_info('xrd_detector_prefix')
+    period = caget(prefix+'cam1:AcquirePeriod_RBV')
+    if caget(prefix+'cam1:Acquire') != 1 or period is None or period <= 0:
+        print("XRD camera is not streaming")
+        return None
+    nframes = int(round(t/period))
+    if nframes < 1 or abs(nframes*period - t) > 0.01*t:
+        print(f"exposure {t:.3f} s is not a multiple of frame period {period:.3f} s")
+        return None
+    #endif
     t0 = clock()
-    print('Wait for Acquire ... ')
-
-    while ((1 == caget(prefix+'cam1:Acquire')) and
-            (clock()-t0 < timeout)):
-        sleep(0.25)
-    print(f'Acquire Done, writing file {name}')
-    sleep(0.1)
-
-    # clean up, returning to short dwell time
-    caput(prefix+'TIFF1:WriteFile',       1)
-    caput(prefix+'TIFF1:EnableCallbacks', 0)
-    sleep(0.5)
+    camport = caget(prefix+'cam1:PortName_RBV', as_string=True)
+    tiffport = caget(prefix+'TIFF1:NDArrayPort', as_string=True)
+    proc_settings = [('PROC1:NDArrayPort', camport),
+                     ('PROC1:EnableFilter', 1),
+                     ('PROC1:FilterType', 'Sum'),
+                     ('PROC1:NumFilter', nframes),
+                     ('PROC1:AutoResetFilter', 0),
+                     ('PROC1:FilterCallbacks', 1),
+                     ('PROC1:EnableCallbacks', 1)]
+    # PROC1 may be in use, as for live viewing: restore it when done
+    proc_saved = [(suffix, get_pv(prefix+suffix).get(as_string=isinstance(value, str)))
+                  for suffix, value in proc_settings]
+    proc_saved = [(suffix, value) for suffix, value in proc_saved if value is not None]
+    fname = None
+    try:
+        ad_configure(prefix, proc_settings + [('TIFF1:EnableCallbacks', 0),
+                                              ('TIFF1:NDArrayPort', 'PROC1')])
+        ad_configure(prefix, _tiff_settings(name, ext=ext, autosave=True))
+
+        print(f'Save tiff from stream ({nframes} frames, {t:.1f} seconds)')
+        count = caget(prefix+'TIFF1:ArrayCounter_RBV')
+        caput(prefix+'PROC1:ResetFilter', 1)
+        sleep(0.8*t)
+        while (caget(prefix+'TIFF1:ArrayCounter_RBV') == count and
+               clock()-t0 < timeout):
+            if check_scan_abort():
+                break
+            sleep(0.05)
+        if caget(prefix+'TIFF1:ArrayCounter_RBV') != count:
+            fname = caget(prefix+'TIFF1:FullFileName_RBV', as_string=True)
+    finally:
+        ad_configure(prefix, [('TIFF1:EnableCallbacks', 0),
+                              ('TIFF1:AutoSave', 0),
+                              ('TIFF1:NDArrayPort', tiffport)])
+        # restore PROC1 with its callbacks off, enabling them last
+        callbacks = dict(proc_saved).get('PROC1:EnableCallbacks', 0)
+        ad_configure(prefix, [('PROC1:EnableCallbacks', 0)] +
+                     [(suffix, value) for suffix, value in proc_saved
+                      if suffix != 'PROC1:EnableCallbacks'] +
+                     [('PROC1:EnableCallbacks', callbacks)])
+    #endtry
+    print(f'Acquire Done, wrote file {fname}, {(clock()-t0):.2f} seconds')
+    if fname is not None:
+        record_timing('xrd_stream_overhead', clock()-t0-t, None)
+        queue_xrd_integration(fname, t=t, prefix=prefix)
+    return fname
+#enddef
 
 def xrd_at(posname,  t=10):
     move_samplestage(posname, wait=True)
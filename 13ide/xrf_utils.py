@@ -1,4 +1,10 @@
 ## XRF commands
+import numpy as np
+from time import monotonic as clock
+
+XRF_PREFIX = '13QX7:'
+XRF_NMCA = 7
+
 def expose(t=60):
     open_shutter()
     t0 = time.time()
@@ -7,3 +13,130 @@ def expose(t=60):
         sleep(1)
     print("Done exposed for %.3f sec" % (time.time()-t0))
     close_shutter()
+
+def _line_xrf_fly(plan, t, filename, trigger='internal', prefix=None, nmca=XRF_NMCA):
+    """
+    collect XRF spectra while moving one motor continuously along a line plan.
+    expected to be used internally, by line_xrf(..., fly=True).
+
+    Parameters:
+        plan (dict): line scan plan, from line_path()
+        t (float): dwelltime per point, in seconds
+        filename (string): name of output file, in the user folder
+        trigger (string): 'internal' for timed frames, 'external' for frames
+             from hardware trigger pulses ['internal']
+        prefix (string or None): PV prefix for Xspress3 [xrf_detector_prefix]
+        nmca (int): number of MCA channels to save [7]
+
+    Returns:
+        number of frames collected
+
+    Note:
+        The motor moves at constant velocity (step/t), starting and ending
+        outside the line so that it is at speed for the first and last frames.
+        Spectra (npts, nmca, nchan), measured and nominal positions, and a
+        mask of collected frames are written to a single .npz file.
+        Every frame is taken from the MCA monitor updates, in order, so
+        that no frame is lost when several end between two polls; the
+        position of each frame is read when its counter update arrives.
+    """
+    if prefix is None:
+        prefix = _scandb.get_info('xrf_detector_prefix', XRF_PREFIX)
+    det = prefix + 'det1:'
+    motorpv = plan['pvnames'][0]
+    mprefix = motorpv.split('.')[0]
+    nominal = plan['points'][:, 0]
+    npts = len(nominal)
+    if npts < 2:
+        print("Error: fly scans need at least 2 points")
+        return 0
+    step = abs(nominal[1] - nominal[0])
+    sign = 1.0 if nominal[-1] >= nominal[0] else -1.0
+
+    velo_save = caget(mprefix + '.VELO')
+    vmax = caget(mprefix + '.VMAX')
+    accl = caget(mprefix + '.ACCL')
+    velo = step/t
+    if vmax is not None and vmax > 0 and velo > vmax:
+        print("Error: fly velocity %.4f too fast for motor (VMAX=%.4f)" % (velo, vmax))
+        return 0
+    #endif
+    # frames are centered on points, after ramping up to speed
+    ramp = sign*(velo*accl + 0.5*step)
+
+    caput(det + 'Acquire', 0, wait=True)
+    caput(det + 'ERASE', 1)
+    caput(det + 'TriggerMode', 'TTL Veto Only' if trigger == 'external' else 'Internal')
+    caput(det + 'AcquireTime', t)
+    caput(det + 'NumImages', npts)
+    caput(det + 'ArrayCounter', 0, wait=True)
+
+    counter = get_pv(det + 'ArrayCounter_RBV')
+    mcas = [get_pv(prefix + 'MCA%d:ArrayData' % (i+1)) for i in range(nmca)]
+    rbv = get_pv(mprefix + '.RBV')
+
+    caput(motorpv, nominal[0] - ramp, wait=True)
+    caput(mprefix + '.VELO', velo, wait=True)
+
+    # frames as they arrive: readback at each new count, and each MCA update
+    frames = {'on': False, 'pos': [], 'mca': [[] for mca in mcas]}
+    def onCounter(value=None, **kws):
+        if frames['on'] and value is not None and value > len(frames['pos']):
+            pos = rbv.get()
+            frames['pos'].extend([pos]*(min(value, npts) - len(frames['pos'])))
+    #enddef
+    def onMCA(value=None, mca_index=0, **kws):
+        if (frames['on'] and value is not None and
+            len(frames['mca'][mca_index]) < npts):
+            frames['mca'][mca_index].append(np.array(value))
+    #enddef
+    callbacks = [(counter, counter.add_callback(onCounter))]
+    for i, mca in enumerate(mcas):
+        callbacks.append((mca, mca.add_callback(onMCA, mca_index=i)))
+
+    aborted = False
+    print("#fly line_xrf: %d points, velocity %.4f" % (npts, velo))
+    try:
+        caput(motorpv, nominal[-1] + ramp)
+        sleep(accl)
+        frames['on'] = True
+        caput(det + 'Acquire', 1)
+        t0 = clock()
+        timeout = 2.0*npts*t + 30.0
+        while (min([len(m) for m in frames['mca']]) < npts and
+               clock()-t0 < timeout):
+            if check_scan_abort():
+                aborted = True
+                break
+            sleep(min(0.01, 0.1*t))
+        #endwhile
+    finally:
+        for pv, cb_index in callbacks:
+            pv.remove_callback(cb_index)
+        caput(det + 'Acquire', 0)
+        if aborted:
+            caput(mprefix + '.STOP', 1)
+        caput(mprefix + '.VELO', velo_save, wait=True)
+    #endtry
+    nframes = min([len(m) for m in frames['mca']])
+    if nframes < 1:
+        print("Error: no XRF frames collected")
+        return 0
+    spectra = np.zeros((npts, nmca, len(frames['mca'][0][0])),
+                       dtype=frames['mca'][0][0].dtype)
+    for i, mcaframes in enumerate(frames['mca']):
+        spectra[:nframes, i] = np.array(mcaframes[:nframes])
+    # each frame ended half a step before the position read at its count
+    positions = nominal.copy()
+    npos = min(nframes, len(frames['pos']))
+    positions[:npos] = np.array(frames['pos'][:npos]) - sign*0.5*step
+    valid = np.zeros(npts, dtype=bool)
+    valid[:nframes] = True
+    nmissed = npts - valid.sum()
+    if nmissed > 0:
+        print("#fly line_xrf: %d frames missed" % nmissed)
+    np.savez(user_datafile(filename), spectra=spectra, positions=positions,
+             nominal=nominal, valid=valid, dwelltime=t, motor=motorpv)
+    print("#fly line_xrf: wrote %s (%d frames)" % (filename, valid.sum()))
+    return int(valid.sum())
+#enddef
@@ -0,0 +1,159 @@
+"""
+Test support for the 13ide macros.
+
+The scan server execs every macro file into one shared namespace, which
+already holds _scandb, _instdb and the server functions (do_scan, ...).
+The `macros` fixture does the same for a list of macro files, with a
+dict-backed ScanDB and a user folder in a temporary directory.  EPICS
+access (caget, caput, get_pv) goes to FakeEpics, whose PVs tests set.
+"""
+import sys
+from pathlib import Path
+import pytest
+
+MACRO_DIR = Path(__file__).resolve().parents[1] / '13ide'
+DAEMON_DIR = MACRO_DIR / 'daemons'
+
+class FakeScanDB:
+    """ScanDB info table and scan definitions, kept in dicts"""
+    def __init__(self, info=None):
+        self.info = dict(info or {})
+        self.scandefs = {}
+        self.commands = []
+        self.abort = False
+
+    def get_info(self, key, default=None, as_int=False, as_bool=False, **kws):
+        val = self.info.get(key, default)
+        if as_bool:
+            return val not in (None, 0, '0', 'False', 'false', '')
+        if as_int and val is not None:
+            return int(val)
+        return val
+
+    def set_info(self, key, value, **kws):
+        self.info[key] = value
+
+    def get_scandef(self, name):
+        text = self.scandefs.get(name, None)
+        if text is None:
+            return None
+        return type('ScanDef', (), {'name': name, 'text': text})()
+
+    def add_command(self, command, **kws):
+        self.commands.append(command)
+
+    def wait_for_pause(self, timeout=None):
+        pass
+
+    def test_abort(self, msg=None):
+        return self.abort
+
+
+class FakePV:
+    """PV holding a value, with put-complete and callbacks"""
+    def __init__(self, pvname, value=None):
+        self.pvname = pvname
+        self.value = value
+        self.timestamp = 0
+        self.connected = True
+        self.access = 'read/write'
+        self.put_complete = True
+        self.complete_puts = True
+        self.callbacks = {}
+        self.puts = []
+
+    def get(self, as_string=False, **kws):
+        if as_string and self.value is not None:
+            return str(self.value)
+        return self.value
+
+    def put(self, value, wait=False, use_complete=False, callback=None, **kws):
+        self.puts.append(value)
+        self.value = value
+        if use_complete:
+            self.put_complete = self.complete_puts
+        if callback is not None:
+            callback(pvname=self.pvname)
+        return 1
+
+    def wait_for_connection(self, timeout=None):
+        return self.connected
+
+    def add_callback(self, callback, **kws):
+        index = len(self.callbacks) + 1
+        self.callbacks[index] = (callback, kws)
+        return index
+
+    def remove_callback(self, index):
+        self.callbacks.pop(index, None)
+
+    def post(self, value):
+        "set a new value, as a monitor update, running the callbacks"
+        self.value = value
+        self.timestamp += 1
+        for callback, kws in list(self.callbacks.values()):
+            callback(pvname=self.pvname, value=value, char_value=str(value), **kws)
+
+
+class FakeEpics:
+    """caget/caput/get_pv on a table of FakePVs, made on first use"""
+    def __init__(self):
+        self.pvs = {}
+        self.puts = []
+
+    def pv(self, pvname, value=None):
+        if pvname not in self.pvs:
+            self.pvs[pvname] = FakePV(pvname, value)
+        elif value is not None:
+            self.pvs[pvname].value = value
+        return self.pvs[pvname]
+
+    def get_pv(self, pvname, **kws):
+        return self.pv(pvname)
+
+    def caget(self, pvname, as_string=False, **kws):
+        if pvname not in self.pvs:
+            return None
+        return self.pvs[pvname].get(as_string=as_string)
+
+    def caput(self, pvname, value, wait=False, **kws):
+        self.puts.append((pvname, value))
+        self.pv(pvname).put(value, wait=wait)
+        return 1
+
+
+@pytest.fixture
+def epics():
+    return FakeEpics()
+
+@pytest.fixture
+def scandb(tmp_path):
+    (tmp_path / 'user').mkdir()
+    return FakeScanDB({'server_fileroot': str(tmp_path), 'user_folder': 'user'})
+
+@pytest.fixture
+def macros(scandb, epics):
+    """load macro files into one namespace, as the scan server does:
+    macros('common.py', 'settle.py', ...) returns the namespace"""
+    def load(*fnames, **names):
+        ns = {'__name__': 'macros', '_scandb': scandb, '_instdb': None}
+        for fname in fnames:
+            fpath = MACRO_DIR / fname
+            exec(compile(fpath.read_text(), str(fpath), 'exec'), ns)
+        ns.update({'caget': epics.caget, 'caput': epics.caput,
+                   'get_pv': epics.get_pv,
+                   'get_dbinfo': scandb.get_info,
+                   'check_scan_abort': lambda: False,
+                   '_getPV': lambda name: None})
+        ns.update(names)
+        return ns
+    return load
+
+@pytest.fixture
+def daemon_path(monkeypatch):
+    """import path for the daemons, as when run as scripts"""
+    monkeypatch.syspath_prepend(str(MACRO_DIR))
+    monkeypatch.syspath_prepend(str(DAEMON_DIR))
+    yield DAEMON_DIR
+    for name in ('run_integrator', 'xrd_integrate', 'run_analyzer', 'analyzer_geom'):
+        sys.modules.pop(name, None)
@@ -0,0 +1,66 @@
+"""asyncio layer for macros (aio.py)"""
+import asyncio
+import threading
+import time
+import pytest
+
+pytest.importorskip('epics')
+
+@pytest.fixture
+def aio(macros):
+    return macros('aio.py')
+
+def test_run_async(aio):
+    async def wait(t, val):
+        await asyncio.sleep(t)
+        return val
+    assert aio['run_async'](wait(0, 'a')) == 'a'
+    t0 = time.monotonic()
+    assert aio['run_async'](wait(0.2, 1), wait(0.2, 2)) == [1, 2]
+    assert time.monotonic() - t0 < 0.35
+
+    # from a blocking call made inside an async macro
+    async def outer():
+        return await aio['acall'](aio['run_async'], wait(0, 'inner'))
+    assert aio['run_async'](outer()) == 'inner'
+
+def test_adb_calls_run_one_at_a_time(aio):
+    state = {'now': 0, 'most': 0}
+    lock = threading.Lock()
+    def work():
+        with lock:
+            state['now'] += 1
+            state['most'] = max(state['most'], state['now'])
+        time.sleep(0.05)
+        with lock:
+            state['now'] -= 1
+    async def calls(call):
+        await asyncio.gather(*[call(work) for i in range(4)])
+
+    aio['run_async'](calls(aio['adb']))
+    assert state['most'] == 1
+    aio['run_async'](calls(aio['acall']))
+    assert state['most'] > 1
+
+def test_aput(aio, epics):
+    assert aio['run_async'](aio['aput']('13XRM:m1.VAL', 2.0))
+    assert epics.pvs['13XRM:m1.VAL'].puts == [2.0]
+
+    stuck = epics.pv('13XRM:m2.VAL')
+    stuck.put = lambda value, callback=None, **kws: None
+    assert not aio['run_async'](aio['aput']('13XRM:m2.VAL', 1.0, timeout=0.1))
+
+def test_await_pv_and_info(aio, epics, scandb):
+    dmov = epics.pv('13XRM:m1.DMOV', 0)
+    threading.Timer(0.1, dmov.post, args=(1,)).start()
+    threading.Timer(0.1, scandb.set_info, args=('needs_offset', 0)).start()
+    async def waits():
+        return await asyncio.gather(
+            aio['await_pv']('13XRM:m1.DMOV', lambda v: v == 1, timeout=5),
+            aio['await_info']('needs_offset', lambda v: int(v) == 0,
+                              timeout=5, poll=0.02))
+    assert aio['run_async'](waits()) == [1, 0]
+    assert dmov.callbacks == {}
+
+    assert aio['run_async'](aio['await_pv']('13XRM:m1.DMOV', lambda v: v == 0,
+                                            timeout=0.05)) is None
@@ -0,0 +1,52 @@
+"""Rowland-circle analyzer geometry (analyzer_geom.py)"""
+import numpy as np
+import pytest
+
+@pytest.fixture
+def geom(macros):
+    return macros('analyzer_geom.py')
+
+def test_bragg_angles(geom):
+    # Si(440): d/|hkl| = 0.9601 A, so 8 keV is at about 53.8 degrees
+    theta = geom['bragg_theta']([8000.0, 1000.0], xtal='si', hkl=(4, 4, 0))
+    dhkl = 5.4309/np.sqrt(32)
+    assert theta[0] == pytest.approx(np.degrees(np.arcsin(12398.419/(2*dhkl*8000))))
+    assert np.isnan(theta[1])
+
+def test_analyzer_table(geom):
+    energies = np.linspace(6400, 6420, 5)
+    table = geom['analyzer_table'](energies, xtal='ge', hkl=(4, 4, 0),
+                                   diameter=500, det_diameter=1000)
+    theta = table['ana_th']
+    assert np.all(np.diff(theta) < 0)
+    # analyzer on a 500 mm circle, detector on a 1000 mm circle
+    assert np.allclose(table['ana_d'], 500*np.sin(np.radians(theta)))
+    det_x, det_y = geom['detector_position'](theta, diameter=1000)
+    assert np.allclose(table['det_x'], det_x) and np.allclose(table['det_y'], det_y)
+    # one value as an array of one
+    assert geom['analyzer_table'](6400.0)['ana_th'].shape == (1,)
+
+def test_limits_and_trajectory_time(geom):
+    table = geom['analyzer_table']([8000.0, 8010.0, 1000.0])
+    problems = geom['check_limits'](table, {'ana_th': (0, 90), 'ana_d': (900, 1000)})
+    bad = set([(en, motor) for en, motor, val in problems])
+    assert bad == {(1000.0, 'ana_th'), (1000.0, 'ana_d'),
+                   (8000.0, 'ana_d'), (8010.0, 'ana_d')}
+
+    table = {'energy': np.array([1, 2, 3]), 'ana_th': np.array([10., 11., 13.]),
+             'ana_d': np.array([100., 100., 110.])}
+    steps = geom['trajectory_time'](table, {'ana_th': 1.0, 'ana_d': 5.0},
+                                    accels={'ana_th': 0.5}, start={'ana_th': 9.0})
+    assert np.allclose(steps, [1.5, 1.5, 2.5])
+
+def test_plan_emission_uses_diam(geom, epics):
+    for attr, val in (('xtal', 0), ('h', 4), ('k', 4), ('l', 0), ('diam', 500)):
+        epics.pv('13XRM:ANA:' + attr, val)
+    table, problems, steps = geom['plan_emission']([8000.0, 8005.0])
+    theta = table['ana_th']
+    assert np.allclose(table['ana_d'], 500*np.sin(np.radians(theta)))
+    # no limits known: nothing to check
+    assert problems == []
+
+    epics.pvs.pop('13XRM:ANA:diam')
+    assert geom['plan_emission']([8000.0]) is None
@@ -0,0 +1,51 @@
+"""SQLite catalog of data files (catalog.py)"""
+import threading
+import pytest
+
+@pytest.fixture
+def catalog(macros):
+    return macros('common.py', 'catalog.py')
+
+def test_add_and_find(catalog, tmp_path):
+    add, find = catalog['catalog_add'], catalog['catalog_find']
+    add('Fe_A.001', macro='pos_scan', scanname='Fe_XANES', position='A',
+        energy=7112.0, motors={'x': 1.5}, tstart=100.0)
+    add('Fe_B.001', macro='pos_scan', scanname='Fe_XANES', position='B',
+        energy=7112.0, tstart=200.0)
+    add('Mn_A.001', macro='pos_scan', scanname='Mn_XANES', position='A',
+        energy=6539.0, tstart=300.0)
+    add(None, macro='pos_scan')
+    assert (tmp_path / 'user' / 'DataCatalog.db').exists()
+
+    assert [r['filename'] for r in find(position='A')] == ['Fe_A.001', 'Mn_A.001']
+    assert [r['filename'] for r in find(energy_min=7000)] == ['Fe_A.001', 'Fe_B.001']
+    assert [r['filename'] for r in find(after=150, before=250)] == ['Fe_B.001']
+    assert [r['filename'] for r in find(pattern='Mn%')] == ['Mn_A.001']
+    assert find(scanname='Fe_XANES', position='A')[0]['motors'] == {'x': 1.5}
+    assert len(find()) == 3
+    with pytest.raises(ValueError):
+        find(sample='A')
+    with pytest.raises(ValueError):
+        add('x.001', sample='A')
+
+def test_update_keeps_fields(catalog):
+    add, find = catalog['catalog_add'], catalog['catalog_find']
+    add('Map_1.001', macro='grid_scan', tstart=10.0)
+    add('Map_1.001', ckpt_key='abc', ckpt_index=0, nbytes=2048, macro=None)
+    rows = find(pattern='Map%')
+    assert len(rows) == 1
+    assert (rows[0]['macro'], rows[0]['ckpt_key'], rows[0]['nbytes']) == \
+        ('grid_scan', 'abc', 2048)
+
+def test_done_points_from_threads(catalog):
+    def register(i):
+        catalog['catalog_add']('Map_%d.001' % i, ckpt_key='abc', ckpt_index=i)
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    register(9)
+    catalog['catalog_add']('Other.001', ckpt_key='xyz', ckpt_index=0)
+    done = catalog['catalog_done']('abc')
+    assert done == {i: 'Map_%d.001' % i for i in (0, 1, 2, 3, 9)}
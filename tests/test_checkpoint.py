@@ -0,0 +1,66 @@
+"""checkpoint journal and resume (checkpoint.py)"""
+
+MACROS = ('common.py', 'catalog.py', 'map_store.py', 'checkpoint.py', 'estimate.py')
+
+def test_resume_skips_points_with_files(macros, tmp_path):
+    ns = macros(*MACROS)
+    params = {'datafile': 'Map', 't': 1.0}
+    ckpt = ns['checkpoint_begin']('grid_scan', params)
+    for i in range(3):
+        fname = 'Map_%d.001' % (i+1)
+        if i != 1:
+            (tmp_path / 'user' / fname).write_text('data\n')
+        ns['checkpoint_point'](ckpt, i, fname)
+
+    ckpt = ns['checkpoint_begin']('grid_scan', params, resume=True)
+    assert ns['checkpoint_skip'](ckpt, 0)
+    assert not ns['checkpoint_skip'](ckpt, 1)     # file is missing
+    assert ns['checkpoint_skip'](ckpt, 2)
+    assert not ns['checkpoint_skip'](ckpt, 3)
+
+    # other parameters are another run
+    other = ns['checkpoint_begin']('grid_scan', dict(params, t=2.0), resume=True)
+    assert not ns['checkpoint_skip'](other, 0)
+
+def test_resume_queues_unfinished_macro(macros, scandb):
+    ns = macros(*MACROS)
+    done = ns['checkpoint_begin']('fe_map', {'posname': 'A'})
+    ns['checkpoint_end'](done)
+    ns['checkpoint_begin']('grid_xrd', {'datafile': 'B'})
+
+    runs = ns['checkpoint_list']()
+    assert [r[1] for r in runs] == ['grid_xrd']
+    ns['resume']()
+    assert scandb.commands == ["grid_xrd(datafile='B', resume=True)"]
+
+def test_consolidated_points_count_as_done(macros, tmp_path):
+    ns = macros(*MACROS)
+    assert ns['_datafile_exists']('gone.001', consolidated={'gone.001'})
+    assert not ns['_datafile_exists']('gone.001')
+    (tmp_path / 'user' / 'Maps').mkdir()
+    (tmp_path / 'user' / 'Maps' / 'here.001').write_text('')
+    assert ns['_datafile_exists']('here.001')
+
+def test_timed_scan_returns_incremented_name(macros, tmp_path):
+    folder = tmp_path / 'user'
+    (folder / 'Fe_XANES_A.001').write_text('earlier run\n')
+
+    def do_scan(scanname, filename=None, nscans=1):
+        # the scan server increments the extension of an existing file
+        (folder / 'Fe_XANES_A.002').write_text('new run\n')
+
+    ns = macros(*MACROS, do_scan=do_scan)
+    written = ns['timed_scan']('Fe_XANES', filename='Fe_XANES_A.001')
+    assert written == 'Fe_XANES_A.002'
+    rows = ns['catalog_find'](scanname='Fe_XANES')
+    assert [row['filename'] for row in rows] == ['Fe_XANES_A.002']
+    assert rows[0]['nbytes'] == len('new run\n')
+
+def test_timed_scan_without_extension(macros, tmp_path):
+    folder = tmp_path / 'user'
+
+    def do_scan(scanname, filename=None, nscans=1):
+        (folder / (filename + '.001')).write_text('x\n')
+
+    ns = macros(*MACROS, do_scan=do_scan)
+    assert ns['timed_scan']('Map', filename='Map_A_7112.25eV') == 'Map_A_7112.25eV.001'
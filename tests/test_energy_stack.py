@@ -0,0 +1,62 @@
+"""cached mono tilt for energy stacks (energy_stack.py)"""
+import pytest
+
+TILT_PV = '13IDA:E_MonoPiezoPitch.VAL'
+ROLL_PV = '13IDA:E_MonoPiezoRoll.VAL'
+I0_PV = '13IDE:I0_Volts'
+
+@pytest.fixture
+def stack(macros, epics):
+    calls = []
+    def tuner(name, pitch, roll):
+        def tune():
+            calls.append(name)
+            epics.pv(TILT_PV, pitch)
+            epics.pv(ROLL_PV, roll)
+        return tune
+    ns = macros('common.py', 'catalog.py', 'estimate.py', 'energy_stack.py',
+                sleep=lambda t: None,
+                move_energy=lambda en, **kws: calls.append(('move', en)),
+                set_mono_tilt=tuner('full', 3.0, 1.0),
+                fast_mono_tilt=tuner('fast', 3.1, 1.1),
+                mono_tilt_feedback=lambda: (True, False))
+    epics.pv(I0_PV, 2.0)
+    return ns, calls
+
+def test_tune_reuses_cached_tilt(stack, epics):
+    ns, calls = stack
+    assert ns['tune_at_energy'](7112.0) == 'full'
+    assert ns['cached_mono_tilt'](7112.0) == (3.0, 1.0, 2.0)
+
+    epics.pv(TILT_PV, 0.0)
+    assert ns['tune_at_energy'](7112.0) == 'cached'
+    assert epics.caget(TILT_PV) == 3.0
+    assert calls.count('full') == 1
+    assert ('13XRM:roll_pid.FBON', 1) in epics.puts
+    assert ('13XRM:pitch_pid.FBON', 1) not in epics.puts
+
+def test_tune_retunes_when_i0_changed(stack, epics):
+    ns, calls = stack
+    ns['tune_at_energy'](7112.0)
+    epics.pv(I0_PV, 1.0)
+    assert ns['tune_at_energy'](7112.0) == 'fast'
+    assert calls[-1] == 'fast'
+    # the new values are cached
+    assert ns['cached_mono_tilt'](7112.0) == (3.1, 1.1, 1.0)
+
+def test_cache_expires(stack, epics, scandb):
+    ns, calls = stack
+    ns['tune_at_energy'](7112.0)
+    ns['TILT_CACHE_HOURS'] = 0.0
+    assert ns['cached_mono_tilt'](7112.0) is None
+    ns['clear_mono_tilt_cache']()
+    assert scandb.info['mono_tilt_cache'] == '{}'
+
+def test_energy_stack_time(stack):
+    ns, calls = stack
+    ns['record_timing']('move_energy', 2.0)
+    ns['record_timing']('set_mono_tilt', 40.0)
+    # three new energies (one repeated) with full tuning
+    assert ns['energy_stack_time']([7100, 7110, 7100]) == pytest.approx(3*2 + 2*40 + 1)
+    assert ns['energy_stack_time']([7100, 7110], tune='fast') == pytest.approx(2*2 + 2*12)
+    assert ns['energy_stack_time']([7100, 7110], tune=None) == pytest.approx(4)
@@ -0,0 +1,52 @@
+"""time and data-volume estimates (estimate.py)"""
+import json
+import pytest
+
+MACROS = ('common.py', 'catalog.py', 'estimate.py')
+
+def test_nominal_time_from_scan_definitions(macros, scandb):
+    ns = macros(*MACROS)
+    scandb.scandefs['Fe_XANES'] = json.dumps({'type': 'xafs',
+                                              'regions': [[-50, -10, 5, 9, 1.0],
+                                                          [-10, 20, 0.5, 61, 2.0]]})
+    scandb.scandefs['Map'] = json.dumps({'type': 'slew', 'dwelltime': [0.5],
+                                         'inner': ['x', 0, 1, 21],
+                                         'outer': ['y', 0, 1, 11]})
+    assert ns['scan_nominal_time']('Fe_XANES') == pytest.approx(5*9 + 0.5*61)
+    assert ns['scan_nominal_time']('Map') == pytest.approx(0.5*21*11)
+    assert ns['scan_nominal_time']('missing') is None
+
+def test_unreadable_scan_definition_is_skipped(macros, scandb, capsys):
+    ns = macros(*MACROS)
+    scandb.scandefs['Bad'] = '{not json'
+    scandb.scandefs['Odd'] = json.dumps({'type': 'xafs', 'regions': [[1, 2]]})
+    assert ns['scan_nominal_time']('Bad') is None
+    assert ns['scan_nominal_time']('Odd') is None
+    out = capsys.readouterr().out
+    assert "'Bad'" in out and "'Odd'" in out
+
+def test_learned_timing_is_a_running_average(macros):
+    ns = macros(*MACROS)
+    assert ns['learned_timing']('scan:A', default=7.0) == (7.0, None)
+    ns['record_timing']('scan:A', 10.0, nbytes=1000)
+    assert ns['learned_timing']('scan:A') == (10.0, 1000)
+    ns['record_timing']('scan:A', 20.0, nbytes=2000)
+    tval, nval = ns['learned_timing']('scan:A', default=7.0)
+    weight = ns['TIMING_WEIGHT']
+    assert tval == pytest.approx((1-weight)*10 + weight*20)
+    assert nval == pytest.approx((1-weight)*1000 + weight*2000)
+
+def test_motor_move_time(macros, epics):
+    ns = macros(*MACROS)
+    epics.pv('13XRM:m1.VELO', 2.0)
+    epics.pv('13XRM:m1.ACCL', 0.5)
+    # moves of 1, 0 and 3 units: 0.5+0.5 s, nothing, 1.5+0.5 s
+    assert ns['path_move_time']('13XRM:m1.VAL', [0, 1, 1, -2]) == pytest.approx(3.0)
+    assert ns['motor_move_time']('13XRM:m2.VAL', 5.0) == 0.0
+    assert ns['motor_move_time'](None, 5.0) == 0.0
+
+def test_dryrun_report(macros):
+    ns = macros(*MACROS)
+    out = ns['dryrun_report']('grid_scan', 100, 2.0, nbytes=5.e4, move_time=30, extra=10)
+    assert out == {'npts': 100, 'seconds': 240.0, 'nbytes': 5.e6}
+    assert ns['_fmt_seconds'](3725) == '1:02:05'
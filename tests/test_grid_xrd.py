@@ -0,0 +1,57 @@
+"""XRD maps with a detector session (scanning.grid_xrd)"""
+import pytest
+
+MOTORS = {'x': '13XRM:m1.VAL', 'y': '13XRM:m2.VAL'}
+
+@pytest.fixture
+def grid(macros):
+    log = []
+    def session_begin():
+        log.append('begin')
+        return {'n': len([x for x in log if x == 'begin'])}
+    def session_frame(session, fname, **kws):
+        log.append(('frame', session['n'], kws['index']))
+        return fname
+    ns = macros('common.py', 'catalog.py', 'checkpoint.py', 'estimate.py',
+                'scanpaths.py', 'scanning.py', _getPV=MOTORS.get,
+                check_abort_pause=lambda: False,
+                plan_move=lambda plan, i, allmotors=False: None,
+                mapstore_begin=lambda plan, mapname=None: None,
+                mapstore_add=lambda store, i, fname: None,
+                xrd_session_begin=session_begin,
+                xrd_session_frame=session_frame,
+                xrd_session_end=lambda session: log.append(('end', session['n'])),
+                xrd_background_needed=lambda t: False,
+                xrd_bgr=lambda: log.append('bgr'),
+                xrd_background_taken=lambda t: None)
+    return ns, log
+
+ARGS = dict(t=1, xstart=0, xstop=0.1, xstep=0.1, ystart=0, ystop=0.1, ystep=0.1)
+
+def test_one_session(grid):
+    ns, log = grid
+    ns['grid_xrd']('Map', **ARGS)
+    assert log == ['begin', ('frame', 1, 0), ('frame', 1, 1), ('frame', 1, 2),
+                   ('frame', 1, 3), ('end', 1)]
+
+def test_background_per_row(grid):
+    ns, log = grid
+    ns['grid_xrd']('Map', bgr_per_row=True, **ARGS)
+    assert log == ['begin', ('end', 1), 'bgr', 'begin', ('frame', 2, 0), ('frame', 2, 1),
+                   ('end', 2), 'bgr', 'begin', ('frame', 3, 2), ('frame', 3, 3), ('end', 3)]
+
+def test_failed_background_ends_session_once(grid):
+    ns, log = grid
+    def bgr():
+        raise RuntimeError('no shutter')
+    ns['xrd_bgr'] = bgr
+    with pytest.raises(RuntimeError):
+        ns['grid_xrd']('Map', bgr_per_row=True, **ARGS)
+    assert log == ['begin', ('end', 1)]
+
+def test_failed_restart(grid):
+    ns, log = grid
+    begin = ns['xrd_session_begin']
+    ns['xrd_session_begin'] = lambda: begin() if len(log) == 0 else None
+    ns['grid_xrd']('Map', bgr_per_row=True, **ARGS)
+    assert log == ['begin', ('end', 1), 'bgr']
@@ -0,0 +1,32 @@
+"""undulator peak fit for optimize_id (intensity.py)"""
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+@pytest.fixture
+def inten(macros):
+    return macros('analyzer_geom.py', 'intensity.py')
+
+def test_fit_id_peak(inten):
+    rng = np.random.default_rng(3)
+    energies = np.linspace(7050, 7200, 40)
+    i0vals = inten['_gaussian'](energies, 5.0, 7131.3, 12.0, 0.4)
+    i0vals += rng.normal(scale=0.02, size=energies.size)
+    cen, cen_err, sigma = inten['_fit_id_peak'](energies, i0vals)
+    assert cen == pytest.approx(7131.3, abs=0.2) and 0 < cen_err < 0.2
+    assert sigma == pytest.approx(12.0, rel=0.05)
+
+    # refinement with the width held fixed
+    energies = 7131 + 12.0*np.linspace(-1, 1, 5)
+    i0vals = inten['_gaussian'](energies, 5.0, 7132.0, 12.0, 0.4)
+    cen, cen_err, sigma = inten['_fit_id_peak'](energies, i0vals, sigma=12.0)
+    assert cen == pytest.approx(7132.0, abs=1e-3) and sigma == 12.0
+
+@pytest.mark.filterwarnings('ignore::scipy.optimize.OptimizeWarning')
+def test_fit_id_peak_fails(inten):
+    energies = np.linspace(7050, 7200, 20)
+    # peak outside the sweep
+    i0vals = inten['_gaussian'](energies, 5.0, 7400.0, 12.0, 0.4)
+    assert inten['_fit_id_peak'](energies, i0vals) is None
+    assert inten['_fit_id_peak'](energies, np.ones(20)) is None
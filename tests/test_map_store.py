@@ -0,0 +1,62 @@
+"""consolidated HDF5 map files (map_store.py)"""
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+MOTORS = {'x': '13XRM:m1.VAL', 'y': '13XRM:m2.VAL'}
+
+@pytest.fixture
+def store(macros):
+    ns = macros('common.py', 'estimate.py', 'scanpaths.py', 'map_store.py',
+                _getPV=MOTORS.get)
+    plan = ns['grid_path']('x', 'y', xstart=0, xstop=0.1, xstep=0.1,
+                           ystart=0, ystop=1, ystep=1, fileform='Map_y{iy}_x{ix}.001')
+    return ns, plan
+
+def write_point(folder, fname, nrows):
+    data = np.arange(nrows*3).reshape((nrows, 3)) + 100*nrows
+    np.savetxt(folder / fname, data, header='x y i0')
+    return data
+
+def test_disabled(store):
+    ns, plan = store
+    assert ns['mapstore_begin'](plan) is None
+    ns['mapstore_add'](None, 0, 'Map_y1_x1.001')
+
+def test_consolidate_points(store, tmp_path):
+    ns, plan = store
+    folder = tmp_path / 'user'
+    ns['enable_map_consolidation'](keep_files=False)
+    st = ns['mapstore_begin'](plan)
+
+    rows = {0: 4, 1: 6, 3: 5}
+    expected = {}
+    for i, nrows in rows.items():
+        expected[i] = write_point(folder, plan['filenames'][i], nrows)
+        ns['mapstore_add'](st, i, plan['filenames'][i])
+    ns['mapstore_add'](st, 2, 'missing.001')
+    # per-point files removed once held in the map file
+    assert not (folder / plan['filenames'][0]).exists()
+
+    fh = ns['mapstore_read'](st['file'])
+    assert fh['data'].shape == (2, 2, 6, 3)
+    assert fh['done'][()].tolist() == [[True, True], [False, True]]
+    assert np.allclose(fh['data'][0, 0, :4], expected[0])
+    assert np.allclose(fh['data'][1, 1, :5], expected[3])
+    assert np.allclose(fh['positions'][1, 1], plan['points'][3])
+    assert np.isnan(fh['positions'][1, 0]).all()
+    fh.close()
+
+    done = ns['mapstore_files']()
+    assert done == {plan['filenames'][i] for i in rows}
+
+def test_mapname_from_plan(store, tmp_path):
+    ns, plan = store
+    ns['enable_map_consolidation']()
+    st = ns['mapstore_begin'](plan)
+    assert st['file'].name == 'Map_y.h5' and st['keep_files']
+    fname = plan['filenames'][0]
+    write_point(tmp_path / 'user', fname, 2)
+    ns['mapstore_add'](st, 0, fname)
+    assert (tmp_path / 'user' / fname).exists()
+    assert ns['mapstore_files']() == {fname}
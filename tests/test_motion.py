@@ -0,0 +1,73 @@
+"""motion completion policy (motion.py)"""
+import pytest
+
+MOTOR = '13XRM:m1'
+
+@pytest.fixture
+def motion(macros, epics):
+    ticks = []
+    ns = macros('motion.py', sleep=lambda t: ticks.append(t),
+                _getPV={'finex': MOTOR + '.VAL'}.get,
+                watch_begin=lambda pvname, value, timeout=60: {'pvname': pvname},
+                watch_check=lambda watch: None,
+                watch_recover=lambda watch, problem: False,
+                watch_end=lambda watch: None)
+    epics.pv(MOTOR + '.RDBD', 0.002)
+    epics.pv(MOTOR + '.DMOV', 1)
+    return ns, ticks
+
+def test_policies(motion, scandb):
+    ns, ticks = motion
+    assert ns['motion_policy'](MOTOR + '.VAL') is None
+    ns['set_motion_policy']('finex', settle=0.03)
+    ns['set_motion_policy']('13XRM:m2.VAL', deadband=0.01)
+    policies = ns['motion_policies']([MOTOR + '.VAL', '13XRM:m2.VAL', '13XRM:m3.VAL'])
+    assert policies[MOTOR + '.VAL'] == {'deadband': 0.002, 'settle': 0.03}
+    assert policies['13XRM:m2.VAL'] == {'deadband': 0.01, 'settle': 0.05}
+    assert policies['13XRM:m3.VAL'] is None
+    ns['set_motion_policy']('finex', enable=False)
+    assert ns['motion_policy'](MOTOR + '.VAL') is None
+
+def test_no_policy_waits_for_completion(motion, epics):
+    ns, ticks = motion
+    assert ns['move_in_position'](MOTOR + '.VAL', 1.0, policy=None) == 'complete'
+    assert epics.pvs[MOTOR + '.VAL'].puts == [1.0]
+
+def test_released_by_readback(motion, epics):
+    ns, ticks = motion
+    epics.pv(MOTOR + '.VAL').complete_puts = False
+    epics.pv(MOTOR + '.RBV', 1.001)
+    out = ns['move_in_position'](MOTOR + '.VAL', 1.0,
+                                 policy={'deadband': 0.002, 'settle': 0.0})
+    assert out == 'in_position'
+
+def test_stale_completion(motion, epics, capsys):
+    "a completion outside the deadband, while still moving, is not accepted"
+    ns, ticks = motion
+    rbv = epics.pv(MOTOR + '.RBV', 0.5)
+    dmov = epics.pv(MOTOR + '.DMOV', 0)
+    def tick(t):
+        ticks.append(t)
+        if len(ticks) == 20:
+            rbv.value, dmov.value = 1.0, 1
+    ns['sleep'] = tick
+    out = ns['move_in_position'](MOTOR + '.VAL', 1.0,
+                                 policy={'deadband': 0.002, 'settle': 1.0})
+    assert out == 'complete' and len(ticks) == 20
+    assert 'outside deadband' not in capsys.readouterr().out
+
+def test_stopped_outside_deadband(motion, epics, capsys):
+    ns, ticks = motion
+    epics.pv(MOTOR + '.RBV', 0.99)
+    out = ns['move_in_position'](MOTOR + '.VAL', 1.0,
+                                 policy={'deadband': 0.002, 'settle': 0.0})
+    assert out == 'complete'
+    assert 'stopped at 0.99, outside deadband' in capsys.readouterr().out
+
+def test_watchdog_stop(motion, epics):
+    ns, ticks = motion
+    epics.pv(MOTOR + '.VAL').complete_puts = False
+    epics.pv(MOTOR + '.RBV', 0.0)
+    ns['watch_check'] = lambda watch: 'stalled'
+    assert ns['move_in_position'](MOTOR + '.VAL', 1.0,
+                                  policy={'deadband': 0.002, 'settle': 0.0}) == 'stopped'
@@ -0,0 +1,59 @@
+"""scan-to-scan pipelining (pipeline.py)"""
+import pytest
+
+pytest.importorskip('epics')
+STATUS = '13XRM:SCAN:'
+
+@pytest.fixture
+def pipe(macros, epics, scandb):
+    scandb.info.update({'scan_pipelining': 1, 'epics_status_prefix': STATUS})
+    status = epics.pv(STATUS + 'Status', 'Idle')
+    epics.pv(STATUS + 'Abort', 0)
+    scans = []
+    def timed_scan(scanname, filename=None, nscans=1, meta=None):
+        for i in range(nscans):
+            status.post('Running')
+            scans.append(('acquired', len(epics.puts)))
+            status.post('Finishing')
+        return filename
+    ns = macros('common.py', 'estimate.py', 'pipeline.py', timed_scan=timed_scan,
+                motor_move_time=lambda pvname, dist: 0.1)
+    return ns, scans
+
+MOVES = [('13XRM:m1.VAL', 1.0), ('13XRM:m2.VAL', 2.0)]
+
+def test_moves_start_after_last_acquisition(pipe, epics):
+    ns, scans = pipe
+    out = ns['scan_with_prefetch']('Scan', filename='a.001', nscans=2, moves=MOVES)
+    assert out == 'a.001'
+    # no moves during either acquisition, all once the last has ended
+    assert scans == [('acquired', 0), ('acquired', 0)]
+    assert epics.puts == MOVES
+
+def test_no_early_moves(pipe, epics, scandb):
+    ns, scans = pipe
+    epics.pv(STATUS + 'Abort', 1)
+    ns['scan_with_prefetch']('Scan', moves=MOVES)
+    assert epics.puts == []
+
+    epics.pv(STATUS + 'Abort', 0)
+    scandb.info['scan_pipelining'] = 0
+    assert ns['scan_with_prefetch']('Scan', filename='b.001', moves=MOVES) == 'b.001'
+    assert epics.puts == []
+
+def test_move_errors(pipe, epics):
+    ns, scans = pipe
+    def caput(pvname, value, **kws):
+        if pvname == MOVES[0][0]:
+            raise OSError('no connection')
+        epics.caput(pvname, value)
+    ns['caput'] = caput
+    with pytest.raises(OSError):
+        ns['scan_with_prefetch']('Scan', moves=MOVES)
+    assert epics.puts == [MOVES[1]]
+
+    # ordered moves stop at the first error
+    epics.puts.clear()
+    with pytest.raises(OSError):
+        ns['scan_with_prefetch']('Scan', moves=MOVES, ordered=True)
+    assert epics.puts == []
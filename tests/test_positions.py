@@ -0,0 +1,141 @@
+"""bulk named positions and the spatial index (positions.py)"""
+from types import SimpleNamespace as Row
+import numpy as np
+import pytest
+from conftest import FakeScanDB
+
+PVS = ['13XRM:m1.VAL', '13XRM:m2.VAL', '13XRM:m3.VAL']
+
+class PositionDB(FakeScanDB):
+    """instrument, pv, position and position_pv tables, as rows"""
+    def __init__(self, info=None):
+        FakeScanDB.__init__(self, info)
+        self.tables = {'instrument': [Row(id=1, name='Stage'), Row(id=2, name='Other')],
+                       'pv': [Row(id=i+1, name=name) for i, name in enumerate(PVS)],
+                       'instrument_pv': [Row(instrument_id=1, pv_id=i+1, display_order=i)
+                                         for i in range(len(PVS))],
+                       'position': [], 'position_pv': []}
+        self.nqueries = 0
+        self.last_id = 0
+
+    def add_position(self, name, values, instrument_id=1, stamp=0):
+        self.last_id = posid = self.last_id + 1
+        self.tables['position'].append(Row(id=posid, name=name, modify_time=stamp,
+                                           instrument_id=instrument_id))
+        for i, val in enumerate(values):
+            self.tables['position_pv'].append(Row(position_id=posid, pv_id=i+1, value=val))
+        return posid
+
+    def get_rows(self, table, where=None, limit_one=False, **kws):
+        rows = [row for row in self.tables[table]
+                if all(getattr(row, key) == val for key, val in (where or {}).items())]
+        if limit_one:
+            return rows[0] if len(rows) > 0 else None
+        return rows
+
+    def get_table(self, table):
+        "just enough of a table for select().where(c.col.in_(ids))"
+        rows = self.tables[table]
+        class Column:
+            def __init__(self, name):
+                self.name = name
+            def in_(self, ids):
+                return lambda row: getattr(row, self.name) in ids
+        class Query:
+            def where(self, test):
+                return [row for row in rows if test(row)]
+        return Row(c=Row(position_id=Column('position_id')), select=Query)
+
+    def execute(self, rows):
+        self.nqueries += 1
+        return Row(fetchall=lambda: rows)
+
+@pytest.fixture
+def positions(macros, tmp_path):
+    db = PositionDB()
+    ns = macros('positions.py', _scandb=db)
+    ns['_POSITION_INDEX'].clear()
+    return ns, db
+
+def test_read_and_write_positions(positions):
+    ns, db = positions
+    db.add_position('a', [1.0, 2.0, 3.0])
+    db.add_position('b', [4.0, 5.0, 6.0])
+    db.add_position('elsewhere', [7.0, 8.0, 9.0], instrument_id=2)
+    assert ns['instrument_pvnames']('Stage') == PVS
+    names, pvnames, vals = ns['read_positions']('Stage', pvnames=PVS[::-1])
+    assert names == ['a', 'b'] and pvnames == PVS[::-1]
+    assert vals.tolist() == [[3.0, 2.0, 1.0], [6.0, 5.0, 4.0]]
+    assert db.nqueries == 1
+    assert ns['positions_dict'](names, vals)['b'] == [6.0, 5.0, 4.0]
+
+    saved = []
+    ns['_instdb'] = Row(save_position=lambda inst, name, vals: saved.append(name))
+    nwrite = ns['write_positions']('Stage', ['a', 'b', 'c'], PVS,
+                                   [[1.0, 2.0, 3.0], [4.0, 5.5, 6.0], [0, 0, 0]])
+    assert nwrite == 2 and saved == ['b', 'c']
+
+def test_position_index_updates(positions):
+    ns, db = positions
+    for i in range(5):
+        db.add_position('p%d' % i, [float(i), float(i), 0.0])
+    index = ns['position_index']('Stage')
+    assert index['names'] == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert index['xy'][3].tolist() == [3.0, 3.0]
+
+    # one moved, one removed, one added
+    row = db.tables['position'][1]
+    row.modify_time = 1
+    for pvrow in db.tables['position_pv']:
+        if pvrow.position_id == row.id:
+            pvrow.value = 10.0
+    db.tables['position'].pop(0)
+    db.add_position('new', [-1.0, -1.0, 0.0])
+    nqueries = db.nqueries
+    index = ns['position_index']('Stage')
+    assert db.nqueries == nqueries      # no full re-read
+    assert sorted(index['names']) == ['new', 'p1', 'p2', 'p3', 'p4']
+    assert index['xy'][index['names'].index('p1')].tolist() == [10.0, 10.0]
+
+def test_spatial_queries(positions):
+    ns, db = positions
+    for name, x, y in (('A_1', 0, 0), ('A_2', 1, 0), ('B_1', 0, 3), ('B_2', 5, 5)):
+        db.add_position(name, [x, y, 0.0])
+    near = ns['positions_near'](0.9, 0.1, n=2, instname='Stage')
+    assert [name for name, dist in near] == ['A_2', 'A_1']
+    assert near[0][1] == pytest.approx(np.sqrt(0.02))
+    assert [n for n, d in ns['positions_within'](0, 0, 3.0, instname='Stage')] == \
+        ['A_1', 'A_2', 'B_1']
+    assert ns['positions_in_box'](-1, 2, -1, 4, instname='Stage') == ['A_1', 'A_2', 'B_1']
+    assert ns['positions_matching']('^A_', instname='Stage') == ['A_1', 'A_2']
+
+    order = ns['visit_order'](['B_2', 'A_1', 'missing', 'B_1', 'A_2'],
+                              instname='Stage', start=(6, 6))
+    assert order == ['B_2', 'B_1', 'A_1', 'A_2', 'missing']
+
+def test_coarse_and_fine_xy(positions):
+    ns, db = positions
+    values = np.array([[0.1, 0.2, 0, 0, 10.0, 20.0],
+                       [np.nan, np.nan, 0, 0, 1.0, 2.0]])
+    assert ns['_index_xy'](values).tolist() == [[10.1, 20.2], [1.0, 2.0]]
+
+def test_maplist(positions, macros):
+    ns, db = positions
+    for name, x in (('S_1', 0.0), ('S_2', 5.0), ('S_3', 1.0), ('T_1', 2.0)):
+        db.add_position(name, [x, 0.0, np.nan])
+    visits = []
+    ns = macros('positions.py', 'scanning.py', _scandb=db,
+                move_samplestage=lambda name, wait=True: visits.append(name),
+                scan_with_prefetch=lambda scan, filename=None, moves=None, **kws:
+                visits.append((filename, moves)))
+    ns['_POSITION_INDEX'].clear()
+    db.info['samplestage_instrument'] = 'Stage'
+    ns['maplist']('S_', 'Map')
+    assert visits == []
+
+    ns['maplist']('S_', 'Map', suffixes='all', ordered=True)
+    assert visits[0] == 'S_1'
+    # the next position's values, without the unsaved one, are prefetched
+    assert visits[1] == ('Map_S_1.001', [(PVS[0], 1.0), (PVS[1], 0.0)])
+    assert visits[2::2] == ['S_3', 'S_2']
+    assert visits[-1] == ('Map_S_2.001', None)
@@ -0,0 +1,69 @@
+"""analyzer daemon (daemons/run_analyzer.py)"""
+import threading
+import time
+import pytest
+from conftest import FakePV
+
+@pytest.fixture
+def analyzer(daemon_path, monkeypatch):
+    import epics
+    monkeypatch.setattr(epics, 'PV', FakePV)
+    import run_analyzer
+    return run_analyzer
+
+def make_analyzer(module, **methods):
+    "Analyzer daemon with status PVs, without connecting a Device"
+    cls = type('TestAnalyzer', (module.Analyzer,), methods)
+    ana = object.__new__(cls)
+    ana._pvs = {name: FakePV(name) for name in ('QueueDepth', 'Latency', 'Moving')}
+    ana.cond = threading.Condition()
+    ana.en_val, ana.n_pending, ana.t_request = -1, 0, 0
+    return ana
+
+def test_requests_are_coalesced(analyzer):
+    moves = []
+    ana = make_analyzer(analyzer, set_energy=lambda self, t_request=None:
+                        moves.append(self.en_val))
+    ana.onEnergyChange(7000.0)
+    ana.onEnergyChange(7100.0)
+    ana.onEnergyChange(50.0)         # out of range, not an energy
+    ana.onMovingChange(0)            # only Moving=1 is a request
+    assert (ana.en_val, ana.n_pending) == (7100.0, 3)
+
+    thread = threading.Thread(target=ana.run, daemon=True)
+    thread.start()
+    t0 = time.time()
+    while len(moves) < 1 and time.time()-t0 < 5:
+        time.sleep(0.01)
+    assert moves == [7100.0]
+    assert ana._pvs['QueueDepth'].value == 3
+    assert ana.n_pending == 0
+
+def set_motors(module, monkeypatch, **values):
+    motors = {name: FakePV(name, values.get(name, 0.0)) for name in module.MOTORS}
+    monkeypatch.setattr(module, 'MOTORS', motors)
+    return motors
+
+def test_group_move(analyzer, monkeypatch):
+    motors = set_motors(analyzer, monkeypatch)
+    assert analyzer.group_move({'ana_d': 600.0, 'ana_th': 70.0})
+    assert motors['ana_d'].puts == [600.0] and motors['ana_th'].puts == [70.0]
+    assert motors['det_x'].puts == []
+
+    motors['det_x'].complete_puts = False
+    assert not analyzer.group_move({'det_x': 10.0, 'ana_d': 500.0}, timeout=0.05)
+
+def test_move_stages_keeps_clearance(analyzer, monkeypatch):
+    set_motors(analyzer, monkeypatch, ana_d=500.0, det_x=0.0, det_y=0.0)
+    # without the detector, or far apart: all at once
+    targets = {'ana_d': 400.0, 'ana_th': 60.0}
+    assert analyzer.move_stages(targets) == [targets]
+    targets = {'ana_d': 450.0, 'det_x': 0.0, 'det_y': 20.0}
+    assert analyzer.move_stages(targets) == [targets]
+
+    # detector moving to where the analyzer is: the analyzer moves away first
+    chi = analyzer.deg2rad(analyzer.ACHI)
+    ana_x, ana_y = 500*analyzer.cos(chi), 500*analyzer.sin(chi)
+    targets = {'ana_d': 100.0, 'ana_th': 60.0, 'det_x': ana_x, 'det_y': ana_y}
+    assert analyzer.move_stages(targets) == [{'ana_d': 100.0, 'ana_th': 60.0},
+                                             {'det_x': ana_x, 'det_y': ana_y}]
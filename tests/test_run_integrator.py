@@ -0,0 +1,103 @@
+"""live XRD integration service (daemons/run_integrator.py)"""
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+tifffile = pytest.importorskip('tifffile')
+
+PONI = """# Calibration, as saved by pyFAI
+PixelSize1: 0.001
+PixelSize2: 0.001
+Distance: 0.1
+Poni1: 0.02
+Poni2: 0.025
+Rot1: 0
+Rot2: 0
+Rot3: 0
+Wavelength: 1e-10
+"""
+SHAPE = (40, 50)
+
+@pytest.fixture
+def integrator(daemon_path, tmp_path):
+    import run_integrator
+    for cache in (run_integrator._integrators, run_integrator._masks,
+                  run_integrator._darks):
+        cache.clear()
+    (tmp_path / 'cal.poni').write_text(PONI)
+    return run_integrator
+
+def save_frame(path, value, dtype='uint32', bad=None):
+    img = np.full(SHAPE, value, dtype=dtype)
+    if bad is not None:
+        img[bad] = np.iinfo(dtype).max
+    tifffile.imwrite(path, img)
+    return str(path)
+
+def queue(tmp_path, *jobs, end='\n'):
+    with open(tmp_path / 'XRD_Integrate.jsonl', 'a') as fh:
+        fh.write(end.join([json.dumps(job) for job in jobs]) + end)
+
+def test_new_jobs(integrator, tmp_path):
+    queue(tmp_path, {'file': 'old.tif', 'poni': 'cal.poni'})
+    integ = integrator.Integrator(tmp_path)
+    assert integ.new_jobs() == []       # queued before the service started
+
+    queue(tmp_path, {'file': '/data/a_001.tif', 'poni': 'cal.poni', 'mask': None},
+          {'file': '/data/b_001.tif', 'poni': None})
+    with open(tmp_path / 'XRD_Integrate.jsonl', 'a') as fh:
+        fh.write('not json\n{"file": "/data/partial')
+    jobs = integ.new_jobs()
+    assert [job['name'] for job in jobs] == ['a_001']
+    assert jobs[0]['ponifile'] == (tmp_path / 'cal.poni').as_posix()
+    assert jobs[0]['maskfile'] is None
+
+    # the rest of a partly written line is read next time
+    with open(tmp_path / 'XRD_Integrate.jsonl', 'a') as fh:
+        fh.write('", "poni": "cal.poni", "map": "Map", "index": 3}\n')
+    jobs = integ.new_jobs()
+    assert [(job['name'], job['index']) for job in jobs] == [('Map', 3)]
+
+def test_integrate_into_map(integrator, tmp_path):
+    integ = integrator.Integrator(tmp_path)
+    bad = (slice(10, 12), slice(None))
+    for i, value in enumerate((5, 7)):
+        fname = save_frame(tmp_path / ('m_%d.tif' % i), value, bad=bad)
+        queue(tmp_path, {'file': fname, 'poni': 'cal.poni', 'map': 'Map',
+                         'index': i, 'shape': [1, 3]})
+    for job in integ.new_jobs():
+        integ.store.add(*integrator.integrate_frame(job)[:3])
+
+    out = tmp_path / 'XRD_Integrated'
+    arr = np.load(out / 'Map.npy')
+    q = np.load(out / 'Map_q.npy')
+    assert arr.shape == (3, integrator.NBINS) and q.shape == (integrator.NBINS,)
+    assert json.load(open(out / 'Map.json'))['shape'] == [1, 3]
+    assert np.isnan(arr[2]).all()
+    # gap pixels are masked, not counted at 2**32-1
+    filled = np.abs(arr[0]) > 0
+    assert filled.any() and arr[0][filled].max() < 10
+    assert np.allclose(arr[1][filled]/arr[0][filled], 7/5.0)
+
+def test_dark_subtraction(integrator, tmp_path):
+    integ = integrator.Integrator(tmp_path)
+    dark = save_frame(tmp_path / 'bgr_001.tif', 2)
+    small = str(tmp_path / 'small.tif')
+    tifffile.imwrite(small, np.ones((4, 4), dtype='uint32'))
+    for i, darkfile in enumerate((dark, small, str(tmp_path / 'missing.tif'), None)):
+        fname = save_frame(tmp_path / ('m_%d.tif' % i), 5)
+        queue(tmp_path, {'file': fname, 'poni': 'cal.poni', 'map': 'Map',
+                         'index': i, 'shape': [1, 4], 'dark': darkfile})
+    for job in integ.new_jobs():
+        job, q, intensity, dark = integrator.integrate_frame(job)
+        assert (dark is not None) == (job['index'] == 0)
+        integ.store.add(job, q, intensity, dark=dark)
+
+    out = tmp_path / 'XRD_Integrated'
+    arr, sub = np.load(out / 'Map.npy'), np.load(out / 'Map_sub.npy')
+    filled = np.abs(arr[0]) > 0
+    assert np.allclose(sub[0][filled], arr[0][filled]*3/5.0)
+    assert np.isnan(sub[1:]).all() and not np.isnan(arr).any()
+    # each dark is integrated once
+    assert len(integrator._darks) == 3
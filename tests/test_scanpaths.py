@@ -0,0 +1,62 @@
+"""scan plans (scanpaths.py)"""
+import numpy as np
+import pytest
+
+MOTORS = {'x': '13XRM:m1.VAL', 'y': '13XRM:m2.VAL', 'z': '13XRM:m3.VAL'}
+
+@pytest.fixture
+def paths(macros):
+    return macros('estimate.py', 'scanpaths.py', _getPV=MOTORS.get)
+
+def test_grid_path(paths):
+    plan = paths['grid_path']('x', 'y', xstart=0, xstop=0.2, xstep=0.1,
+                              ystart=1, ystop=2, ystep=0.5,
+                              fileform='Map_y{iy}_x{ix}.001')
+    assert plan['shape'] == (3, 3)
+    assert plan['motors'] == ['y', 'x']
+    assert plan['pvnames'] == ['13XRM:m2.VAL', '13XRM:m1.VAL']
+    assert np.allclose(plan['points'][:4], [[1, 0], [1, 0.1], [1, 0.2], [1.5, 0]])
+    assert plan['index'][4].tolist() == [1, 1]
+    assert plan['filenames'][:2] == ['Map_y1_x1.001', 'Map_y1_x2.001']
+    assert plan['filenames'][-1] == 'Map_y3_x3.001'
+    # y only moves at the start of each row
+    assert plan['moves'][:, 0].tolist() == [True, False, False]*3
+    assert plan['moves'][:, 1].all()
+
+def test_line_and_list_paths(paths):
+    plan = paths['line_path']('z', start=0, stop=1, step=0.25, fileform='L_{i}.001')
+    assert np.allclose(plan['points'][:, 0], [0, 0.25, 0.5, 0.75, 1.0])
+    assert plan['filenames'][-1] == 'L_5.001'
+    assert plan['shape'] == (1, 5)
+
+    plan = paths['list_path'](['x', 'y'], [[0, 0], [0, 1], [2, 1]])
+    assert plan['moves'].tolist() == [[True, True], [False, True], [True, False]]
+    assert plan['filenames'] == [None]*3
+
+def test_unknown_motor(paths, capsys):
+    assert paths['line_path']('nomotor', 0, 1, 0.5) is None
+    assert 'nomotor' in capsys.readouterr().out
+    # full PV names are accepted
+    plan = paths['line_path']('13IDE:m9.VAL', 0, 1, 0.5)
+    assert plan['pvnames'] == ['13IDE:m9.VAL']
+
+def test_spiral_path_spacing(paths):
+    plan = paths['spiral_path']('x', 'y', xcenter=1, ycenter=2, radius=0.1, step=0.01)
+    pts = plan['points']
+    assert np.allclose(pts[0], [1, 2])
+    rad = np.hypot(pts[:, 0]-1, pts[:, 1]-2)
+    assert rad.max() <= 0.1 + 1.e-9
+    steps = np.hypot(*np.diff(pts, axis=0).T)
+    assert np.median(steps) == pytest.approx(0.01, rel=0.1)
+
+def test_plan_targets_and_move_time(paths, epics):
+    plan = paths['grid_path']('x', 'y', xstart=0, xstop=1, xstep=1,
+                              ystart=0, ystop=1, ystep=1)
+    assert paths['plan_targets'](plan, 1) == [('13XRM:m1.VAL', 1.0)]
+    assert paths['plan_targets'](plan, 1, allmotors=True) == [('13XRM:m2.VAL', 0.0),
+                                                             ('13XRM:m1.VAL', 1.0)]
+    for pvname in MOTORS.values():
+        epics.pv(pvname.replace('.VAL', '.VELO'), 1.0)
+        epics.pv(pvname.replace('.VAL', '.ACCL'), 0.0)
+    # x: 0 -> 1 -> 0 -> 1, y: 0 -> 1
+    assert paths['plan_move_time'](plan) == pytest.approx(4.0)
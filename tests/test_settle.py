@@ -0,0 +1,57 @@
+"""learned settle times (settle.py)"""
+import json
+import threading
+import pytest
+
+pytest.importorskip('epics')
+PV = '13IDE:I0_Volts'
+
+@pytest.fixture
+def settle(macros):
+    return macros('aio.py', 'settle.py')
+
+def test_learned_times(settle, scandb):
+    for t in range(1, 31):
+        settle['record_settle']('focus', t/100.0)
+    # buffered until flushed
+    assert 'settle_times' not in scandb.info
+    assert settle['learned_settle']('focus') == pytest.approx(0.276)     # of the last 25
+    assert settle['learned_settle']('other', 0.5) == 0.5
+    settle['settle_flush']()
+    history = json.loads(scandb.info['settle_times'])['focus']
+    assert len(history) == settle['SETTLE_HISTORY'] and history[-1] == 0.3
+    assert settle['settle_report']()['focus'][0] == 25
+
+def test_wait_without_readbacks(settle):
+    settle['record_settle']('gain', 0.02)
+    assert settle['wait_settled']('gain', default=1.0) == pytest.approx(0.02)
+    assert settle['wait_settled']('new', default=0.03) == 0.03
+
+def test_wait_for_readbacks(settle, epics):
+    pv = epics.pv(PV, 1.0)
+    for i, t in enumerate((0.05, 0.1, 0.15)):
+        threading.Timer(t, pv.post, args=(2.0 + i,)).start()
+    elapsed = settle['wait_settled']('i0', [PV], default=2.0, window=0.1)
+    assert 0.14 < elapsed < 0.5
+    assert settle['_settle_table']()['i0'] == [round(elapsed, 4)]
+
+def test_not_settled(settle, epics, capsys):
+    pv = epics.pv(PV, 1.0)
+    stop = threading.Event()
+    def noisy():
+        value = 1.0
+        while not stop.wait(0.01):
+            value = -value
+            pv.post(value)
+    thread = threading.Thread(target=noisy)
+    thread.start()
+    try:
+        assert settle['wait_settled']('i0', [PV], default=0.2) == 0.2
+    finally:
+        stop.set()
+        thread.join()
+    assert 'did not settle' in capsys.readouterr().out
+    assert 'i0' not in settle['_settle_table']()
+
+    # a fresh value is needed, and never arrives
+    assert settle['wait_settled']('i0', [PV], default=0.1, fresh=True) == 0.1
@@ -0,0 +1,55 @@
+"""microscope to sample stage registration (uscope.py)"""
+import numpy as np
+import pytest
+
+@pytest.fixture
+def uscope(macros):
+    return macros('uscope.py')
+
+def affine(pts):
+    "a known rotation, scale and shift"
+    c, s = np.cos(0.3), np.sin(0.3)
+    mat = np.array([[c, -s, 0.01], [s, c, 0.02], [0.0, 0.03, 0.98]])
+    return np.dot(mat, pts) + np.array([[1.5], [-2.0], [0.25]]), mat
+
+def test_affine_lstsq_recovers_transform(uscope):
+    rng = np.random.default_rng(7)
+    v1 = rng.uniform(-5, 5, size=(3, 8))
+    v2, mat = affine(v1)
+    fit, inverse, resid = uscope['affine_lstsq'](v1, v2)
+    assert np.allclose(fit[:3, :3], mat)
+    assert np.allclose(fit[:3, 3], [1.5, -2.0, 0.25])
+    assert np.allclose(fit[3], [0, 0, 0, 1])
+    assert np.allclose(np.dot(inverse, fit), np.identity(4))
+    assert resid.shape == (8,) and resid.max() < 1e-9
+
+def test_affine_lstsq_weights(uscope):
+    rng = np.random.default_rng(8)
+    v1 = rng.uniform(-5, 5, size=(3, 8))
+    v2, mat = affine(v1)
+    v2[0, 0] += 1.0              # one bad point
+    weights = np.ones(8)
+    plain = uscope['affine_lstsq'](v1, v2)[2]
+    weights[0] = 1.e-8
+    fit, inverse, resid = uscope['affine_lstsq'](v1, v2, weights=weights)
+    assert np.allclose(fit[:3, :3], mat, atol=1e-6)
+    assert resid[1:].max() < plain[1:].max()
+    assert resid[0] == pytest.approx(1.0, abs=1e-5)
+
+def test_calc_registration(uscope, capsys):
+    rng = np.random.default_rng(9)
+    v1 = rng.uniform(-5, 5, size=(3, 7))
+    v2, mat = affine(v1)
+    names = ['p%d' % i for i in range(7)]
+    d1 = {name: tuple(v1[:, i]) for i, name in enumerate(names)}
+    d2 = {name: tuple(v2[:, i]) for i, name in enumerate(names)}
+    d1['only_uscope'] = (0, 0, 0)
+    fit, inverse, labels, resid = uscope['calc_registration'](d1, d2)
+    assert labels == names
+    assert np.allclose(fit[:3, :3], mat)
+    assert 'using 7 positions' in capsys.readouterr().out
+
+    d2.pop('p0')
+    d2.pop('p1')
+    fit, inverse, labels, resid = uscope['calc_registration'](d1, d2)
+    assert fit is None and len(labels) == 5
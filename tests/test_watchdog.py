@@ -0,0 +1,78 @@
+"""watchdog for blocking moves (watchdog.py)"""
+import pytest
+
+MOTOR = '13XRM:m1'
+
+@pytest.fixture
+def dog(macros, epics):
+    now = {'t': 100.0}
+    ns = macros('estimate.py', 'watchdog.py', clock=lambda: now['t'],
+                sleep=lambda t: None,
+                motor_move_time=lambda pvname, dists: 2.0*abs(dists[0]))
+    epics.pv(MOTOR + '.RBV', 0.0)
+    epics.pv(MOTOR + '.DMOV', 1)
+    return ns, now
+
+def test_settings(dog, scandb):
+    ns, now = dog
+    ns['set_watchdog'](recovery='skip', stall_time=2)
+    conf = ns['watchdog_config']()
+    assert (conf['recovery'], conf['stall_time'], conf['retries']) == ('skip', 2, 1)
+    with pytest.raises(ValueError):
+        ns['set_watchdog'](recovery='ignore')
+    with pytest.raises(ValueError):
+        ns['set_watchdog'](stall=2)
+
+def test_allowed_time(dog, epics):
+    ns, now = dog
+    watch = ns['watch_begin'](MOTOR + '.VAL', 5.0)
+    assert watch['expected'] == 10.0 and watch['allowed'] == 10.0 + 3*10.0
+    assert ns['watch_begin'](MOTOR + '.VAL', 5.0, timeout=15)['allowed'] == 15
+    # not a motor, nothing learned
+    epics.pv('13IDE:Gain.DMOV').connected = False
+    watch = ns['watch_begin']('13IDE:Gain.VAL', 1)
+    assert watch['expected'] is None and watch['allowed'] == 60.0
+    assert len(ns['watchdog_status']()) == 3
+
+def test_stall(dog, epics):
+    ns, now = dog
+    rbv, dmov = epics.pvs[MOTOR + '.RBV'], epics.pvs[MOTOR + '.DMOV']
+    watch = ns['watch_begin'](MOTOR + '.VAL', 5.0)
+    # a slow start is not a stall
+    now['t'] += 8
+    assert ns['watch_check'](watch) is None
+    dmov.value = 0
+    assert ns['watch_check'](watch) is None
+    now['t'] += 4
+    rbv.value = 0.5
+    assert ns['watch_check'](watch) is None
+    now['t'] += 4.9
+    assert ns['watch_check'](watch) is None
+    now['t'] += 0.2
+    assert ns['watch_check'](watch) == 'stalled'
+
+def test_overdue(dog, epics):
+    ns, now = dog
+    rbv = epics.pvs[MOTOR + '.RBV']
+    watch = ns['watch_begin'](MOTOR + '.VAL', 1.0)
+    for i in range(1, 20):
+        now['t'] += 1.0
+        rbv.value = i*0.01
+        if ns['watch_check'](watch) is not None:
+            break
+    assert ns['watch_check'](watch) == 'overdue' and now['t'] == 100.0 + 17
+
+def test_recovery(dog, epics, scandb):
+    ns, now = dog
+    watch = ns['watch_begin'](MOTOR + '.VAL', 5.0)
+    assert ns['watch_recover'](watch, 'stalled')
+    assert epics.puts == [(MOTOR + '.STOP', 1)]
+    assert epics.pvs[MOTOR + '.VAL'].puts == [5.0] and watch['retries'] == 1
+    assert not ns['watch_recover'](watch, 'stalled')
+    assert 'stalled moving to 5.0' in scandb.info['watchdog_last_error']
+    assert ns['watchdog_status']() == []
+
+    ns['set_watchdog'](recovery='skip')
+    watch = ns['watch_begin'](MOTOR + '.VAL', 5.0)
+    with pytest.raises(ns['MoveStalled']):
+        ns['watch_recover'](watch, 'overdue')
@@ -0,0 +1,79 @@
+"""geometry-cached sparse integrator (daemons/xrd_integrate.py)"""
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+PONI = {'dist': 0.1, 'poni1': 0.02, 'poni2': 0.025, 'rot1': 0, 'rot2': 0,
+        'rot3': 0, 'wavelength': 1e-10, 'pixel1': 0.001, 'pixel2': 0.001}
+SHAPE = (40, 50)
+
+@pytest.fixture
+def xint(daemon_path):
+    import xrd_integrate
+    return xrd_integrate
+
+def test_read_poni_file(xint, tmp_path):
+    fname = tmp_path / 'cal.poni'
+    fname.write_text("""# Nota: C-Order, 1 refers to the Y axis, 2 to the X axis
+poni_version: 2
+Detector: Eiger1M
+Detector_config: {"pixel1": 7.5e-05, "pixel2": 7.5e-05, "max_shape": [1065, 1030]}
+Distance: 0.1512
+Poni1: 0.0412
+Poni2: 0.0398
+Rot1: 0.001
+Rot2: -0.002
+Rot3: 0.0
+Wavelength: 6.2e-11
+""")
+    poni = xint.read_poni_file(fname)
+    assert poni['dist'] == 0.1512 and poni['wavelength'] == 6.2e-11
+    assert poni['pixel1'] == poni['pixel2'] == 7.5e-05
+    assert poni['rot2'] == -0.002 and poni['detector'] == 'Eiger1M'
+
+def test_pixel_geometry(xint):
+    tth, chi, solid = xint.pixel_geometry(PONI, SHAPE)
+    p1 = (np.arange(SHAPE[0]) + 0.5)*0.001 - 0.02
+    p2 = (np.arange(SHAPE[1]) + 0.5)*0.001 - 0.025
+    rad = np.hypot(*np.meshgrid(p1, p2, indexing='ij'))
+    assert np.allclose(tth, np.arctan2(rad, 0.1))
+    assert np.allclose(solid, np.cos(tth)**3)
+    assert tth.shape == chi.shape == SHAPE
+
+def test_integrator_corrections(xint):
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[5:8, :] = True
+    integ = xint.build_integrator(PONI, SHAPE, nbins=64, mask=mask)
+    assert integ['matrix'].shape == (64, SHAPE[0]*SHAPE[1])
+    assert np.all(np.diff(integ['q']) > 0)
+    tth, chi, solid = xint.pixel_geometry(PONI, SHAPE)
+    assert integ['q'][-1] < 4*np.pi*np.sin(tth.max()/2)/1.0
+
+    # a frame of solid angle and polarization alone integrates to 1,
+    # whatever is in the masked pixels
+    ctth = np.cos(tth)
+    img = solid*0.5*(1 + ctth**2 - 0.99*np.cos(2*chi)*(1 - ctth**2))
+    img[mask] = 1.e9
+    q, intensity = xint.integrate(integ, img)
+    filled = integ['counts'] > 0
+    assert np.allclose(intensity[filled], 1.0)
+    assert np.all(intensity[~filled] == 0)
+
+def test_load_integrator_cache(xint, tmp_path, monkeypatch):
+    ponifile = tmp_path / 'cal.poni'
+    ponifile.write_text('\n'.join(['%s: %s' % (k, v) for k, v in PONI.items()]))
+    integ = xint.load_integrator(str(ponifile), SHAPE, nbins=32)
+    cached = list((tmp_path / 'integrator_cache').glob('cal_*.npz'))
+    assert len(cached) == 1
+
+    def fail(*args, **kws):
+        raise AssertionError('integrator rebuilt')
+    monkeypatch.setattr(xint, 'build_integrator', fail)
+    again = xint.load_integrator(str(ponifile), SHAPE, nbins=32)
+    assert np.allclose(again['q'], integ['q'])
+    assert (again['matrix'] != integ['matrix']).nnz == 0
+    # a different mask needs a new integrator
+    with pytest.raises(AssertionError):
+        xint.load_integrator(str(ponifile), SHAPE, nbins=32,
+                             mask=np.ones(SHAPE, dtype=bool))
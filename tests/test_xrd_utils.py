@@ -0,0 +1,141 @@
+"""XRD camera control, sessions and dark frames (xrd_utils.py)"""
+import json
+import time
+import pytest
+
+pytest.importorskip('epicsscan')
+
+PREFIX = '13EIG2:'
+
+@pytest.fixture
+def xrd(macros, epics, scandb):
+    scandb.info['xrd_detector_prefix'] = PREFIX
+    ns = macros('common.py', 'catalog.py', 'estimate.py', 'xrd_utils.py',
+                sleep=time.sleep)
+    ns['_AD_NO_RBV'].clear()
+    return ns
+
+def follow_readbacks(ns, epics):
+    "caput that also updates the _RBV PV, as the driver would"
+    def caput(pvname, value, **kws):
+        epics.caput(pvname, value)
+        if pvname + '_RBV' in epics.pvs:
+            epics.pv(pvname + '_RBV').value = value
+    ns['caput'] = caput
+
+def test_ad_configure_writes_differences(xrd, epics):
+    follow_readbacks(xrd, epics)
+    epics.pv(PREFIX + 'cam1:NumImages_RBV', 1)
+    # the setpoint was changed, but the driver kept its value
+    epics.pv(PREFIX + 'cam1:AcquireTime', 0.25)
+    epics.pv(PREFIX + 'cam1:AcquireTime_RBV', 1.0)
+    epics.pv(PREFIX + 'cam1:AcquirePeriod_RBV', 1.0)
+    epics.pv(PREFIX + 'TIFF1:FileName_RBV', 'abc')
+    epics.pv(PREFIX + 'cam1:FWEnable', 0)
+    epics.pv(PREFIX + 'cam1:FWEnable_RBV').connected = False
+
+    written = xrd['ad_configure'](PREFIX, [('cam1:NumImages', 1),
+                                           ('cam1:AcquireTime', 1.0),
+                                           ('cam1:AcquirePeriod', 2.0),
+                                           ('cam1:FWEnable', 1),
+                                           ('TIFF1:FileName', 'abc')])
+    assert written == ['cam1:AcquirePeriod', 'cam1:FWEnable']
+    assert epics.puts == [(PREFIX + 'cam1:AcquirePeriod', 2.0),
+                          (PREFIX + 'cam1:FWEnable', 1)]
+    assert PREFIX + 'cam1:FWEnable' in xrd['_AD_NO_RBV']
+
+    # now matching: nothing more to write
+    assert xrd['ad_configure'](PREFIX, [('cam1:AcquirePeriod', 2.0),
+                                        ('cam1:FWEnable', 1)]) == []
+
+def test_ad_configure_warns_on_readback(xrd, epics, capsys):
+    epics.pv(PREFIX + 'cam1:NumImages_RBV', 1)
+    written = xrd['ad_configure'](PREFIX, [('cam1:NumImages', 5)], timeout=0.05)
+    assert written == ['cam1:NumImages']
+    assert 'did not reach 5' in capsys.readouterr().out
+
+def test_eiger_period_after_time(xrd):
+    suffixes = [suffix for suffix, value in xrd['EIGER_LIVE']]
+    assert suffixes.index('cam1:AcquireTime') < suffixes.index('cam1:AcquirePeriod')
+    session = {'prefix': PREFIX, 'kind': 'eiger'}
+    settings = []
+    xrd['ad_configure'] = lambda prefix, values: settings.extend(values)
+    xrd['_session_configure'](session, 'sample', t=3.0)
+    suffixes = [suffix for suffix, value in settings]
+    assert suffixes[-2:] == ['cam1:AcquireTime', 'cam1:AcquirePeriod']
+
+def test_session(xrd, epics, scandb):
+    configured = []
+    xrd['ad_configure'] = lambda prefix, values: configured.append(dict(values))
+    xrd['_ad_stop'] = lambda prefix: None
+    assert xrd['xrd_session_begin']('13XYZ:') is None
+
+    epics.pv('13PIL300K:cam1:ShutterMode', 2)
+    session = xrd['xrd_session_begin']('13PIL300K:')
+    assert session['kind'] == 'pil' and session['shutter_mode'] == 2
+    assert configured[-1]['cam1:ShutterMode'] == 0
+
+    xrd['_ad_acquire'] = lambda prefix, t, timeout=60: t
+    xrd['_ad_write_tiff'] = lambda prefix: '/data/xrd/sample_001.tif'
+    fname = xrd['xrd_session_frame'](session, 'sample', t=2.0)
+    assert fname == '/data/xrd/sample_001.tif'
+    assert session['nframes'] == 1
+    assert configured[-1]['TIFF1:FileName'] == 'sample'
+    assert configured[-1]['cam1:AcquireTime'] == 2.0
+
+    xrd['xrd_session_end'](session)
+    assert configured[-1] == {'TIFF1:EnableCallbacks': 0, 'cam1:ShutterMode': 2}
+
+def test_stream_capture_restores_proc1(xrd, epics):
+    configured = []
+    xrd['ad_configure'] = lambda prefix, values: configured.append(list(values))
+    xrd['sleep'] = lambda t: None
+    assert xrd['save_xrd_stream']('sample', t=1.0) is None      # not streaming
+
+    epics.pv(PREFIX + 'cam1:Acquire', 1)
+    epics.pv(PREFIX + 'cam1:AcquirePeriod_RBV', 0.5)
+    epics.pv(PREFIX + 'TIFF1:NDArrayPort', 'EIG')
+    epics.pv(PREFIX + 'PROC1:NumFilter', 10)
+    epics.pv(PREFIX + 'PROC1:EnableCallbacks', 1)
+    epics.pv(PREFIX + 'TIFF1:ArrayCounter_RBV', 7)
+    epics.pv(PREFIX + 'TIFF1:FullFileName_RBV', '/data/xrd/sample_001.tif')
+    assert xrd['save_xrd_stream']('sample', t=0.7) is None      # not 0.5*N
+
+    reset = epics.pv(PREFIX + 'PROC1:ResetFilter')
+    reset.put = lambda value, **kws: epics.pv(PREFIX + 'TIFF1:ArrayCounter_RBV', 8)
+    assert xrd['save_xrd_stream']('sample', t=1.0) == '/data/xrd/sample_001.tif'
+    assert ('PROC1:NumFilter', 2) in configured[0]
+    assert ('TIFF1:NDArrayPort', 'PROC1') in configured[0]
+    assert ('TIFF1:NDArrayPort', 'EIG') in configured[2]
+    # PROC1 put back as it was, with callbacks enabled last
+    assert configured[3][0] == ('PROC1:EnableCallbacks', 0)
+    assert ('PROC1:NumFilter', 10) in configured[3]
+    assert configured[3][-1] == ('PROC1:EnableCallbacks', 1)
+
+def test_dark_frames(xrd, epics, scandb, tmp_path):
+    temp = epics.pv(PREFIX + 'cam1:TemperatureActual', 25.0)
+    epics.pv(PREFIX + 'TIFF1:FullFileName_RBV', '/data/xrd/bgr_001.tif')
+    assert xrd['xrd_background_needed'](5.0)
+    xrd['xrd_background_taken'](5.0)
+    xrd['xrd_background_taken'](10.0, filename='/data/xrd/bgr_002.tif')
+    assert xrd['xrd_dark_for'](5.0) == '/data/xrd/bgr_001.tif'
+    assert xrd['xrd_dark_for'](10.0) == '/data/xrd/bgr_002.tif'
+    assert xrd['xrd_dark_for'](10.0, prefix='13PIL300K:') is None
+    assert not xrd['xrd_background_needed'](5.0)
+
+    # a new background replaces the old one for the same time
+    xrd['xrd_background_taken'](5.0, filename='/data/xrd/bgr_003.tif')
+    assert len(xrd['_xrd_darks']()) == 2
+    assert xrd['xrd_dark_for'](5.0) == '/data/xrd/bgr_003.tif'
+
+    temp.value = 27.0
+    assert xrd['xrd_background_needed'](5.0)
+
+    temp.value = 25.5
+    scandb.info['xrd_live_integrate'] = 1
+    scandb.info['xrd_ponifile'] = 'cal.poni'
+    xrd['queue_xrd_integration']('/data/xrd/s_001.tif', t=5.0)
+    xrd['queue_xrd_integration']('/data/xrd/s_002.tif')
+    with open(tmp_path / 'user' / 'XRD_Integrate.jsonl') as fh:
+        jobs = [json.loads(line) for line in fh]
+    assert [job['dark'] for job in jobs] == ['/data/xrd/bgr_003.tif', None]
@@ -0,0 +1,63 @@
+"""fly-mode line_xrf (xrf_utils._line_xrf_fly)"""
+import numpy as np
+import pytest
+
+MOTORS = {'x': '13XRM:m1.VAL'}
+DET = '13QX7:det1:'
+
+@pytest.fixture
+def fly(macros, epics, tmp_path):
+    ns = macros('common.py', 'estimate.py', 'scanpaths.py', 'xrf_utils.py',
+                _getPV=MOTORS.get, sleep=lambda t: None)
+    epics.pv('13XRM:m1.VELO', 1.0)
+    epics.pv('13XRM:m1.VMAX', 5.0)
+    epics.pv('13XRM:m1.ACCL', 0.0)
+    return ns
+
+def detector(epics, positions, nframes, nmca=2):
+    """make Acquire=1 post `nframes` frames: the motor readback and
+    counter, then the spectrum of each MCA"""
+    counter = epics.pv(DET + 'ArrayCounter_RBV')
+    rbv = epics.pv('13XRM:m1.RBV')
+    mcas = [epics.pv('13QX7:MCA%d:ArrayData' % (i+1)) for i in range(nmca)]
+    acquire = epics.pv(DET + 'Acquire')
+    def put(value, **kws):
+        acquire.value = value
+        if value != 1:
+            return
+        for n in range(1, nframes+1):
+            rbv.value = positions[n-1]
+            counter.post(n)
+            for i, mca in enumerate(mcas):
+                mca.post(np.full(4, 10*n + i, dtype='int32'))
+    acquire.put = put
+
+def test_fly_frames_and_positions(fly, epics, tmp_path):
+    plan = fly['line_path']('x', start=0, stop=0.4, step=0.1)
+    step = 0.1
+    # each frame's count arrives half a step past its point
+    detector(epics, plan['points'][:, 0] + 0.5*step, nframes=5)
+    n = fly['_line_xrf_fly'](plan, 0.5, 'fly.npz', nmca=2)
+    assert n == 5
+    out = np.load(tmp_path / 'user' / 'fly.npz')
+    assert out['valid'].all()
+    assert np.allclose(out['positions'], plan['points'][:, 0])
+    assert out['spectra'].shape == (5, 2, 4)
+    assert out['spectra'][2, 1, 0] == 31
+    # velocity is step/time, and restored afterwards
+    assert ('13XRM:m1.VELO', pytest.approx(0.2)) in epics.puts
+    assert epics.caget('13XRM:m1.VELO') == 1.0
+
+def test_fly_abort_keeps_collected_frames(fly, epics, tmp_path):
+    fly['check_scan_abort'] = lambda: True
+    plan = fly['line_path']('x', start=0, stop=0.4, step=0.1)
+    detector(epics, plan['points'][:, 0] + 0.05, nframes=3)
+    assert fly['_line_xrf_fly'](plan, 0.5, 'fly.npz', nmca=2) == 3
+    out = np.load(tmp_path / 'user' / 'fly.npz')
+    assert out['valid'].tolist() == [True, True, True, False, False]
+    assert ('13XRM:m1.STOP', 1) in epics.puts
+
+def test_fly_too_fast(fly, epics, capsys):
+    plan = fly['line_path']('x', start=0, stop=1, step=0.5)
+    assert fly['_line_xrf_fly'](plan, 0.05, 'fly.npz') == 0
+    assert 'too fast' in capsys.readouterr().out